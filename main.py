@@ -19,7 +19,13 @@ from rasterio.warp import calculate_default_transform, reproject, Resampling
 from rasterio.enums import Resampling as RasterioResampling
 import tempfile
 import shutil
+import time
 import csv
+import io
+import json
+import sqlite3
+import hashlib
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Tuple, Optional, List, Dict
 import warnings
@@ -114,12 +120,112 @@ plt.rcParams.update({
 })
 
 # ==== Load YOLO Model ====
-model = YOLO("best.pt")
-  # Update this path
+MODEL_WEIGHTS = "best.pt"  # Update this path
+# Inference backends and the runtime module each one needs
+INFERENCE_BACKENDS = {"pytorch": "torch", "onnx": "onnxruntime", "openvino": "openvino"}
+model = YOLO(MODEL_WEIGHTS)
+inference_backend = "pytorch"  # Backend of the loaded model (see set_inference_backend)
+inference_backend_lock = threading.Lock()  # Held for a whole analysis run; backend swaps wait for it
+
+def available_inference_backends():
+    """Backends whose runtime is installed, PyTorch (always there with Ultralytics) first"""
+    import importlib.util
+    return [name for name, module in INFERENCE_BACKENDS.items()
+            if name == "pytorch" or importlib.util.find_spec(module) is not None]
+
+def backend_model_path(backend, weights=MODEL_WEIGHTS):
+    """Where the weights exported for a backend are cached: next to the PyTorch weights"""
+    stem = os.path.splitext(weights)[0]
+    return {"pytorch": weights, "onnx": f"{stem}.onnx", "openvino": f"{stem}_openvino_model"}[backend]
+
+def load_backend_model(backend, weights=MODEL_WEIGHTS):
+    """
+    YOLO model running on the given backend. The weights are exported once (fp32, 640 px,
+    dynamic batch so batched tile inference works) and exported again only when they are
+    newer than the cached export. Ultralytics returns the same Results objects (boxes,
+    classes, confidences) for every backend, so the analysis code does not change.
+    """
+    path = backend_model_path(backend, weights)
+    if backend != "pytorch" and (not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(weights)):
+        print(f"📦 Exporting {weights} for {backend} (once)...")
+        exported = YOLO(weights).export(format=backend, imgsz=640, dynamic=True, half=False)
+        path = str(exported or path)
+    return YOLO(path, task="detect")
+
+def set_inference_backend(backend, weights=MODEL_WEIGHTS):
+    """
+    Replace the module-level model with one running on backend; later predict calls use it.
+    Waits for a running analysis to finish, so a run never mixes two backends.
+    """
+    global model, inference_backend
+    with inference_backend_lock:
+        if backend != inference_backend:
+            model = load_backend_model(backend, weights)
+            inference_backend = backend
+        return model
+
+def benchmark_inference_backends(backends=None, runs=5, weights=MODEL_WEIGHTS):
+    """
+    Seconds per 640×640 prediction for each backend (median of runs after a warm-up),
+    or the error message of a backend that could not be exported or loaded.
+    Holds inference_backend_lock, so it never overlaps an analysis run: it waits for a
+    running one, and a run started meanwhile waits for the benchmark.
+    """
+    image = np.random.default_rng(0).integers(0, 256, (640, 640, 3), dtype=np.uint8)
+    timings = {}
+    with inference_backend_lock:
+        for backend in backends or available_inference_backends():
+            try:
+                candidate = load_backend_model(backend, weights)
+                candidate.predict(source=image, save=False, imgsz=640, verbose=False)
+                samples = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    candidate.predict(source=image, save=False, imgsz=640, verbose=False)
+                    samples.append(time.perf_counter() - start)
+                timings[backend] = float(np.median(samples))
+            except Exception as e:
+                timings[backend] = str(e)
+    return timings
+
+def pick_inference_backend(weights=MODEL_WEIGHTS):
+    """
+    Fastest available backend for weights as (backend, timings). The benchmark runs
+    once per weights file and set of installed runtimes; later starts reuse the result.
+    """
+    available = available_inference_backends()
+    if len(available) <= 1:
+        return (available[0] if available else "pytorch"), {}
+    
+    key = [os.path.abspath(weights), os.path.getmtime(weights), available]
+    cache_path = Path(CACHE_DIR) / "inference_backend.json"
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            return cached['backend'], cached['timings']
+    except Exception:
+        pass
+    
+    timings = benchmark_inference_backends(available, weights=weights)
+    usable = {backend: seconds for backend, seconds in timings.items() if isinstance(seconds, float)}
+    backend = min(usable, key=usable.get) if usable else "pytorch"
+    try:
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'backend': backend, 'timings': timings}, f, indent=2)
+    except Exception as e:
+        print(f"⚠️ Could not cache backend benchmark: {e}")
+    return backend, timings
 
 # ==== Constants ====
 colors = {0: (255, 0, 255), 1: (0, 165, 255)}
 class_names = {0: 'Residential', 1: 'Non-Residential'}
+# House categories in the order of their population multiplier (1x, 2x, 3x)
+HOUSE_CATEGORIES = ("Standard", "Medium", "Large", "Non-Residential")
+# Height above ground (m) below which a pixel or detection is not counted as a building
+MIN_BUILDING_HEIGHT = 2.5
+# Typical compressed/raw size of 8/16-bit imagery tiles, used by the dry-run planner
+TILE_COMPRESSION_RATIOS = {"lzw": 0.7, "deflate": 0.6, "zstd": 0.55, "none": 1.0}
 
 class ScrollableFrame:
     """A scrollable frame that can contain other widgets"""
@@ -178,6 +284,387 @@ class ScrollableFrame:
     def grid(self, **kwargs):
         self.main_frame.grid(**kwargs)
 
+class HeightDataReader:
+    """Keeps the DSM/DTM rasters (and the optical raster streamed tiles are cut from)
+    open for a whole analysis run.
+    
+    rasterio datasets must not be shared between threads, so each thread gets its
+    own handles, opened on first use and reused for every later tile. Height
+    extraction and streamed tile reads then cost only the window reads, and GDAL's
+    block cache stays warm across neighbouring tiles.
+    """
+    def __init__(self, dhm_path, dtm_path, ndsm_path=None, optical_path=None):
+        self.paths = {'dhm': dhm_path, 'dtm': dtm_path, 'ndsm': ndsm_path, 'optical': optical_path}
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+    
+    def dataset(self, name):
+        """Open dataset for 'dhm', 'dtm', 'ndsm' or 'optical' owned by the calling thread"""
+        handles = getattr(self._local, 'handles', None)
+        if handles is None:
+            handles = self._local.handles = {}
+        src = handles.get(name)
+        if src is None:
+            src = rasterio.open(self.paths[name])
+            handles[name] = src
+            with self._lock:
+                self._opened.append(src)
+        return src
+    
+    def close(self):
+        """Close the handles of all threads; call once the run's workers are finished"""
+        with self._lock:
+            for src in self._opened:
+                try:
+                    src.close()
+                except Exception:
+                    pass
+            self._opened = []
+        self._local = threading.local()
+
+class DetectionStore:
+    """Columnar store for building detections.
+    
+    Every field is one NumPy array with a row per building, instead of a dict per
+    building. Tiles append their detection columns as they finish; tile paths are
+    dictionary-encoded as an index into tile_paths. Per-building dicts are only
+    built by records(), for export.
+    """
+    FIELDS = {
+        'tile_index': np.int32, 'tile_row': np.int32, 'tile_col': np.int32,
+        'detection_id': np.int32,
+        'pixel_x': np.float32, 'pixel_y': np.float32,
+        'world_x': np.float64, 'world_y': np.float64,
+        'width_px': np.float32, 'height_px': np.float32,
+        'area_sqm': np.float64, 'confidence': np.float32,
+        'class_id': np.int16, 'category_code': np.int8,
+        'population_multiplier': np.int8, 'base_population': np.float64,
+        'floors': np.int16, 'final_population': np.float64,
+        'bbox': np.float32
+    }
+    
+    def __init__(self, world_na="N/A"):
+        self.world_na = world_na  # Shown instead of world coordinates where there are none
+        self.tile_paths = []
+        self._tile_ids = {}
+        self._chunks = []
+        self._size = 0
+    
+    def __len__(self):
+        return self._size
+    
+    def append(self, detections):
+        """Add the detection columns of one tile or image (as built by _detections_from_result)"""
+        n = len(detections['class_id'])
+        if n == 0:
+            return
+        
+        tile_path = detections.get('tile_path')
+        tile_index = -1
+        if tile_path is not None:
+            tile_index = self._tile_ids.get(tile_path)
+            if tile_index is None:
+                tile_index = self._tile_ids[tile_path] = len(self.tile_paths)
+                self.tile_paths.append(tile_path)
+        
+        chunk = {}
+        for name, dtype in self.FIELDS.items():
+            if name == 'tile_index':
+                chunk[name] = np.full(n, tile_index, dtype=dtype)
+            elif name in ('tile_row', 'tile_col'):
+                value = detections.get(name)
+                chunk[name] = np.full(n, -1 if value is None else value, dtype=dtype)
+            else:
+                chunk[name] = np.asarray(detections[name], dtype=dtype)
+        self._chunks.append(chunk)
+        self._size += n
+    
+    def column(self, name):
+        """One field as an array; 'house_category' and 'class_name' are decoded to strings"""
+        if name == 'house_category':
+            return np.array(HOUSE_CATEGORIES, dtype=object)[self.column('category_code')]
+        if name == 'class_name':
+            return np.array([class_names.get(c, 'Unknown') for c in self.column('class_id').tolist()], dtype=object)
+        
+        if len(self._chunks) != 1:
+            # Merge the appended chunks once; later reads reuse the merged arrays
+            if self._chunks:
+                merged = {key: np.concatenate([chunk[key] for chunk in self._chunks]) for key in self.FIELDS}
+            else:
+                merged = {key: np.empty((0, 4) if key == 'bbox' else 0, dtype=dtype)
+                          for key, dtype in self.FIELDS.items()}
+            self._chunks = [merged]
+        return self._chunks[0][name]
+    
+    def select(self, mask):
+        """New store with the rows where mask is True"""
+        subset = DetectionStore(self.world_na)
+        subset.tile_paths, subset._tile_ids = self.tile_paths, self._tile_ids
+        subset._chunks = [{name: self.column(name)[mask] for name in self.FIELDS}]
+        subset._size = len(subset._chunks[0]['class_id'])
+        return subset
+    
+    def residential(self):
+        """Residential buildings only"""
+        return self.select(self.column('class_id') == 0)
+    
+    def for_tile(self, tile_path):
+        """Detections of one tile"""
+        tile_index = self._tile_ids.get(tile_path, -2)
+        return self.select(self.column('tile_index') == tile_index)
+    
+    def to_dataframe(self):
+        """pandas DataFrame with one column per field (bbox excluded)"""
+        data = {name: self.column(name) for name in self.FIELDS if name not in ('bbox', 'category_code')}
+        data['class_name'] = self.column('class_name')
+        data['house_category'] = self.column('house_category')
+        return pd.DataFrame(data)
+    
+    def records(self):
+        """Yield one dict per building, in the field layout used by the CSV exports"""
+        columns = {name: self.column(name).tolist() for name in self.FIELDS}
+        world_ok = (~(np.isnan(self.column('world_x')) | np.isnan(self.column('world_y')))).tolist()
+        categories = self.column('house_category').tolist()
+        
+        for i in range(self._size):
+            building = {}
+            # Tile fields only exist for tiled analyses
+            tile_index = columns['tile_index'][i]
+            if tile_index >= 0:
+                building['tile_path'] = self.tile_paths[tile_index]
+                building['tile_row'] = columns['tile_row'][i]
+                building['tile_col'] = columns['tile_col'][i]
+            class_id = columns['class_id'][i]
+            building.update({
+                'detection_id': columns['detection_id'][i],
+                'pixel_x': columns['pixel_x'][i],
+                'pixel_y': columns['pixel_y'][i],
+                'world_x': columns['world_x'][i] if world_ok[i] else self.world_na,
+                'world_y': columns['world_y'][i] if world_ok[i] else self.world_na,
+                'width_px': columns['width_px'][i],
+                'height_px': columns['height_px'][i],
+                'area_sqm': columns['area_sqm'][i],
+                'confidence': columns['confidence'][i],
+                'class_id': class_id,
+                'class_name': class_names.get(class_id, 'Unknown'),
+                'house_category': categories[i],
+                'population_multiplier': columns['population_multiplier'][i],
+                'base_population': columns['base_population'][i],
+                'floors': columns['floors'][i],
+                'final_population': columns['final_population'][i],
+                'bbox': columns['bbox'][i]
+            })
+            yield building
+
+class TileManifest:
+    """SQLite manifest of the tiles of one scene, stored next to the tiles.
+    
+    One row per tile with its georeferencing (bounds, transform, CRS, shape, GSD),
+    a hash of its pixels and its processing status, so a tile set outlives the GUI
+    session and other tools can query it with plain SQL. Scene-level settings
+    (source image, tile area, aligned inputs) live in a key/value table. The
+    detections of finished tiles are checkpointed in a results table, written in
+    the same transaction as the tile's status, so an interrupted run can resume.
+    Every call opens its own connection, so the manifest can be used from any thread.
+    """
+    FILENAME = "tile_manifest.sqlite"
+    COLUMNS = ('tile_id', 'path', 'row', 'col', 'minx', 'miny', 'maxx', 'maxy', 'transform', 'crs',
+               'height', 'width', 'gsd', 'area_sqm', 'requested_area_sqm', 'content_hash',
+               'status', 'detail', 'updated')
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tiles (
+            tile_id TEXT PRIMARY KEY, path TEXT, row INTEGER, col INTEGER,
+            minx REAL, miny REAL, maxx REAL, maxy REAL, transform TEXT, crs TEXT,
+            height INTEGER, width INTEGER, gsd REAL, area_sqm REAL, requested_area_sqm REAL,
+            content_hash TEXT, status TEXT NOT NULL DEFAULT 'pending', detail TEXT, updated TEXT
+        );
+        CREATE INDEX IF NOT EXISTS tiles_status ON tiles (status);
+        CREATE TABLE IF NOT EXISTS scene (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS results (tile_id TEXT PRIMARY KEY, detections BLOB);
+    """
+    
+    def __init__(self, path, flush_every=4, flush_seconds=1.0):
+        self.path = path
+        # Small batches: a crash loses at most a few tiles' results, a commit costs ~1 ms
+        self.flush_every = flush_every  # Outcomes buffered before they are written...
+        self.flush_seconds = flush_seconds  # ...or seconds since the last write, whichever comes first
+        self._staged = {}
+        self._outcomes = []
+        self._results = []
+        self._last_flush = time.monotonic()
+        self._crs_cache = {}
+        with self._connect() as con:
+            # WAL lets other tools read the manifest while a run is writing to it
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(self.SCHEMA)
+    
+    @staticmethod
+    def tile_key(tile_metadata):
+        """Manifest key of a tile: its grid id, or the file name for tiles without one"""
+        return tile_metadata.get('tile_id') or os.path.basename(tile_metadata['path'])
+    
+    @contextmanager
+    def _connect(self):
+        con = sqlite3.connect(self.path, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+    
+    def _row(self, tile_metadata, status, detail=None):
+        transform = tile_metadata.get('transform')
+        crs = tile_metadata.get('crs')
+        minx, miny, maxx, maxy = tile_metadata.get('bounds') or (None, None, None, None)
+        height, width = tile_metadata.get('shape') or (None, None)
+        gsd = tile_metadata.get('gsd')
+        if gsd is None and transform is not None:
+            gsd = (abs(transform.a) + abs(transform.e)) / 2.0
+        return (self.tile_key(tile_metadata), tile_metadata.get('path'),
+                tile_metadata.get('row'), tile_metadata.get('col'), minx, miny, maxx, maxy,
+                json.dumps(list(transform)[:6]) if transform is not None else None,
+                rasterio.crs.CRS.from_user_input(crs).to_string() if crs else None,
+                height, width, gsd, tile_metadata.get('area_sqm'), tile_metadata.get('requested_area_sqm'),
+                tile_metadata.get('content_hash'), status, detail, datetime.now().isoformat(timespec='seconds'))
+    
+    def replace_tiles(self, tiles, scene):
+        """Start a new tile set: all tiles as 'pending', plus the scene settings"""
+        placeholders = ", ".join("?" * len(self.COLUMNS))
+        with self._connect() as con:
+            con.execute("DELETE FROM tiles")
+            con.execute("DELETE FROM scene")
+            con.executemany(f"INSERT INTO tiles ({', '.join(self.COLUMNS)}) VALUES ({placeholders})",
+                            (self._row(tile_metadata, 'pending') for tile_metadata in tiles))
+            con.executemany("INSERT INTO scene (key, value) VALUES (?, ?)",
+                            ((key, json.dumps(value, default=str)) for key, value in scene.items()))
+    
+    def scene(self):
+        """Scene settings stored with the tile set"""
+        with self._connect() as con:
+            return {key: json.loads(value) for key, value in con.execute("SELECT key, value FROM scene")}
+    
+    def load_tiles(self, status=None):
+        """Tile metadata dicts (as produced by tiling), in tiling order, optionally of one status"""
+        query = f"SELECT {', '.join(self.COLUMNS)} FROM tiles"
+        args = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            args = (status,)
+        with self._connect() as con:
+            rows = con.execute(query + " ORDER BY rowid", args).fetchall()
+        
+        tiles = []
+        for row in rows:
+            values = dict(zip(self.COLUMNS, row))
+            crs = self._crs_cache.get(values['crs'])
+            if crs is None and values['crs']:
+                crs = self._crs_cache[values['crs']] = rasterio.crs.CRS.from_user_input(values['crs'])
+            bounds = (values['minx'], values['miny'], values['maxx'], values['maxy'])
+            tiles.append({
+                "path": values['path'],
+                "tile_id": values['tile_id'],
+                "row": values['row'],
+                "col": values['col'],
+                "geographic_bounds": bounds,
+                "bounds": bounds,
+                "transform": rasterio.Affine(*json.loads(values['transform'])) if values['transform'] else None,
+                "crs": crs,
+                "shape": (values['height'], values['width']),
+                "gsd": values['gsd'],
+                "area_sqm": values['area_sqm'],
+                "requested_area_sqm": values['requested_area_sqm'],
+                "content_hash": values['content_hash'],
+                "status": values['status']
+            })
+        return tiles
+    
+    def status_counts(self):
+        """Number of tiles per status"""
+        with self._connect() as con:
+            return dict(con.execute("SELECT status, COUNT(*) FROM tiles GROUP BY status"))
+    
+    def start_run(self, settings, resume=False):
+        """
+        Prepare for an analysis run with the given (JSON-able) result-affecting settings.
+        With resume, the finished tiles of the previous run are kept if it used the same
+        settings; otherwise every tile goes back to 'pending' and stored results are dropped.
+        Returns True if the previous run is resumed.
+        """
+        settings = json.loads(json.dumps(settings, default=str))
+        with self._connect() as con:
+            row = con.execute("SELECT value FROM scene WHERE key = 'run_settings'").fetchone()
+            if resume and row is not None and json.loads(row[0]) == settings:
+                return True
+            con.execute("DELETE FROM results")
+            con.execute("UPDATE tiles SET status = 'pending', detail = NULL")
+            con.execute("INSERT OR REPLACE INTO scene (key, value) VALUES ('run_settings', ?)",
+                        (json.dumps(settings),))
+        return False
+    
+    def finished_keys(self):
+        """Keys of the tiles done or skipped so far"""
+        with self._connect() as con:
+            return {key for key, in con.execute("SELECT tile_id FROM tiles WHERE status IN ('done', 'skipped')")}
+    
+    def finished_tiles(self):
+        """Yield (tile_id, path, row, col, status, detail, detections) of tiles done or skipped so far"""
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT tiles.tile_id, path, row, col, status, detail, results.detections FROM tiles "
+                "LEFT JOIN results ON results.tile_id = tiles.tile_id "
+                "WHERE status IN ('done', 'skipped') ORDER BY tiles.rowid").fetchall()
+        for tile_id, path, row, col, status, detail, blob in rows:
+            detections = None
+            if blob is not None:
+                with np.load(io.BytesIO(blob)) as arrays:
+                    detections = {name: arrays[name] for name in arrays.files}
+            yield tile_id, path, row, col, status, detail, detections
+    
+    def stage(self, tile_metadata):
+        """Remember a tile handed to analysis, so streamed tiles get a row once they finish"""
+        self._staged[self.tile_key(tile_metadata)] = tile_metadata
+    
+    def record(self, key, status, detail=None, detections=None, tile_info=None):
+        """
+        Processing outcome of a staged tile ('done', 'failed' or 'skipped'), with the
+        detection columns of done tiles (None if there were none); written in batches.
+        tile_info holds metadata filled in where the tile was read (content hash, path)
+        when that happened in another process.
+        """
+        tile_metadata = self._staged.pop(key, None)
+        if tile_metadata is None:
+            return
+        if tile_info:
+            tile_metadata = dict(tile_metadata, **{name: value for name, value in tile_info.items() if value is not None})
+        self._outcomes.append(self._row(tile_metadata, status, detail))
+        if status == 'done':
+            blob = None
+            if detections is not None:
+                buffer = io.BytesIO()
+                np.savez(buffer, **{name: value for name, value in detections.items() if isinstance(value, np.ndarray)})
+                blob = buffer.getvalue()
+            self._results.append((key, blob))
+        if len(self._outcomes) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+    
+    def flush(self):
+        """Write buffered outcomes, inserting rows for tiles the manifest does not have yet"""
+        self._last_flush = time.monotonic()
+        if not self._outcomes:
+            return
+        outcomes, self._outcomes = self._outcomes, []
+        results, self._results = self._results, []
+        placeholders = ", ".join("?" * len(self.COLUMNS))
+        with self._connect() as con:
+            con.executemany("INSERT OR REPLACE INTO results (tile_id, detections) VALUES (?, ?)", results)
+            con.executemany(
+                f"INSERT INTO tiles ({', '.join(self.COLUMNS)}) VALUES ({placeholders}) "
+                "ON CONFLICT(tile_id) DO UPDATE SET status = excluded.status, detail = excluded.detail, "
+                "updated = excluded.updated, path = COALESCE(excluded.path, tiles.path), "
+                "content_hash = COALESCE(excluded.content_hash, tiles.content_hash)",
+                outcomes)
+
 class BuildingCountPopulationEstimator:
     def __init__(self, root):
         self.root = root
@@ -190,6 +677,14 @@ class BuildingCountPopulationEstimator:
         
         # Tile area configuration for TIF processing
         self.tile_area_sqm = tk.DoubleVar(value=10000.0)  # Default 10,000 m² (100m x 100m)
+        self.snap_tiles_to_blocks = tk.BooleanVar(value=False)  # Tile side = whole GeoTIFF blocks
+        self.tile_compression = tk.StringVar(value="lzw")  # Codec of written tile GeoTIFFs
+        self.stream_tiles = tk.BooleanVar(value=False)  # Cut tiles in memory during analysis
+        self.save_streamed_tiles = tk.BooleanVar(value=False)  # Also write streamed tiles as GeoTIFF
+        self.alignment_mode = tk.StringVar(value="resample")  # "resample" to finest GSD or keep "native" resolution
+        self.materialize_aligned = tk.BooleanVar(value=False)  # Write aligned GeoTIFFs instead of warped VRTs
+        self.reproject_threads = tk.IntVar(value=max(1, min(8, os.cpu_count() or 2)))  # Threads warping output chunks
+        self.reproject_mem_mb = tk.IntVar(value=1024)  # Memory budget (MB) of a materialised reprojection
         
         # Area multiplier thresholds
         self.medium_house_threshold = tk.DoubleVar(value=150.0)  # 1.5x standard = 2x multiplier
@@ -197,13 +692,36 @@ class BuildingCountPopulationEstimator:
         
         # Floor calculation parameters
         self.floor_height = tk.DoubleVar(value=3.0)  # Average floor height in meters
+        
+        # Inference parameters
+        self.inference_batch_size = tk.IntVar(value=0)  # Tiles per YOLO call (0 = auto from free RAM)
+        self.reader_threads = tk.IntVar(value=2)  # Threads reading/preparing tiles ahead of YOLO
+        self.postprocess_threads = tk.IntVar(value=2)  # Threads turning detections into floors/population
+        self.use_process_pool = tk.BooleanVar(value=False)  # Analyze tiles in worker processes
+        self.process_workers = tk.IntVar(value=max(1, min(8, (os.cpu_count() or 2) // 2)))  # Worker processes, one model each
+        self.torch_threads_per_worker = tk.IntVar(value=2)  # Torch intra-op threads per worker process
+        self.resume_analysis = tk.BooleanVar(value=False)  # Continue the last run from its checkpoint
+        self.inference_backend_choice = tk.StringVar(value="auto")  # pytorch/onnx/openvino, or "auto" = fastest
         self.use_height_calculation = tk.BooleanVar(value=False)  # Enable/disable height-based floors
+        self.use_ndsm = tk.BooleanVar(value=True)  # Precompute DSM - DTM once per scene
+        self.use_height_gate = tk.BooleanVar(value=False)  # Skip tiles with no elevated structures
+        self.min_elevated_fraction = tk.DoubleVar(value=0.005)  # Share of pixels above MIN_BUILDING_HEIGHT
+        
+        # Spectral masking parameters
+        self.use_spectral_mask = tk.BooleanVar(value=False)  # Mask vegetation/water before YOLO
+        self.vari_threshold = tk.DoubleVar(value=0.1)  # VARI above this = vegetation
+        self.ndwi_threshold = tk.DoubleVar(value=0.2)  # NDWI above this = water (needs NIR band)
+        self.nir_band = tk.StringVar(value="auto")  # 1-based NIR band, or "auto" = from band descriptions
+        self.min_unmasked_fraction = tk.DoubleVar(value=0.05)  # Skip YOLO below this unmasked share
         
         # File handling
         self.file_path = None
         self.dhm_path = None
         self.dtm_path = None
+        self.height_reader = None  # Run-scoped HeightDataReader while tiles are analyzed
+        self.ndsm_path = None  # Cached height-above-ground raster used by the current run
         self.tiles_save_path = None
+        self.scene_stretch = None  # Per-band percentile stretch of the current scene
         self.is_tif_file = False
         self.tiles_generated = False
         self.height_data_aligned = False
@@ -216,10 +734,15 @@ class BuildingCountPopulationEstimator:
         
         # **NEW**: Coordinate-aware tile processing
         self.tile_metadata_list = []  # Store tile metadata with coordinates
+        self.aligned_paths = {}  # label -> aligned raster path from the last tile generation
+        self.tile_plan = None  # Grid/footprint tile counts of the last tile plan
+        self.tile_plan_cache = {}  # Tile plans by source, grid, tile area and snap (see _plan_area_tiles)
+        self.tile_plan_cache_lock = threading.Lock()
+        self.last_throughput = None  # Analysis speed of the last run, for dry-run estimates
         
         # Analysis results storage
         self.analysis_results = None
-        self.building_data = []
+        self.building_data = DetectionStore()
         self.last_annotated_path = None
         self._annotated_generation = 0
         # UI State
@@ -228,6 +751,8 @@ class BuildingCountPopulationEstimator:
         
         self.setup_window()
         self.create_widgets()
+        # Benchmark/load the inference backend once the window is up
+        self.root.after(1000, self.apply_inference_backend)
 
     def setup_window(self):
         """Setup main window with responsive design"""
@@ -504,6 +1029,24 @@ class BuildingCountPopulationEstimator:
                                          font=('Arial', 10), width=10, relief=tk.SOLID, bd=1)
         self.floor_height_entry.pack(anchor="w", pady=(5, 0))
         
+        # nDSM precomputation
+        tk.Checkbutton(self.height_calc_frame, text="Precompute nDSM (DSM − DTM) raster once per scene",
+                      variable=self.use_ndsm, bg="white",
+                      font=('Arial', 10), fg="#2c3e50").pack(anchor="w")
+        
+        # Height gate: skip tiles where almost nothing stands above ground
+        height_gate_frame = tk.Frame(self.height_calc_frame, bg="white")
+        height_gate_frame.pack(fill="x", pady=(5, 0))
+        
+        tk.Checkbutton(height_gate_frame, text=f"Skip tiles with no structures above {MIN_BUILDING_HEIGHT} m",
+                      variable=self.use_height_gate, bg="white",
+                      font=('Arial', 10), fg="#2c3e50").pack(side="left")
+        
+        tk.Label(height_gate_frame, text="Min. elevated fraction:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left", padx=(10, 0))
+        tk.Entry(height_gate_frame, textvariable=self.min_elevated_fraction, font=('Arial', 10),
+                width=6, relief=tk.SOLID, bd=1).pack(side="left", padx=(5, 0))
+        
         # Alignment status
         self.alignment_status = tk.Label(self.height_calc_frame, text="",
                                        bg="white", font=('Arial', 10))
@@ -795,14 +1338,20 @@ class BuildingCountPopulationEstimator:
             tile_shape = tile_metadata['shape']
             tile_crs = tile_metadata['crs']
             
+            # Reuse the run's open datasets when available
+            reader = self.height_reader
+            dsm_path, dtm_path = self._height_source_paths()
+            
             # Extract and align DHM data
             dhm_data = self._extract_aligned_height_data(
-                self.dhm_path, tile_bounds, tile_transform, tile_shape, tile_crs
+                dsm_path, tile_bounds, tile_transform, tile_shape, tile_crs,
+                reader.dataset('dhm') if reader else None
             )
             
             # Extract and align DTM data
             dtm_data = self._extract_aligned_height_data(
-                self.dtm_path, tile_bounds, tile_transform, tile_shape, tile_crs
+                dtm_path, tile_bounds, tile_transform, tile_shape, tile_crs,
+                reader.dataset('dtm') if reader else None
             )
             
             return dhm_data, dtm_data, tile_transform
@@ -811,57 +1360,208 @@ class BuildingCountPopulationEstimator:
             print(f"Error extracting height data for tile: {e}")
             return None, None, None
 
+    def extract_ndsm_for_tile(self, tile_metadata):
+        """Extract height above ground for a specific tile from the precomputed nDSM"""
+        try:
+            reader = self.height_reader
+            ndsm_data = self._extract_aligned_height_data(
+                self.ndsm_path, tile_metadata['bounds'], tile_metadata['transform'],
+                tile_metadata['shape'], tile_metadata['crs'],
+                reader.dataset('ndsm') if reader else None
+            )
+            return ndsm_data, tile_metadata['transform']
+            
+        except Exception as e:
+            print(f"Error extracting nDSM data for tile: {e}")
+            return None, None
+
+    def _elevated_fraction_for_tile(self, tile_metadata, decimation=4):
+        """
+        Share of the tile's valid height pixels above MIN_BUILDING_HEIGHT, from a read
+        decimated by `decimation` in each direction (nDSM if precomputed, else DSM − DTM).
+        Returns None when no height data covers the tile.
+        """
+        rows, cols = tile_metadata['shape']
+        out_shape = (max(1, rows // decimation), max(1, cols // decimation))
+        
+        def read_decimated(name, path):
+            if self.height_reader is not None:
+                return read_from(self.height_reader.dataset(name))
+            with rasterio.open(path) as src:
+                return read_from(src)
+        
+        def read_from(src):
+            bounds = tile_metadata['bounds']
+            if src.crs != tile_metadata['crs']:
+                bounds = rasterio.warp.transform_bounds(tile_metadata['crs'], src.crs, *bounds)
+            window = from_bounds(*bounds, src.transform)
+            data = src.read(1, window=window, out_shape=out_shape, boundless=True, masked=True)
+            return np.ma.filled(data.astype(np.float32), np.nan)
+        
+        if self.ndsm_path:
+            height_above_ground = read_decimated('ndsm', self.ndsm_path)
+        else:
+            dsm_path, dtm_path = self._height_source_paths()
+            height_above_ground = read_decimated('dhm', dsm_path) - read_decimated('dtm', dtm_path)
+        
+        valid = np.isfinite(height_above_ground)
+        if not valid.any():
+            return None
+        return float((height_above_ground[valid] >= MIN_BUILDING_HEIGHT).sum() / valid.sum())
+
+    def _build_ndsm_raster(self, grid_path, dsm_path, dtm_path, out_dir):
+        """
+        Build a float32 height-above-ground raster (DSM − DTM) on the pixel grid of grid_path,
+        block by block so neither input is ever fully in memory. The file name is keyed on the
+        inputs and the grid, so later runs (other floor heights, thresholds) reuse it.
+        Returns the nDSM path.
+        """
+        from rasterio.vrt import WarpedVRT
+        
+        with rasterio.open(grid_path) as grid:
+            grid_crs, grid_transform = grid.crs, grid.transform
+            width, height = grid.width, grid.height
+        
+        key_source = {
+            'grid': [str(grid_crs), list(grid_transform)[:6], width, height],
+            'inputs': [[os.path.abspath(p), os.path.getsize(p), os.path.getmtime(p)] for p in (dsm_path, dtm_path)]
+        }
+        key = hashlib.sha1(json.dumps(key_source, sort_keys=True).encode()).hexdigest()[:12]
+        ndsm_path = os.path.join(out_dir, f"ndsm_{key}.tif")
+        if os.path.exists(ndsm_path):
+            print(f"♻️ Reusing cached nDSM: {ndsm_path}")
+            return ndsm_path
+        
+        print(f"🏗️ Building nDSM raster: {ndsm_path}")
+        os.makedirs(out_dir, exist_ok=True)
+        profile = {
+            'driver': 'GTiff', 'width': width, 'height': height, 'count': 1,
+            'dtype': 'float32', 'crs': grid_crs, 'transform': grid_transform, 'nodata': np.nan,
+            'tiled': True, 'blockxsize': 256, 'blockysize': 256,
+            'compress': 'lzw', 'predictor': 3, 'BIGTIFF': 'IF_SAFER'
+        }
+        
+        def on_grid(src):
+            # Inputs already resampled to the grid are read directly, others through a warped view
+            if src.crs == grid_crs and src.transform == grid_transform and (src.width, src.height) == (width, height):
+                return src
+            return WarpedVRT(src, crs=grid_crs, transform=grid_transform, width=width, height=height,
+                             resampling=Resampling.bilinear)
+        
+        # Written under a temporary name so an interrupted build is never picked up as cached
+        part_path = ndsm_path + ".part"
+        with rasterio.open(dsm_path) as dsm_src, rasterio.open(dtm_path) as dtm_src:
+            dsm_grid, dtm_grid = on_grid(dsm_src), on_grid(dtm_src)
+            try:
+                with rasterio.open(part_path, 'w', **profile) as dst:
+                    for _, window in dst.block_windows(1):
+                        dsm = dsm_grid.read(1, window=window, masked=True).astype(np.float32).filled(np.nan)
+                        dtm = dtm_grid.read(1, window=window, masked=True).astype(np.float32).filled(np.nan)
+                        
+                        # Same validity rules as the per-tile DSM/DTM floor calculation
+                        valid = ~np.isnan(dsm) & ~np.isnan(dtm)
+                        valid &= (dsm > -1000) & (dsm < 10000) & (dtm > -1000) & (dtm < 10000)
+                        dst.write(np.where(valid, dsm - dtm, np.nan).astype(np.float32), 1, window=window)
+            finally:
+                for vrt, src in ((dsm_grid, dsm_src), (dtm_grid, dtm_src)):
+                    if vrt is not src:
+                        vrt.close()
+        
+        os.replace(part_path, ndsm_path)
+        print(f"✅ nDSM raster ready")
+        return ndsm_path
+
+    def _height_source_paths(self):
+        """(DSM, DTM) paths for height reads: the aligned rasters from tile generation if any, else the inputs"""
+        return (self.aligned_paths.get("dsm") or self.dhm_path,
+                self.aligned_paths.get("dtm") or self.dtm_path)
+
+    def _prepare_ndsm_for_run(self):
+        """Return the nDSM path for this run, building it if needed, or None to use DSM/DTM per tile"""
+        grid_path = self.aligned_paths.get("optical")
+        if not grid_path:
+            return None
+        
+        # Prefer the inputs already aligned during tile generation
+        dsm_path, dtm_path = self._height_source_paths()
+        if not (dsm_path and dtm_path):
+            return None
+        if self.alignment_mode.get() == "native":
+            # Keep height above ground at the DSM's own resolution, not the imagery's
+            grid_path = dsm_path
+        
+        out_dir = os.path.join(self.tiles_save_path, "_resampled") if self.tiles_save_path else os.path.dirname(grid_path)
+        try:
+            return self._build_ndsm_raster(grid_path, dsm_path, dtm_path, out_dir)
+        except Exception as e:
+            print(f"⚠️ nDSM build failed, using DSM/DTM per tile: {e}")
+            return None
+
     # **NEW**: Helper method for height data extraction and alignment
-    def _extract_aligned_height_data(self, height_file_path, tile_bounds, tile_transform, tile_shape, tile_crs):
-        """Extract and align height data to tile coordinate system"""
+    def _extract_aligned_height_data(self, height_file_path, tile_bounds, tile_transform, tile_shape, tile_crs, height_src=None):
+        """Extract and align height data to tile coordinate system (from height_src if already open)"""
         try:
-            with rasterio.open(height_file_path) as height_src:
-                # Get window covering the tile bounds
-                try:
-                    height_window = from_bounds(*tile_bounds, height_src.transform)
-                    height_data = height_src.read(1, window=height_window)
-                except Exception:
-                    # Fallback: read entire height data and crop
-                    height_data = height_src.read(1)
-                    height_window = None
-                
-                # Check if reprojection is needed
-                if height_src.crs != tile_crs:
-                    print(f"Reprojecting height data from {height_src.crs} to {tile_crs}")
-                    
-                    # Create output array
-                    aligned_data = np.empty(tile_shape, dtype=np.float32)
-                    
-                    # Reproject height data to tile coordinate system
-                    rasterio.warp.reproject(
-                        source=height_data,
-                        destination=aligned_data,
-                        src_transform=height_src.window_transform(height_window) if height_window else height_src.transform,
-                        src_crs=height_src.crs,
-                        dst_transform=tile_transform,
-                        dst_crs=tile_crs,
-                        resampling=rasterio.warp.Resampling.bilinear
-                    )
-                    
-                    return aligned_data
-                else:
-                    # Same CRS, just resize if needed
-                    if height_data.shape != tile_shape:
-                        from scipy.ndimage import zoom
-                        zoom_factors = (tile_shape[0] / height_data.shape[0], 
-                                      tile_shape[1] / height_data.shape[1])
-                        height_data = zoom(height_data, zoom_factors, order=1)
-                    
-                    return height_data.astype(np.float32)
+            if height_src is None:
+                with rasterio.open(height_file_path) as src:
+                    return self._read_aligned_height_window(src, tile_bounds, tile_transform, tile_shape, tile_crs)
+            return self._read_aligned_height_window(height_src, tile_bounds, tile_transform, tile_shape, tile_crs)
                     
         except Exception as e:
             print(f"Error processing height data: {e}")
             # Return zeros as fallback
             return np.zeros(tile_shape, dtype=np.float32)
 
+    def _read_aligned_height_window(self, height_src, tile_bounds, tile_transform, tile_shape, tile_crs):
+        """Read the tile's window from an open height dataset, reprojected or resized to the tile grid"""
+        # Get window covering the tile bounds
+        try:
+            height_window = from_bounds(*tile_bounds, height_src.transform)
+            height_data = height_src.read(1, window=height_window)
+        except Exception:
+            # Fallback: read entire height data and crop
+            height_data = height_src.read(1)
+            height_window = None
+        
+        # Check if reprojection is needed
+        if height_src.crs != tile_crs:
+            print(f"Reprojecting height data from {height_src.crs} to {tile_crs}")
+            
+            # Create output array
+            aligned_data = np.empty(tile_shape, dtype=np.float32)
+            
+            # Reproject height data to tile coordinate system
+            rasterio.warp.reproject(
+                source=height_data,
+                destination=aligned_data,
+                src_transform=height_src.window_transform(height_window) if height_window else height_src.transform,
+                src_crs=height_src.crs,
+                dst_transform=tile_transform,
+                dst_crs=tile_crs,
+                resampling=rasterio.warp.Resampling.bilinear
+            )
+            
+            return aligned_data
+        else:
+            # Same CRS: let GDAL resample the raster's own pixels onto the tile grid
+            if height_window is not None:
+                try:
+                    return height_src.read(1, window=height_window, out_shape=tuple(tile_shape),
+                                           resampling=Resampling.bilinear).astype(np.float32)
+                except Exception:
+                    pass
+            if height_data.shape != tile_shape:
+                from scipy.ndimage import zoom
+                zoom_factors = (tile_shape[0] / height_data.shape[0], 
+                              tile_shape[1] / height_data.shape[1])
+                height_data = zoom(height_data, zoom_factors, order=1)
+            
+            return height_data.astype(np.float32)
+
     # **NEW**: Coordinate-aware building floor calculation
-    def calculate_building_floors_from_tile_data(self, x_center, y_center, dhm_data, dtm_data, transform):
+    def calculate_building_floors_from_tile_data(self, x_center, y_center, dhm_data, dtm_data, transform, floor_height=None):
         """Calculate building floors using tile-specific height data and coordinates"""
+        if floor_height is None:
+            floor_height = self.floor_height.get()
         try:
             # Ensure coordinates are within bounds
             height, width = dhm_data.shape
@@ -896,11 +1596,11 @@ class BuildingCountPopulationEstimator:
             building_height = dhm_height - dtm_height
             
             # Validate building height
-            if building_height < 2.5:  # Minimum building height
+            if building_height < MIN_BUILDING_HEIGHT:
                 return 1
             
             # Calculate floors
-            estimated_floors = max(1, round(building_height / self.floor_height.get()))
+            estimated_floors = max(1, round(building_height / floor_height))
             
             # Cap maximum floors (reasonable limit)
             estimated_floors = min(estimated_floors, 50)
@@ -913,7 +1613,53 @@ class BuildingCountPopulationEstimator:
             print(f"Error calculating floors: {e}")
             return 1  # Default fallback
 
+    def calculate_building_floors_vectorized(self, x_centers, y_centers, surface_data, terrain_data=None, floor_height=None):
+        """
+        Zonal height statistics for all detections of a tile in one pass.
+        Each detection is sampled over the same clipped window around its centre as
+        calculate_building_floors_from_tile_data; the windows are gathered into one
+        (n, k, k) stack and reduced with nanmedian. With terrain_data None,
+        surface_data is taken to be height above ground (nDSM).
+        Returns (building heights, floors) as arrays; heights are NaN where no valid data.
+        """
+        if floor_height is None:
+            floor_height = self.floor_height.get()
+        
+        height, width = surface_data.shape
+        x_idx = np.clip(np.asarray(x_centers).astype(np.int64), 0, width - 1)
+        y_idx = np.clip(np.asarray(y_centers).astype(np.int64), 0, height - 1)
+        if x_idx.size == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        
+        # NaN padding stands in for the window clipping at tile edges
+        sample_radius = min(5, height // 10, width // 10)
+        offsets = np.arange(-sample_radius, sample_radius + 1)
+        rows = (y_idx[:, None] + offsets + sample_radius)[:, :, None]
+        cols = (x_idx[:, None] + offsets + sample_radius)[:, None, :]
+        
+        def windows(data):
+            padded = np.pad(data.astype(np.float32), sample_radius, constant_values=np.nan)
+            return padded[rows, cols].reshape(len(x_idx), -1)
+        
+        surface = windows(surface_data)
+        if terrain_data is None:
+            building_heights = np.nanmedian(surface, axis=1)
+        else:
+            terrain = windows(terrain_data)
+            # Same validity rules as the per-detection calculation
+            invalid = np.isnan(surface) | np.isnan(terrain)
+            invalid |= (surface <= -1000) | (surface >= 10000) | (terrain <= -1000) | (terrain >= 10000)
+            surface[invalid] = np.nan
+            terrain[invalid] = np.nan
+            building_heights = np.nanmedian(surface, axis=1) - np.nanmedian(terrain, axis=1)
+        
+        # Below minimum building height (or no data) counts as one floor; cap at 50
+        floors = np.clip(np.round(building_heights / floor_height), 1, 50)
+        floors = np.where(np.isnan(building_heights) | (building_heights < MIN_BUILDING_HEIGHT), 1, floors).astype(np.int64)
+        return building_heights, floors
+
     # **NEW**: Coordinate-aware tile analysis
+
     def analyze_tile_with_coordinates(self, tile_metadata):
         """Analyze tile with proper coordinate-aware floor calculation"""
         tile_path = tile_metadata['path']
@@ -925,14 +1671,10 @@ class BuildingCountPopulationEstimator:
             if dhm_data is None or dtm_data is None:
                 dhm_data = dtm_data = None
 
-            # ✅ Always preprocess tile before YOLO
-            preprocessed_path = self.preprocess_tile_for_yolo(tile_path)
+            # ✅ Always preprocess tile before YOLO (3-channel BGR array, no temp PNG)
+            image_bgr = self.preprocess_tile_for_yolo_array(tile_path)
 
-            # Run YOLO detection on safe RGB
-            with Image.open(preprocessed_path) as im:
-                rgb_array = np.array(im.convert("RGB"))
-
-            results = model.predict(source=rgb_array, save=False, imgsz=640, verbose=False)
+            results = model.predict(source=image_bgr, save=False, imgsz=640, verbose=False)
             # ✅ Generate annotated image from YOLO results
             if results and len(results) > 0:
                 result = results[0]
@@ -1195,25 +1937,10 @@ class BuildingCountPopulationEstimator:
             if tile_path.lower().endswith(('.tif', '.tiff')):
                 # Handle TIFF tile with proper channel management
                 with rasterio.open(tile_path) as src:
-                    # Ensure RGB output
-                    if src.count >= 3:
-                        data = src.read([1, 2, 3])
-                        data = np.transpose(data, (1, 2, 0))
-                    else:
-                        single_band = src.read(1)
-                        data = np.stack([single_band, single_band, single_band], axis=2)
+                    data = src.read([1, 2, 3] if src.count >= 3 else [1])
                     
-                    # Normalize for display
-                    data = data.astype(np.float32)
-                    data_min = np.nanmin(data)
-                    data_max = np.nanmax(data)
-                    
-                    if data_max > data_min:
-                        data = ((data - data_min) / (data_max - data_min)) * 255
-                    else:
-                        data = np.full_like(data, 128)
-                    
-                    data = np.clip(data, 0, 255).astype(np.uint8)
+                    # Same scene stretch as the YOLO input, so previews match what was analysed
+                    data = np.ascontiguousarray(self._tile_array_to_rgb(data, self._get_scene_stretch()))
                     
                     # Verify 3 channels
                     if data.shape[2] != 3:
@@ -1246,95 +1973,6 @@ class BuildingCountPopulationEstimator:
 
 
         
-    def preprocess_tile_for_yolo(self, tile_path):
-        """Preprocess tile to ensure it's in RGB format for YOLO"""
-        try:
-            if tile_path.lower().endswith(('.tif', '.tiff')):
-                # Handle TIFF tile
-                with rasterio.open(tile_path) as src:
-                    # Always ensure we get 3 channels
-                    if src.count >= 3:
-                        # Read first 3 bands as RGB
-                        data = src.read([1, 2, 3])
-                        data = np.transpose(data, (1, 2, 0))
-                    elif src.count == 1:
-                        # Single band - replicate to create RGB
-                        single_band = src.read(1)
-                        data = np.stack([single_band, single_band, single_band], axis=2)
-                    else:
-                        # Handle 2 bands or other cases
-                        available_bands = src.read()
-                        if available_bands.shape[0] == 2:
-                            # Use first band for R and G, second for B
-                            data = np.stack([available_bands, available_bands[1], available_bands], axis=2)
-                        else:
-                            # Fallback: use first band for all channels
-                            first_band = available_bands
-                            data = np.stack([first_band, first_band, first_band], axis=2)
-                        data = np.transpose(data, (1, 2, 0))
-                    
-                    # Ensure data is in the right format and range
-                    data = data.astype(np.float32)
-                    
-                    # Normalize to 0-255 range if needed
-                    if data.max() > 255 or data.min() < 0:
-                        # Handle different data ranges
-                        data_min = np.nanmin(data)
-                        data_max = np.nanmax(data)
-                        if data_max > data_min:
-                            data = ((data - data_min) / (data_max - data_min)) * 255
-                        else:
-                            data = np.full_like(data, 128)
-                    
-                    # Ensure values are in valid range and convert to uint8
-                    data = np.clip(data, 0, 255).astype(np.uint8)
-                    
-                    # Verify we have exactly 3 channels
-                    if len(data.shape) != 3 or data.shape[2] != 3:
-                        raise ValueError(f"Expected RGB image with 3 channels, got shape: {data.shape}")
-                    
-                    # Save as temporary RGB image for YOLO
-                    import tempfile
-                    temp_path = tempfile.mktemp(suffix='.png')
-                    image_pil = Image.fromarray(data, mode='RGB')
-                    image_pil.save(temp_path)
-                    return temp_path
-                    
-            else:
-                # Regular image file - ensure it's RGB
-                image = cv2.imread(tile_path)
-                if image is None:
-                    raise Exception("Could not load image file")
-                
-                # Convert BGR to RGB and ensure 3 channels
-                if len(image.shape) == 3 and image.shape[2] == 3:
-                    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                elif len(image.shape) == 2:
-                    # Grayscale image - convert to RGB
-                    image_rgb = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
-                else:
-                    raise Exception(f"Unexpected image format: {image.shape}")
-                
-                # Save as temporary RGB image
-                import tempfile
-                temp_path = tempfile.mktemp(suffix='.png')
-                image_pil = Image.fromarray(image_rgb, mode='RGB')
-                image_pil.save(temp_path)
-                return temp_path
-                
-        except Exception as e:
-            print(f"Error preprocessing tile: {e}")
-            # Fallback: create a simple RGB image if all else fails
-            try:
-                import tempfile
-                temp_path = tempfile.mktemp(suffix='.png')
-                fallback_image = np.full((640, 640, 3), 128, dtype=np.uint8)
-                image_pil = Image.fromarray(fallback_image, mode='RGB')
-                image_pil.save(temp_path)
-                return temp_path
-            except:
-                return tile_path
-
     def validate_image_channels(self, image_path):
         """Validate that image has exactly 3 channels before YOLO processing"""
         try:
@@ -1359,6 +1997,19 @@ class BuildingCountPopulationEstimator:
         except Exception as e:
             return False, f"Validation error: {str(e)}"
 
+    def validate_image_array(self, image):
+        """Validate an in-memory HWC image (as fed to YOLO) has exactly 3 uint8 channels"""
+        if not isinstance(image, np.ndarray) or image.ndim != 3:
+            return False, f"Expected HWC image array, got {getattr(image, 'shape', type(image))}"
+        height, width, channels = image.shape
+        if channels != 3:
+            return False, f"Image has {channels} channels, expected 3 (RGB)"
+        if image.dtype != np.uint8:
+            return False, f"Image dtype {image.dtype}, expected uint8"
+        if width < 32 or height < 32:
+            return False, f"Image too small: {width}x{height}, minimum 32x32"
+        return True, f"Valid RGB image: {width}x{height}x{channels}"
+
     def debug_image_info(self, image_path):
         """Debug method to check image properties"""
         try:
@@ -1427,6 +2078,10 @@ class BuildingCountPopulationEstimator:
         self.tile_area_entry.bind('<KeyRelease>', self.update_tile_dimensions)
         self.tile_area_entry.bind('<FocusOut>', self.update_tile_dimensions)
         
+        tk.Checkbutton(input_frame, text="🧱 Snap tile edges to GeoTIFF blocks (side = nearest block multiple)",
+                       variable=self.snap_tiles_to_blocks, bg="white", font=('Arial', 10),
+                       fg="#2c3e50", selectcolor="#3498db", cursor="hand2").pack(anchor="w", pady=(5, 0))
+        
         # Preset buttons
         preset_frame = tk.Frame(config_frame, bg="white")
         preset_frame.pack(fill="x", pady=(10, 0))
@@ -1492,6 +2147,47 @@ class BuildingCountPopulationEstimator:
                                          bg="white", font=('Arial', 10), fg="#7f8c8d")
         self.save_location_info.pack(side="left", padx=(15, 0))
         
+        # Streaming options
+        stream_frame = tk.Frame(gen_frame, bg="white")
+        stream_frame.pack(fill="x", pady=(0, 10))
+
+        tk.Checkbutton(stream_frame, text="⚡ Stream tiles into analysis (no intermediate tile files)",
+                       variable=self.stream_tiles, bg="white", font=('Arial', 10),
+                       fg="#2c3e50", selectcolor="#3498db", cursor="hand2").pack(anchor="w")
+        tk.Checkbutton(stream_frame, text="💾 Also save streamed tiles as GeoTIFF",
+                       variable=self.save_streamed_tiles, bg="white", font=('Arial', 10),
+                       fg="#2c3e50", selectcolor="#3498db", cursor="hand2").pack(anchor="w", padx=(20, 0))
+
+        # Input alignment
+        align_frame = tk.Frame(gen_frame, bg="white")
+        align_frame.pack(fill="x", pady=(0, 10))
+
+        tk.Label(align_frame, text="Input Alignment:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(anchor="w")
+        tk.Radiobutton(align_frame, text="Resample all inputs to the finest GSD",
+                       variable=self.alignment_mode, value="resample",
+                       bg="white", font=('Arial', 10), fg="#2c3e50",
+                       selectcolor="#3498db", cursor="hand2").pack(anchor="w", padx=10)
+        tk.Radiobutton(align_frame, text="Keep native resolution (reproject only on CRS change)",
+                       variable=self.alignment_mode, value="native",
+                       bg="white", font=('Arial', 10), fg="#2c3e50",
+                       selectcolor="#3498db", cursor="hand2").pack(anchor="w", padx=10)
+        tk.Checkbutton(align_frame, text="💾 Materialise aligned rasters (faster repeated runs, needs scratch disk)",
+                       variable=self.materialize_aligned, bg="white", font=('Arial', 10),
+                       fg="#2c3e50", selectcolor="#3498db", cursor="hand2").pack(anchor="w", padx=10)
+
+        reproject_frame = tk.Frame(align_frame, bg="white")
+        reproject_frame.pack(fill="x", padx=(30, 0), pady=(2, 0))
+
+        tk.Label(reproject_frame, text="Reprojection threads:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        tk.Entry(reproject_frame, textvariable=self.reproject_threads, font=('Arial', 10),
+                width=4, relief=tk.SOLID, bd=1).pack(side="left", padx=(5, 10))
+        tk.Label(reproject_frame, text="Memory budget (MB):", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        tk.Entry(reproject_frame, textvariable=self.reproject_mem_mb, font=('Arial', 10),
+                width=6, relief=tk.SOLID, bd=1).pack(side="left", padx=(5, 0))
+
         # Generate button
         self.generate_tiles_btn = tk.Button(gen_frame, text="🔄 Generate Coordinate-Aware Tiles",
                                           command=self.generate_tiles, bg="#27ae60", fg="white",
@@ -1499,6 +2195,22 @@ class BuildingCountPopulationEstimator:
                                           relief=tk.RAISED, activebackground="#229954")
         self.generate_tiles_btn.pack(fill="x", pady=(0, 10))
         
+        # Dry-run planner
+        plan_frame = tk.Frame(gen_frame, bg="white")
+        plan_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Button(plan_frame, text="🧮 Dry Run Estimate", command=self.dry_run_tiles,
+                 bg="#3498db", fg="white", font=('Arial', 10, 'bold'), cursor="hand2",
+                 relief=tk.RAISED, activebackground="#2980b9").pack(side="left")
+        tk.Label(plan_frame, text="Tile compression:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left", padx=(15, 0))
+        ttk.Combobox(plan_frame, textvariable=self.tile_compression, values=list(TILE_COMPRESSION_RATIOS),
+                     state="readonly", width=8).pack(side="left", padx=(5, 0))
+        
+        self.plan_status = tk.Label(gen_frame, text="", bg="white", justify="left",
+                                  font=('Arial', 10), fg="#2c3e50")
+        self.plan_status.pack(anchor="w", pady=(0, 10))
+        
         # Status
         self.tiles_status = tk.Label(gen_frame, text="", bg="white",
                                    font=('Arial', 10), fg="#27ae60")
@@ -1517,6 +2229,109 @@ class BuildingCountPopulationEstimator:
                                    relief=tk.RAISED, activebackground="#c0392b")
         self.analyze_btn.pack(fill="x", pady=(0, 10))
         
+        # Spectral masking
+        mask_frame = tk.Frame(section_frame, bg="white")
+        mask_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Checkbutton(mask_frame, text="Mask vegetation (VARI) and water (NDWI)",
+                      variable=self.use_spectral_mask, bg="white",
+                      font=('Arial', 10), fg="#2c3e50").pack(side="left")
+        
+        tk.Label(mask_frame, text="VARI >", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left", padx=(15, 0))
+        tk.Entry(mask_frame, textvariable=self.vari_threshold, font=('Arial', 10),
+                width=5, relief=tk.SOLID, bd=1).pack(side="left", padx=(5, 10))
+        
+        tk.Label(mask_frame, text="NDWI >", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        tk.Entry(mask_frame, textvariable=self.ndwi_threshold, font=('Arial', 10),
+                width=5, relief=tk.SOLID, bd=1).pack(side="left", padx=(5, 10))
+        
+        tk.Label(mask_frame, text="NIR band:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        tk.Entry(mask_frame, textvariable=self.nir_band, font=('Arial', 10),
+                width=5, relief=tk.SOLID, bd=1).pack(side="left", padx=(5, 10))
+        
+        tk.Label(mask_frame, text="Skip tile below unmasked fraction:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        tk.Entry(mask_frame, textvariable=self.min_unmasked_fraction, font=('Arial', 10),
+                width=5, relief=tk.SOLID, bd=1).pack(side="left", padx=(5, 0))
+        
+        # Inference batch size
+        batch_frame = tk.Frame(section_frame, bg="white")
+        batch_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Label(batch_frame, text="Tiles per YOLO batch (0 = auto):", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        
+        self.batch_size_entry = tk.Entry(batch_frame, textvariable=self.inference_batch_size,
+                                       font=('Arial', 10), width=6, relief=tk.SOLID, bd=1)
+        self.batch_size_entry.pack(side="left", padx=(10, 0))
+        
+        # Pipeline thread counts
+        threads_frame = tk.Frame(section_frame, bg="white")
+        threads_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Label(threads_frame, text="Reader threads:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        
+        self.reader_threads_entry = tk.Entry(threads_frame, textvariable=self.reader_threads,
+                                           font=('Arial', 10), width=4, relief=tk.SOLID, bd=1)
+        self.reader_threads_entry.pack(side="left", padx=(10, 15))
+        
+        tk.Label(threads_frame, text="Post-processing threads:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        
+        self.postprocess_threads_entry = tk.Entry(threads_frame, textvariable=self.postprocess_threads,
+                                                font=('Arial', 10), width=4, relief=tk.SOLID, bd=1)
+        self.postprocess_threads_entry.pack(side="left", padx=(10, 0))
+        
+        # Multi-process execution
+        process_frame = tk.Frame(section_frame, bg="white")
+        process_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Checkbutton(process_frame, text="Use worker processes",
+                      variable=self.use_process_pool, bg="white",
+                      font=('Arial', 10), fg="#2c3e50").pack(side="left")
+        
+        tk.Label(process_frame, text="Workers:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left", padx=(15, 0))
+        
+        self.process_workers_entry = tk.Entry(process_frame, textvariable=self.process_workers,
+                                            font=('Arial', 10), width=4, relief=tk.SOLID, bd=1)
+        self.process_workers_entry.pack(side="left", padx=(10, 15))
+        
+        tk.Label(process_frame, text="Torch threads/worker:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        
+        self.torch_threads_entry = tk.Entry(process_frame, textvariable=self.torch_threads_per_worker,
+                                          font=('Arial', 10), width=4, relief=tk.SOLID, bd=1)
+        self.torch_threads_entry.pack(side="left", padx=(10, 0))
+        
+        # Inference backend
+        backend_frame = tk.Frame(section_frame, bg="white")
+        backend_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Label(backend_frame, text="Inference backend:", bg="white",
+               font=('Arial', 10, 'bold'), fg="#2c3e50").pack(side="left")
+        
+        backend_box = ttk.Combobox(backend_frame, textvariable=self.inference_backend_choice,
+                                   values=["auto"] + list(INFERENCE_BACKENDS), state="readonly", width=10)
+        backend_box.pack(side="left", padx=(10, 10))
+        backend_box.bind("<<ComboboxSelected>>", self.apply_inference_backend)
+        
+        self.backend_status = tk.Label(backend_frame, text="", bg="white",
+                                     font=('Arial', 9), fg="#7f8c8d")
+        self.backend_status.pack(side="left")
+        
+        # Checkpoint/resume
+        resume_frame = tk.Frame(section_frame, bg="white")
+        resume_frame.pack(fill="x", pady=(0, 10))
+        
+        tk.Checkbutton(resume_frame, text="Resume interrupted run (reuse tiles finished with the same settings)",
+                      variable=self.resume_analysis, bg="white",
+                      font=('Arial', 10), fg="#2c3e50").pack(side="left")
+        
         # Quick validation info
         self.validation_label = tk.Label(section_frame, text="✅ Ready for coordinate-aware analysis",
                                        bg="white", font=('Arial', 10), fg="#27ae60")
@@ -1978,6 +2793,7 @@ class BuildingCountPopulationEstimator:
                 self.update_status("TIF file selected - Generate tiles OR upload individual tiles for analysis", "🗂️")
                 self.tiles_generated = False
                 self.tiles_status.config(text="")
+                self._restore_tiles_from_manifest()
 
                 # Reset height data alignment
                 self.height_data_aligned = False
@@ -2067,6 +2883,9 @@ class BuildingCountPopulationEstimator:
             self.tiles_save_path = folder_path
             folder_name = os.path.basename(folder_path) or folder_path
             self.save_location_info.config(text=f"📁 {folder_name}", fg="#27ae60")
+            if self._restore_tiles_from_manifest():
+                self.update_status(f"Tiles restored from the manifest in: {folder_name}", "📁")
+                return
             tile_area = self.tile_area_sqm.get()
             side_length = int(math.sqrt(tile_area))
             self.update_status(f"Coordinate-aware tiles ({side_length}×{side_length}m) will be saved to: {folder_name}", "📁")
@@ -2088,15 +2907,30 @@ class BuildingCountPopulationEstimator:
             messagebox.showerror("Error", "Please enter a valid tile area (positive number)")
             return
         
-        # Show detailed confirmation
-        side_length = int(math.sqrt(tile_area))
+        # The estimate opens rasters and may read the footprint, so it runs off the Tk thread
+        self.generate_tiles_btn.config(state='disabled', text="🧮 Planning Tiles...")
+        self.update_status("Estimating the tile run...", "🧮")
         
+        def _plan():
+            try:
+                plan_lines = "\n    ".join(self._format_tile_plan(self.plan_tile_run(tile_area)))
+            except Exception as e:
+                plan_lines = f"(estimate unavailable: {e})"
+            self.root.after(0, lambda: self._confirm_generate_tiles(tile_area, plan_lines))
+        
+        threading.Thread(target=_plan, daemon=True).start()
+    
+    def _confirm_generate_tiles(self, tile_area, plan_lines):
+        """Show the tile plan from generate_tiles and start the generation if confirmed"""
+        side_length = int(math.sqrt(tile_area))
         confirm_msg = f"""Generate area-based tiles with the following configuration?
 
     📏 Tile Area: {tile_area:,} m²
     📐 Target Tile Dimensions: ~{side_length} × {side_length} meters  
     🗺️ Format: GeoTIFF with coordinate information preserved
 
+    {plan_lines}
+
     Note: Actual pixel dimensions will be calculated based on the image's 
     Ground Sample Distance (GSD) to ensure accurate area-based tiling.
 
@@ -2108,6 +2942,8 @@ class BuildingCountPopulationEstimator:
     Continue with area-based tile generation?"""
         
         if not messagebox.askyesno("Confirm Area-Based Tile Generation", confirm_msg):
+            self.generate_tiles_btn.config(state='normal', text="🔄 Generate Area-Based Tiles")
+            self.update_status("Tile generation cancelled")
             return
         
         # Start generation
@@ -2155,53 +2991,248 @@ class BuildingCountPopulationEstimator:
         else:
             return abs(res_x), abs(res_y)  # already meters (projected CRS)
 
-    def _reproject_resample(self, in_path, out_path, dst_crs, dst_res):
+    def _reproject_chunking(self, count, item_size, num_threads, mem_limit_mb, block_size=512,
+                            min_warp_mb=64):
+        """
+        (num_threads, warp_mem_mb, chunk side in px) for _reproject_resample within mem_limit_mb.
+        A quarter of the budget goes to GDAL's warp buffers (one per thread, at least
+        min_warp_mb each, and at most half the budget in total, so small budgets get fewer
+        threads); the rest holds the up to 2 × num_threads output chunks that are being warped
+        or waiting to be written. Chunks never go below one block.
+        """
+        num_threads = max(1, int(num_threads))
+        while num_threads > 1 and num_threads * min_warp_mb > mem_limit_mb / 2:
+            num_threads -= 1
+        warp_mem_mb = max(min_warp_mb, int(mem_limit_mb / num_threads / 4))
+        chunk_bytes = max(0, mem_limit_mb - num_threads * warp_mem_mb) * 1024 * 1024 / (2 * num_threads)
+        side = int(math.sqrt(chunk_bytes / (count * item_size)))
+        chunk = max(block_size, side // block_size * block_size)
+        return num_threads, warp_mem_mb, chunk
+
+    def _reproject_resample(self, in_path, out_path, dst_crs, dst_res, num_threads=1, mem_limit_mb=1024,
+                            block_size=512):
         """
         Reproject+resample to (dst_crs, dst_res[m, m]) using bilinear for imagery; preserves bands, dtype.
+        Output windows (whole blocks of the tiled GeoTIFF) are warped by up to num_threads threads
+        and written as they finish. Thread count, chunk size and warp_mem_limit come from
+        _reproject_chunking, so all in-flight chunks plus the warp buffers fit mem_limit_mb
+        however large the raster is.
         """
         import rasterio
         from rasterio.warp import calculate_default_transform, reproject, Resampling
+        from rasterio.windows import Window, transform as win_transform
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
         with rasterio.open(in_path) as src:
             transform, width, height = calculate_default_transform(
                 src.crs, dst_crs, src.width, src.height, *src.bounds, resolution=dst_res
             )
             profile = src.profile.copy()
-            profile.update({
-                "crs": dst_crs,
-                "transform": transform,
-                "width": width,
-                "height": height,
-                "compress": "lzw",
-                "driver": "GTiff",
-                "tiled": True
-            })
+            src_crs, src_transform, count, nodata = src.crs, src.transform, src.count, src.nodata
+            item_size = np.dtype(profile["dtype"]).itemsize
+        profile.update({
+            "crs": dst_crs,
+            "transform": transform,
+            "width": width,
+            "height": height,
+            "compress": "lzw",
+            "driver": "GTiff",
+            "tiled": True,
+            "blockxsize": block_size,
+            "blockysize": block_size,
+            "BIGTIFF": "IF_SAFER"
+        })
+
+        num_threads, warp_mem_mb, chunk = self._reproject_chunking(count, item_size, num_threads,
+                                                                    mem_limit_mb, block_size)
+        windows = [Window(col, row, min(chunk, width - col), min(chunk, height - row))
+                   for row in range(0, height, chunk) for col in range(0, width, chunk)]
+        print(f"📐 Reprojecting {os.path.basename(in_path)}: {width}×{height} px in {len(windows)} chunk(s) "
+              f"of {chunk} px, {num_threads} thread(s), {warp_mem_mb} MB warp memory each")
+
+        # rasterio datasets must not be shared between threads
+        local = threading.local()
+        opened = []
+        opened_lock = threading.Lock()
+
+        def warp_chunk(window):
+            src = getattr(local, "src", None)
+            if src is None:
+                src = local.src = rasterio.open(in_path)
+                with opened_lock:
+                    opened.append(src)
+            fill = nodata if nodata is not None else 0
+            data = np.full((count, int(window.height), int(window.width)), fill, dtype=profile["dtype"])
+            reproject(
+                source=rasterio.band(src, list(range(1, count + 1))),
+                destination=data,
+                src_transform=src_transform,
+                src_crs=src_crs,
+                src_nodata=nodata,
+                dst_transform=win_transform(window, transform),
+                dst_crs=dst_crs,
+                dst_nodata=nodata,
+                resampling=Resampling.bilinear,
+                warp_mem_limit=warp_mem_mb,
+                num_threads=1
+            )
+            return window, data
 
-            with rasterio.open(out_path, "w", **profile) as dst:
-                for i in range(1, src.count + 1):
-                    reproject(
-                        source=rasterio.band(src, i),
-                        destination=rasterio.band(dst, i),
-                        src_transform=src.transform,
-                        src_crs=src.crs,
-                        dst_transform=transform,
-                        dst_crs=dst_crs,
-                        resampling=Resampling.bilinear
-                    )
+        part_path = out_path + ".part"
+        try:
+            with rasterio.open(part_path, "w", **profile) as dst, ThreadPoolExecutor(max_workers=num_threads) as pool:
+                pending = set()
+                window_iter = iter(windows)
+                exhausted = False
+                done_chunks = 0
+                while pending or not exhausted:
+                    # Bounded in-flight chunks keep memory at the budget
+                    while not exhausted and len(pending) < 2 * num_threads:
+                        try:
+                            pending.add(pool.submit(warp_chunk, next(window_iter)))
+                        except StopIteration:
+                            exhausted = True
+                    if not pending:
+                        break
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        window, data = future.result()
+                        dst.write(data, window=window)
+                        done_chunks += 1
+                    status_msg = f"Reprojecting {os.path.basename(in_path)}: chunk {done_chunks}/{len(windows)}"
+                    self.root.after(0, lambda msg=status_msg: self.update_status(msg, "📐"))
+        except Exception:
+            # Don't leave a half-written raster behind
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        finally:
+            for src in opened:
+                src.close()
+        os.replace(part_path, out_path)
 
-    def _tile_area_m(self, base_ds, tile_area_sqm, out_dir, prefix):
+    def _plan_alignment(self, inputs, target_crs, target_res_m, native, res_tol=1e-3, phase_tol=0.01):
         """
-        Cut pure-area tiles from base_ds (already metric CRS), write tiles, and
-        return metadata list. This is the ONLY place tiles are cut.
+        Grid-compatibility analysis of the inputs against the target CRS and pixel size
+        (each input's own pixel size in "native" mode) and, for DSM/DTM, against the
+        optical grid. Returns one dict per input with 'label', 'path', 'action' and 'reason':
+          noop     - already on the target grid, used as-is
+          window   - same CRS, pixel size and origin phase but a different extent;
+                     used as-is, tiles and heights are read by window offset
+          resample - needs reprojection/resampling (VRT or materialised)
         """
-        import os, math, numpy as np
-        from rasterio.windows import from_bounds, transform as win_transform
+        plan = []
+        reference = None
+        for label, path in inputs:
+            with rasterio.open(path) as ds:
+                transform, crs = ds.transform, ds.crs
+                bounds, shape = ds.bounds, ds.shape
+                res_m = min(self._pixel_size_meters(ds))
+            step = {'label': label, 'path': path, 'crs': str(crs), 'gsd': res_m}
+            wanted_res = res_m if native else target_res_m
+            
+            if crs != target_crs:
+                step.update(action='resample', reason=f"CRS {crs} ≠ {target_crs}")
+            elif transform.b != 0 or transform.d != 0:
+                step.update(action='resample', reason="rotated geotransform")
+            elif (abs(transform.a - wanted_res) > res_tol * wanted_res
+                  or abs(-transform.e - wanted_res) > res_tol * wanted_res):
+                step.update(action='resample', reason=f"pixel size {res_m:.3f} m ≠ {wanted_res:.3f} m")
+            elif reference is None or native:
+                # The optical grid is the reference; native mode resamples per read anyway
+                step.update(action='noop', reason="on target grid" if reference is None else "target CRS, native pixel size")
+            else:
+                ref_transform, ref_bounds, ref_shape = reference
+                phase_x = ((transform.c - ref_transform.c) / ref_transform.a) % 1.0
+                phase_y = ((transform.f - ref_transform.f) / ref_transform.e) % 1.0
+                if (min(phase_x, 1.0 - phase_x) > phase_tol or min(phase_y, 1.0 - phase_y) > phase_tol
+                        or abs(transform.a - ref_transform.a) > res_tol * ref_transform.a):
+                    step.update(action='resample',
+                                reason=f"origin phase ({phase_x:.2f}, {phase_y:.2f}) px off the optical grid")
+                elif bounds == ref_bounds and shape == ref_shape:
+                    step.update(action='noop', reason="identical to optical grid")
+                else:
+                    step.update(action='window', reason="optical grid, different extent")
+            
+            if label == "optical" and step['action'] != 'resample':
+                reference = (transform, bounds, shape)
+            elif label == "optical":
+                reference = None
+            plan.append(step)
+        return plan
+
+    def _write_warped_vrt(self, in_path, out_path, dst_crs, dst_res):
+        """
+        Virtual counterpart of _reproject_resample: write a small warped VRT that
+        reprojects/resamples in_path to (dst_crs, dst_res[m, m]) only for the windows
+        that are actually read. An unchanged VRT is left untouched, so caches keyed on
+        the file (nDSM, scene stretch) stay valid across tile generations.
+        """
+        import rasterio
+        import rasterio.shutil
+        from rasterio.vrt import WarpedVRT
+        from rasterio.warp import calculate_default_transform, Resampling
 
-        os.makedirs(out_dir, exist_ok=True)
+        part_path = out_path + ".part.vrt"
+        with rasterio.open(in_path) as src:
+            transform, width, height = calculate_default_transform(
+                src.crs, dst_crs, src.width, src.height, *src.bounds, resolution=dst_res
+            )
+            with WarpedVRT(src, crs=dst_crs, transform=transform, width=width, height=height,
+                           resampling=Resampling.bilinear) as vrt:
+                rasterio.shutil.copy(vrt, part_path, driver="VRT")
+
+        with open(part_path, "rb") as f:
+            new_doc = f.read()
+        if os.path.exists(out_path):
+            with open(out_path, "rb") as f:
+                if f.read() == new_doc:
+                    os.remove(part_path)
+                    return
+        os.replace(part_path, out_path)
+
+    def _block_snapped_side(self, base_ds, tile_area_sqm):
+        """
+        Tile side (m) that is the whole number of internal blocks closest to the requested
+        area, or None if base_ds is not block-organised along both axes (e.g. striped).
+        Warped VRTs (VRT alignment) are not snapped either: their block shapes are GDAL's
+        warp blocks, and the source blocks no longer lie on a grid after reprojection.
+        """
+        if base_ds.driver == "VRT":
+            return None
+        block_rows, block_cols = base_ds.block_shapes[0]
+        res_x, res_y = abs(base_ds.transform.a), abs(base_ds.transform.e)
+        if block_cols >= base_ds.width or block_rows >= base_ds.height or abs(res_x - res_y) > 1e-9 * res_x:
+            return None
+        block = max(block_rows, block_cols)
+        if block % min(block_rows, block_cols):
+            return None
+        requested_px = math.sqrt(tile_area_sqm) / res_x
+        return max(1, int(round(requested_px / block))) * block * res_x
+
+    def _area_grid(self, base_ds, tile_area_sqm, snap=False):
+        """
+        Walk the pure-area grid (in meters) over base_ds.bounds.
+        Returns (xs, ys, side_m, snapped); tile (r, c) spans xs[c]..xs[c+1], ys[r+1]..ys[r].
+        With snap ("snap tiles to blocks") the side is a multiple of the GeoTIFF block size, so
+        tile edges fall on block boundaries and every compressed block is decoded by
+        exactly one tile (row-major tile order is then block-major). The tile metadata
+        always carries the actual area. snapped is False if base_ds cannot be snapped.
+        """
+        import math
 
         # side in meters
         side_m = math.sqrt(tile_area_sqm)
         left, bottom, right, top = base_ds.bounds
+        snapped_side = self._block_snapped_side(base_ds, tile_area_sqm) if snap else None
+        if snapped_side:
+            # Multiplied rather than accumulated, so edges stay on exact pixel boundaries
+            side_m = snapped_side
+            n_cols = int(math.ceil((right - left) / side_m - 1e-9))
+            n_rows = int(math.ceil((top - bottom) / side_m - 1e-9))
+            xs = [left + c * side_m for c in range(n_cols)] + [right]
+            ys = [top - r * side_m for r in range(n_rows)] + [bottom]
+            return xs, ys, side_m, True
         # walk grid in meters
         xs = []
         x = left
@@ -2217,61 +3248,345 @@ class BuildingCountPopulationEstimator:
             y -= side_m
         ys.append(bottom)
 
-        meta = base_ds.profile.copy()
+        return xs, ys, side_m, False
 
-        tiles = []
-        tcount = 0
-        for r in range(len(ys)-1):
+    def _valid_footprint(self, base_ds, max_side=1024, max_full_read=4):
+        """
+        Valid-data mask of base_ds at reduced resolution and its transform, from the dataset
+        mask (nodata, alpha or internal mask) read at overview resolution. Rasters without any
+        mask use "any band non-zero" instead, matching the zero fill of tile reads.
+        A reduced pixel is valid if any pixel of the overview level under it is, so the
+        footprint is as complete as the overviews ('nearest' ones can miss lone valid
+        pixels, 'average' ones cannot). Without overviews that level is the full raster,
+        which is only read (in strips) up to max_full_read times max_side pixels a side.
+        Larger rasters without overviews (warped VRTs never have any) return None instead
+        of decoding the whole scene.
+        """
+        from rasterio.enums import MaskFlags
+        from rasterio.windows import Window
+
+        factor = max(1, int(math.ceil(max(base_ds.width, base_ds.height) / max_side)))
+        # GDAL reads cannot resample with 'max' (and 'average' rounds a lone valid pixel
+        # away), so read the finest overview level needed pixel for pixel and take the
+        # maximum over each block of it here, in strips of rows
+        level = max([f for f in base_ds.overviews(1) if f <= factor], default=1)
+        if level == 1 and factor > max_full_read:
+            return None
+        block = int(math.ceil(factor / level))
+        factor = block * level
+        out_shape = (int(math.ceil(base_ds.height / factor)), int(math.ceil(base_ds.width / factor)))
+        no_mask = all(MaskFlags.all_valid in flags for flags in base_ds.mask_flag_enums)
+        valid = np.zeros(out_shape, dtype=bool)
+        strip = max(1, 1024 // block)
+        for out_row in range(0, out_shape[0], strip):
+            n = min(strip, out_shape[0] - out_row)
+            row_off = out_row * factor
+            window = Window(0, row_off, base_ds.width, min(n * factor, base_ds.height - row_off))
+            shape = (int(math.ceil(window.height / level)), int(math.ceil(window.width / level)))
+            if no_mask:
+                data = base_ds.read(window=window, out_shape=(base_ds.count,) + shape)
+                level_valid = (data != 0).any(axis=0)
+            else:
+                level_valid = base_ds.dataset_mask(window=window, out_shape=shape) > 0
+            padded = np.zeros((n * block, out_shape[1] * block), dtype=bool)
+            padded[:shape[0], :shape[1]] = level_valid
+            valid[out_row:out_row + n] = padded.reshape(n, block, out_shape[1], block).any(axis=(1, 3))
+        transform = base_ds.transform * rasterio.Affine.scale(factor, factor)
+        return valid, transform
+
+    def _plan_area_tiles(self, base_ds, tile_area_sqm, snap=False):
+        """
+        Intersect the area grid of base_ds with its valid-data footprint, without reading
+        any tile. Returns a dict with the grid ('xs', 'ys', 'side_m', 'snapped' = tile edges
+        on block boundaries, see _area_grid), the cells to read ('cells', [(row, col), ...]
+        in row-major order) and the counts 'grid_cells' and 'outside_footprint'.
+        Plans are cached per source raster (and its mtime), grid, tile area and snap, so the
+        dry run, tile generation and streamed analysis compute the footprint once.
+        """
+        source = getattr(base_ds, 'src_dataset', base_ds).name
+        key = (base_ds.name, os.path.getmtime(source) if os.path.exists(source) else None,
+               str(base_ds.crs), tuple(base_ds.transform)[:6], base_ds.width, base_ds.height,
+               float(tile_area_sqm), bool(snap))
+        with self.tile_plan_cache_lock:
+            if key in self.tile_plan_cache:
+                return self.tile_plan_cache[key]
+        
+        xs, ys, side_m, snapped = self._area_grid(base_ds, tile_area_sqm, snap)
+        all_cells = [(r, c) for r in range(len(ys) - 1) for c in range(len(xs) - 1)]
+        try:
+            footprint = self._valid_footprint(base_ds)
+            if footprint is None:
+                raise ValueError("no overviews (build them to skip empty tiles)")
+            valid, fp_transform = footprint
+        except Exception as e:
+            print(f"⚠️ Valid-data footprint unavailable, planning every grid cell: {e}")
+            logging.info(f"Tile plan without footprint for {base_ds.name}: {e}")
+            plan = {'xs': xs, 'ys': ys, 'side_m': side_m, 'snapped': snapped, 'cells': all_cells,
+                    'grid_cells': len(all_cells), 'outside_footprint': 0}
+            with self.tile_plan_cache_lock:
+                self.tile_plan_cache[key] = plan
+            return plan
+        
+        # Summed-area table: valid pixels in any footprint rectangle in O(1)
+        fp_rows, fp_cols = valid.shape
+        integral = np.zeros((fp_rows + 1, fp_cols + 1), dtype=np.int64)
+        integral[1:, 1:] = valid.cumsum(0).cumsum(1)
+        inverse = ~fp_transform
+        
+        cells = []
+        for r, c in all_cells:
+            col0, row0 = inverse * (xs[c], ys[r])
+            col1, row1 = inverse * (xs[c + 1], ys[r + 1])
+            # One footprint pixel of margin against decimation losses
+            c0, c1 = max(0, int(math.floor(col0)) - 1), min(fp_cols, int(math.ceil(col1)) + 1)
+            r0, r1 = max(0, int(math.floor(row0)) - 1), min(fp_rows, int(math.ceil(row1)) + 1)
+            if c0 < c1 and r0 < r1 and integral[r1, c1] - integral[r0, c1] - integral[r1, c0] + integral[r0, c0] > 0:
+                cells.append((r, c))
+        
+        plan = {'xs': xs, 'ys': ys, 'side_m': side_m, 'snapped': snapped, 'cells': cells,
+                'grid_cells': len(all_cells), 'outside_footprint': len(all_cells) - len(cells)}
+        with self.tile_plan_cache_lock:
+            self.tile_plan_cache[key] = plan
+        return plan
+
+    def _area_tile_id(self, prefix, plan, r, c, tile_area_sqm):
+        """Id of grid cell (r, c) of a tile plan, from its bounds in meters and the requested area"""
+        xs, ys = plan['xs'], plan['ys']
+        return (f"{prefix}_X{int(round(xs[c]))}to{int(round(xs[c + 1]))}"
+                f"_Y{int(round(ys[r + 1]))}to{int(round(ys[r]))}_A{int(round(tile_area_sqm))}")
+
+    def _iter_area_windows(self, base_ds, tile_area_sqm, prefix="tile", plan=None, snap=False):
+        """
+        Generator over the pure-area tiles of base_ds (already metric CRS) without reading
+        them: yields (window, tile_metadata) for every grid cell of the plan (see
+        _plan_area_tiles; snap is only used when no plan is given). The tile's pixels
+        are read by _read_area_tile.
+        """
+        from rasterio.windows import from_bounds, transform as win_transform
+
+        if plan is None:
+            plan = self._plan_area_tiles(base_ds, tile_area_sqm, snap)
+        xs, ys, snapped = plan['xs'], plan['ys'], plan['snapped']
+
+        for r, c in plan['cells']:
             y_top = ys[r]
             y_bottom = ys[r+1]
-            for c in range(len(xs)-1):
-                x_left = xs[c]
-                x_right = xs[c+1]
-                # window in pixels for this geog box
-                w = from_bounds(x_left, y_bottom, x_right, y_top, transform=base_ds.transform)
-                # Make sure window is within the dataset; allow boundless read with fill
-                data = base_ds.read(window=w, boundless=True, fill_value=0)
-                # If completely empty, skip
-                if data.size == 0 or (np.all(data == 0)):
-                    continue
+            x_left = xs[c]
+            x_right = xs[c+1]
+            # window in pixels for this geog box
+            w = from_bounds(x_left, y_bottom, x_right, y_top, transform=base_ds.transform)
+            if snapped:
+                # Drop float noise so the read covers whole blocks only
+                w = Window(round(w.col_off), round(w.row_off), round(w.width), round(w.height))
+
+            # output geotransform for this tile
+            t_transform = win_transform(w, base_ds.transform)
+
+            tile_id = self._area_tile_id(prefix, plan, r, c, tile_area_sqm)
+            tile_metadata = {
+                "path": None,
+                "tile_id": tile_id,
+                "row": r,
+                "col": c,
+                "geographic_bounds": (x_left, y_bottom, x_right, y_top),
+                "bounds": (x_left, y_bottom, x_right, y_top),
+                "transform": t_transform,
+                "crs": base_ds.crs,
+                # Same rounding as the window read, so the shape is known before reading
+                "shape": (int(round(w.height)), int(round(w.width))),
+                "area_sqm": (x_right - x_left) * (y_top - y_bottom),
+                "requested_area_sqm": tile_area_sqm
+            }
+            yield w, tile_metadata
+
+    def _read_area_tile(self, base_ds, window, tile_metadata, out_dir=None, compression="lzw"):
+        """
+        Read one tile window of base_ds (boundless, zero fill) as a CHW array and record its
+        content hash. If out_dir is given the tile is also written there as a GeoTIFF
+        and its path stored in tile_metadata. Returns None for an all-zero tile.
+        """
+        data = base_ds.read(window=window, boundless=True, fill_value=0)
+        # If completely empty, skip
+        if data.size == 0 or (np.all(data == 0)):
+            return None
 
-                # output geotransform for this tile
-                t_transform = win_transform(w, base_ds.transform)
-
-                # update profile for tile dims
-                tile_profile = meta.copy()
-                tile_profile.update({
-                    "width": data.shape[2],
-                    "height": data.shape[1],
-                    "transform": t_transform,
-                    "compress": "lzw"
-                })
-
-                fname = f"{prefix}_X{int(round(x_left))}to{int(round(x_right))}_Y{int(round(y_bottom))}to{int(round(y_top))}_A{int(round(tile_area_sqm))}.tif"
-                fpath = os.path.join(out_dir, fname)
-
-                with rasterio.open(fpath, "w", **tile_profile) as dst:
-                    dst.write(data)
-
-                tcount += 1
-                tiles.append({
-                    "path": fpath,
-                    "row": r,
-                    "col": c,
-                    "geographic_bounds": (x_left, y_bottom, x_right, y_top),
-                    "transform": t_transform,
-                    "crs": base_ds.crs,
-                    "area_sqm": (x_right - x_left) * (y_top - y_bottom)
-                })
-
-        return tiles, side_m
+        # Lets the tile manifest detect tiles whose pixels changed
+        tile_metadata["content_hash"] = hashlib.blake2b(np.ascontiguousarray(data), digest_size=16).hexdigest()
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+            # update profile for tile dims
+            tile_profile = base_ds.profile.copy()
+            tile_profile.update({
+                "driver": "GTiff",
+                "width": data.shape[2],
+                "height": data.shape[1],
+                "transform": tile_metadata["transform"],
+                "compress": compression
+            })
+            fpath = os.path.join(out_dir, f"{tile_metadata['tile_id']}.tif")
+            with rasterio.open(fpath, "w", **tile_profile) as dst:
+                dst.write(data)
+            tile_metadata["path"] = fpath
+        return data
 
-    def _collect_inputs_for_resample(self):
+    def _iter_area_tiles(self, base_ds, tile_area_sqm, out_dir=None, prefix="tile", plan=None):
         """
-        Build list of rasters to align. Optical is mandatory; include DSM/DTM if set.
-        Return list of (label, path).
+        Generator over pure-area tiles of base_ds (already metric CRS).
+        Yields (window, transform, data, tile_metadata) with data as a CHW ndarray,
+        so tiles can be analysed straight from memory. If out_dir is given, each
+        tile is also written there as a GeoTIFF (side output).
+        Only grid cells of the plan (see _plan_area_tiles) are read; empty tiles are dropped.
         """
-        items = [("optical", self.file_path)]
+        compression = self.tile_compression.get()
+        for w, tile_metadata in self._iter_area_windows(base_ds, tile_area_sqm, prefix, plan):
+            data = self._read_area_tile(base_ds, w, tile_metadata, out_dir, compression)
+            if data is None:
+                continue
+            yield w, tile_metadata["transform"], data, tile_metadata
+
+    def _read_streamed_tile(self, tile_metadata):
+        """
+        Pixels of a streamed tile, read from its window through the calling thread's handle
+        on the source raster (see HeightDataReader), so reader threads overlap their I/O.
+        Returns None for an all-zero tile.
+        """
+        args = (tile_metadata['window'], tile_metadata, tile_metadata.get('out_dir'),
+                tile_metadata.get('compression', "lzw"))
+        reader = self.height_reader
+        if reader is not None and reader.paths.get('optical') == tile_metadata['source_path']:
+            return self._read_area_tile(reader.dataset('optical'), *args)
+        with rasterio.open(tile_metadata['source_path']) as src:
+            return self._read_area_tile(src, *args)
+
+    def _tile_area_m(self, base_ds, tile_area_sqm, out_dir, prefix, plan=None):
+        """
+        Cut pure-area tiles from base_ds (already metric CRS), write tiles, and
+        return metadata list. Tiles are cut by _iter_area_tiles only.
+        """
+        if plan is None:
+            plan = self._plan_area_tiles(base_ds, tile_area_sqm)
+        tiles = []
+        for _w, _t, _data, tile_metadata in self._iter_area_tiles(base_ds, tile_area_sqm, out_dir, prefix, plan):
+            tiles.append(tile_metadata)
+
+        return tiles, plan['side_m']
+
+    def plan_tile_run(self, tile_area_sqm=None):
+        """
+        Dry run of tile generation and analysis: tile count, bytes written and run time.
+        Uses the same grid and footprint plan as _tile_area_m, on the aligned optical
+        raster or, before alignment, on the optical image as _generate_tiles_thread would
+        align it: a virtual warp to the target UTM CRS at the common GSD of all inputs (its
+        own GSD in "native" mode), or the image itself if already on that grid. No tile is
+        read or written; only the footprint is read, at overview level (see _valid_footprint).
+        The run time comes from the throughput of the last measured analysis run (None if
+        there is none). Runs on a worker thread: it opens rasters and may read the footprint.
+        """
+        from rasterio.vrt import WarpedVRT
+
+        tile_area = float(tile_area_sqm or self.tile_area_sqm.get())
+        aligned_optical = self.aligned_paths.get("optical")
+        scene_path = aligned_optical or self.file_path
+        compression = self.tile_compression.get()
+
+        def summarize(base_ds, source_size):
+            plan = self._plan_area_tiles(base_ds, tile_area, bool(self.snap_tiles_to_blocks.get()))
+            xs, ys = plan['xs'], plan['ys']
+            res_x, res_y = abs(base_ds.transform.a), abs(base_ds.transform.e)
+            pixels = sum(int(round((xs[c + 1] - xs[c]) / res_x)) * int(round((ys[r] - ys[r + 1]) / res_y))
+                         for r, c in plan['cells'])
+            item_size = max(np.dtype(dt).itemsize for dt in base_ds.dtypes)
+            raw_bytes = pixels * base_ds.count * item_size
+
+            # The source's own ratio is the best guess when it uses the same codec
+            ratio = TILE_COMPRESSION_RATIOS.get(compression, 1.0)
+            source_codec = str(base_ds.profile.get("compress", "none")).lower()
+            if source_size and source_codec == compression:
+                source_raw = base_ds.width * base_ds.height * base_ds.count * item_size
+                ratio = min(1.2, max(0.05, source_size / source_raw))
+            return plan, pixels, raw_bytes, ratio
+
+        if not aligned_optical:
+            # Same alignment decision for the optical image as in _generate_tiles_thread
+            with rasterio.open(scene_path) as src:
+                target_crs = self._utm_epsg_from_bounds(src.crs, src.bounds)
+            inputs = self._collect_inputs_for_resample()
+            gsds, target_res_m = self._common_gsd(inputs)
+            native = self.alignment_mode.get() == "native"
+            step = self._plan_alignment(inputs, target_crs, target_res_m, native)[0]
+            res_m = gsds[0] if native else target_res_m
+
+        with rasterio.open(scene_path) as src:
+            source_size = os.path.getsize(scene_path) if scene_path.lower().endswith(('.tif', '.tiff')) else None
+            if aligned_optical or step['action'] != 'resample':
+                plan, pixels, raw_bytes, ratio = summarize(src, source_size)
+            else:
+                transform, width, height = calculate_default_transform(
+                    src.crs, target_crs, src.width, src.height, *src.bounds, resolution=(res_m, res_m))
+                with WarpedVRT(src, crs=target_crs, transform=transform, width=width, height=height) as vrt:
+                    plan, pixels, raw_bytes, ratio = summarize(vrt, None)
+
+        writes_tiles = not self.stream_tiles.get() or self.save_streamed_tiles.get()
+        bytes_written = int(raw_bytes * ratio) if writes_tiles else 0
+        free_bytes = shutil.disk_usage(self.tiles_save_path).free if self.tiles_save_path else None
+
+        throughput = self._read_run_manifest().get('throughput') or getattr(self, 'last_throughput', None)
+        seconds = pixels / 1e6 * throughput['seconds_per_megapixel'] if throughput else None
+
+        return {
+            'tile_area': tile_area,
+            'side_m': plan['side_m'],
+            'grid_cells': plan['grid_cells'],
+            'outside_footprint': plan['outside_footprint'],
+            'tiles': len(plan['cells']),
+            'megapixels': pixels / 1e6,
+            'compression': compression,
+            'bytes_written': bytes_written,
+            'free_bytes': free_bytes,
+            'estimated_seconds': seconds
+        }
+
+    def _format_tile_plan(self, plan):
+        """Human-readable lines of a plan_tile_run result"""
+        def _size(n):
+            return f"{n / 1024 ** 3:.2f} GB" if n >= 1024 ** 3 else f"{n / 1024 ** 2:.1f} MB"
+        
+        lines = [
+            f"🧩 Tiles: {plan['tiles']:,} of {plan['grid_cells']:,} grid cells "
+            f"({plan['outside_footprint']:,} outside valid data) @ {plan['side_m']:.2f} m side",
+            f"💾 Written: {_size(plan['bytes_written'])} ({plan['compression']})"
+            + (f", {_size(plan['free_bytes'])} free" if plan['free_bytes'] is not None else "")
+        ]
+        if plan['free_bytes'] is not None and plan['bytes_written'] > plan['free_bytes']:
+            lines.append("⚠️ Not enough free disk space for the tiles")
+        if plan['estimated_seconds'] is None:
+            lines.append(f"⏱️ Run time: unknown until one analysis run has been measured ({plan['megapixels']:,.1f} MP)")
+        else:
+            lines.append(f"⏱️ Estimated analysis time: {plan['estimated_seconds'] / 60:.1f} min ({plan['megapixels']:,.1f} MP)")
+        return lines
+
+    def dry_run_tiles(self):
+        """Estimate the tile run in the background and show it in the planner panel"""
+        if not self.file_path or not self.is_tif_file:
+            messagebox.showerror("Error", "Please select a TIF file first")
+            return
+        self.plan_status.config(text="🧮 Planning...", fg="#7f8c8d")
+
+        def _plan():
+            try:
+                text, color = "\n".join(self._format_tile_plan(self.plan_tile_run())), "#2c3e50"
+            except Exception as e:
+                text, color = f"❌ Planning failed: {e}", "#e74c3c"
+            self.root.after(0, lambda: self.plan_status.config(text=text, fg=color))
+
+        threading.Thread(target=_plan, daemon=True).start()
+
+    def _collect_inputs_for_resample(self):
+        """
+        Build list of rasters to align. Optical is mandatory; include DSM/DTM if set.
+        Return list of (label, path).
+        """
+        items = [("optical", self.file_path)]
         # if your app5.py uses these attributes; if not, this will be just optical.
         if getattr(self, "dhm_path", None):
             items.append(("dsm", self.dhm_path))
@@ -2279,13 +3594,34 @@ class BuildingCountPopulationEstimator:
             items.append(("dtm", self.dtm_path))
         return items
 
+    def _common_gsd(self, inputs):
+        """
+        Native pixel size (m) of each (label, path) input and the common target pixel size:
+        the smallest of them, clamped to 0.2..5 m. Returns (gsds, target_res_m).
+        """
+        # estimate native GSD (m) for each input, pick the smallest
+        gsds = []
+        for _, p in inputs:
+            with rasterio.open(p) as ds:
+                rx_m, ry_m = self._pixel_size_meters(ds)
+                gsds.append(min(rx_m, ry_m))
+        target_res_m = float(np.nanmin(gsds))
+
+        # Safety clamps (avoid insane sub-decimeter if metadata odd)
+        if target_res_m <= 0 or target_res_m != target_res_m:
+            target_res_m = 0.5  # default
+        target_res_m = max(0.2, min(target_res_m, 5.0))  # clamp 0.2..5 m
+        return gsds, target_res_m
+
 
     def _generate_tiles_thread(self):
         """
         FULL pipeline:
         1) Choose target metric CRS (UTM from optical)
         2) Compute common pixel size in meters (min across inputs)
-        3) Reproject+resample all inputs to (CRS, pixel)
+        3) Reproject+resample the inputs to (CRS, pixel) where _plan_alignment says so;
+           in "native" alignment mode each keeps its own pixel size. Aligned inputs
+           are warped VRTs unless materialisation is enabled
         4) Tile by pure area in meters from OPTICAL-aligned raster
         """
         import os
@@ -2308,39 +3644,95 @@ class BuildingCountPopulationEstimator:
                 target_crs = self._utm_epsg_from_bounds(src_opt.crs, src_opt.bounds)
 
             # -------- (2) common pixel size (meters) --------
-            # estimate native GSD (m) for each input, pick the smallest
-            gsds = []
-            for _, p in inputs:
-                with rasterio.open(p) as ds:
-                    rx_m, ry_m = self._pixel_size_meters(ds)
-                    gsds.append(min(rx_m, ry_m))
-            target_res_m = float(np.nanmin(gsds))
-
-            # Safety clamps (avoid insane sub-decimeter if metadata odd)
-            if target_res_m <= 0 or target_res_m != target_res_m:
-                target_res_m = 0.5  # default
-            target_res_m = max(0.2, min(target_res_m, 5.0))  # clamp 0.2..5 m
+            gsds, target_res_m = self._common_gsd(inputs)
 
             # -------- (3) reproject+resample all inputs --------
             res_dir = os.path.join(self.tiles_save_path, "_resampled")
             os.makedirs(res_dir, exist_ok=True)
 
+            native = self.alignment_mode.get() == "native"
+            materialize = self.materialize_aligned.get()
+            reproject_threads = max(1, int(self.reproject_threads.get()))
+            reproject_mem_mb = max(128, int(self.reproject_mem_mb.get()))
+            plan = self._plan_alignment(inputs, target_crs, target_res_m, native)
+            plan_msg = "Alignment plan: " + ", ".join(f"{step['label']} {step['action']}" for step in plan)
+            for step in plan:
+                logging.info(f"Alignment {step['label']}: {step['action']} ({step['reason']}) - {step['path']}")
+            self.root.after(0, lambda msg=plan_msg: self.update_status(msg, "📐"))
+            self._update_run_manifest('alignment', {'target_crs': target_crs, 'native': native, 'plan': plan})
+
             aligned_paths = {}
-            for label, p in inputs:
-                out_p = os.path.join(res_dir, f"{label}_aligned.tif")
-                self._reproject_resample(p, out_p, target_crs, (target_res_m, target_res_m))
+            for step, gsd in zip(plan, gsds):
+                label, p = step['label'], step['path']
+                if step['action'] != 'resample':
+                    # Already on a compatible grid: tile/height reads map into it directly
+                    print(f"📐 {label}: {step['action']} ({step['reason']})")
+                    aligned_paths[label] = p
+                    continue
+                print(f"📐 {label}: resample ({step['reason']})")
+                res_m = gsd if native else target_res_m
+                if materialize:
+                    out_p = os.path.join(res_dir, f"{label}_aligned.tif")
+                    print(f"📐 {label}: reprojecting to {target_crs} at {res_m:.3f} m")
+                    self._reproject_resample(p, out_p, target_crs, (res_m, res_m),
+                                             num_threads=reproject_threads, mem_limit_mb=reproject_mem_mb)
+                else:
+                    # Warped on the fly, window by window, whenever tiles or heights are read
+                    out_p = os.path.join(res_dir, f"{label}_aligned.vrt")
+                    print(f"📐 {label}: virtual warp to {target_crs} at {res_m:.3f} m")
+                    self._write_warped_vrt(p, out_p, target_crs, (res_m, res_m))
                 aligned_paths[label] = out_p
 
+            self.aligned_paths = aligned_paths
+            gsd_note = "native GSDs kept" if native else f"common GSD {target_res_m:.3f} m"
+
             # -------- (4) area tiling from optical-aligned --------
+            stream = self.stream_tiles.get()
+            snap = bool(self.snap_tiles_to_blocks.get())
             with rasterio.open(aligned_paths["optical"]) as base_ds:
-                tiles, side_m = self._tile_area_m(base_ds, tile_area, self.tiles_save_path, prefix="tile")
+                plan = self._plan_area_tiles(base_ds, tile_area, snap)
+                if snap and not plan['snapped']:
+                    print("ℹ️ Tile edges not snapped: the optical raster has no usable block grid "
+                          "(striped, non-square pixels or a warped VRT)")
+                n_planned, n_outside = len(plan['cells']), plan['outside_footprint']
+                print(f"🗺️ Tile plan: {plan['grid_cells']} grid cells, {n_outside} outside the valid-data "
+                      f"footprint (never read), {n_planned} to read")
+                if stream:
+                    # Tiles are cut in memory during analysis; only the grid is needed here
+                    side_m = plan['side_m']
+                    tiles = []
+                else:
+                    tiles, side_m = self._tile_area_m(base_ds, tile_area, self.tiles_save_path, prefix="tile", plan=plan)
+            self.tile_metadata_list = tiles
+            self.tile_plan = {'grid_cells': plan['grid_cells'], 'outside_footprint': n_outside, 'planned': n_planned}
+            
+            # Tiles and their georeferencing survive a restart (see _restore_tiles_from_manifest);
+            # streamed tiles get their rows as they are analysed, on the grid stored here
+            self._tile_manifest().replace_tiles(tiles, {
+                'source': os.path.abspath(optical_path),
+                'tile_area': tile_area,
+                'snap_tiles_to_blocks': snap,
+                'target_crs': target_crs,
+                'streamed': stream,
+                'aligned_paths': {label: os.path.abspath(p) for label, p in aligned_paths.items()},
+                'created': datetime.now().isoformat(timespec='seconds')
+            })
 
             # -------- UI update --------
             def _ok():
                 self.tiles_generated = True
                 n = len(tiles)
+                if stream:
+                    self.tiles_status.config(
+                        text=f"✅ Inputs aligned; up to {n_planned} tiles @ {side_m:.2f} m side will be streamed during analysis ({n_outside} outside valid data skipped); {gsd_note}; CRS {target_crs}."
+                    )
+                    self.generate_tiles_btn.config(state='normal', text="🔄 Generate Area-Based Tiles")
+                    self.show_progress(False)
+                    self.update_status(f"Inputs aligned for streaming analysis ({n_planned} grid cells)", "✅")
+                    self.update_validation_status()
+                    return
                 self.tiles_status.config(
-                    text=f"✅ Generated {n} tiles @ {side_m:.2f} m side; common GSD {target_res_m:.3f} m; CRS {target_crs}."
+                    text=f"✅ Generated {n} tiles @ {side_m:.2f} m side ({n_outside} outside valid data skipped); {gsd_note}; CRS {target_crs}."
                 )
                 self.generate_tiles_btn.config(state='normal', text="🔄 Generate Area-Based Tiles")
                 self.show_progress(False)
@@ -2546,7 +3938,8 @@ class BuildingCountPopulationEstimator:
     def _analyze_individual_tile_thread(self, tile_path):
         """Background thread for individual tile analysis"""
         try:
-            results = self.analyze_single_image(tile_path)
+            with inference_backend_lock:
+                results = self.analyze_single_image(tile_path)
             results['processing_method'] = f'Individual Tile Analysis - {os.path.basename(tile_path)}'
             results['tile_analysis'] = True
             
@@ -2561,11 +3954,80 @@ class BuildingCountPopulationEstimator:
                 self.update_status("Tile analysis failed", "❌")
             self.root.after(0, show_error)
 
+    def _generated_tile_grid(self):
+        """
+        (tile_area, snap) of the grid the current tiles were generated with, from the tile
+        manifest's scene settings, so streaming and checkpoints use it even if the settings
+        changed since. Falls back to the current settings if the manifest is for another scene.
+        """
+        manifest = self._tile_manifest()
+        scene = manifest.scene() if manifest and os.path.exists(manifest.path) else {}
+        optical_path = self.aligned_paths.get("optical")
+        if not optical_path or scene.get('aligned_paths', {}).get('optical') != os.path.abspath(optical_path):
+            scene = {}
+        return (float(scene.get('tile_area', self.tile_area_sqm.get())),
+                bool(scene.get('snap_tiles_to_blocks', self.snap_tiles_to_blocks.get())))
+
+    def _analysis_tile_source(self, skip=frozenset()):
+        """
+        Return (iterable of tile metadata, planned tile count, count to analyse) for analysis.
+        Tiles whose manifest key is in skip (finished in a resumed run) are left out before
+        anything is read. In streaming mode only the tile windows are produced here,
+        carrying 'window' and 'source_path'; each tile is read by whichever reader thread
+        or worker takes it (see _read_streamed_tile). Otherwise the generated tile list is used.
+        """
+        optical_path = self.aligned_paths.get("optical")
+        if not (self.stream_tiles.get() and optical_path):
+            tiles = [t for t in self.tile_metadata_list if TileManifest.tile_key(t) not in skip]
+            return tiles, len(self.tile_metadata_list), len(tiles)
+
+        out_dir = self.tiles_save_path if self.save_streamed_tiles.get() else None
+        tile_area, snap = self._generated_tile_grid()
+        with rasterio.open(optical_path) as base_ds:
+            plan = self._plan_area_tiles(base_ds, tile_area, snap)
+        self.tile_plan = {'grid_cells': plan['grid_cells'], 'outside_footprint': plan['outside_footprint'],
+                          'planned': len(plan['cells'])}
+
+        compression = self.tile_compression.get()
+        cells = [(r, c) for r, c in plan['cells'] if self._area_tile_id("tile", plan, r, c, tile_area) not in skip]
+        run_plan = dict(plan, cells=cells)
+
+        def _stream():
+            with rasterio.open(optical_path) as base_ds:
+                for w, tile_metadata in self._iter_area_windows(base_ds, tile_area, prefix="tile", plan=run_plan):
+                    tile_metadata.update({'window': w, 'source_path': optical_path,
+                                          'out_dir': out_dir, 'compression': compression})
+                    yield tile_metadata
+
+        return _stream(), len(plan['cells']), len(cells)
+
     def analyze_coordinate_aware_tiles(self):
         """Analyze all coordinate-aware tiles using building count methodology with optional floor calculation"""
-        if not self.tile_metadata_list:
+        # Worker threads read settings from this snapshot, never from Tk variables
+        params = self._snapshot_analysis_params()
+        
+        # Per-tile outcomes and detections are checkpointed in the tile manifest as tiles
+        # finish; a resumed run leaves the finished tiles out of the tile source
+        manifest = self._tile_manifest()
+        resumed, finished = False, set()
+        if manifest is not None:
+            resume = bool(self.resume_analysis.get())
+            resumed = manifest.start_run(self._checkpoint_settings(params), resume)
+            if resumed:
+                finished = manifest.finished_keys()
+            elif resume:
+                print("⚠️ No checkpoint with the current settings; analysing every tile")
+        
+        tile_source, expected_tiles, remaining_tiles = self._analysis_tile_source(finished)
+        if not expected_tiles:
             raise Exception("No coordinate-aware tile metadata available")
         
+        tile_plan = self.tile_plan or {'grid_cells': expected_tiles, 'outside_footprint': 0, 'planned': expected_tiles}
+        plan_msg = (f"Tile plan: {tile_plan['grid_cells']} grid cells, {tile_plan['outside_footprint']} outside "
+                    f"valid data (skipped), {remaining_tiles} to analyze")
+        print(f"🗺️ {plan_msg}")
+        self.root.after(0, lambda msg=plan_msg: self.update_status(msg, "🗺️"))
+        
         tile_area = self.tile_area_sqm.get()
         side_length = int(math.sqrt(tile_area))
         
@@ -2578,9 +4040,9 @@ class BuildingCountPopulationEstimator:
             'standard_houses': 0,
             'medium_houses': 0,
             'large_houses': 0,
-            'building_details': [],
-            'processing_method': f'Coordinate-Aware Building Count Analysis with Floor Calculation ({len(self.tile_metadata_list)} tiles of {side_length}×{side_length}m)' if self.use_height_calculation.get() else f'Coordinate-Aware Building Count Analysis ({len(self.tile_metadata_list)} tiles of {side_length}×{side_length}m)',
-            'tile_count': len(self.tile_metadata_list),
+            'building_details': DetectionStore(),
+            'processing_method': f'Coordinate-Aware Building Count Analysis with Floor Calculation ({expected_tiles} tiles of {side_length}×{side_length}m)' if self.use_height_calculation.get() else f'Coordinate-Aware Building Count Analysis ({expected_tiles} tiles of {side_length}×{side_length}m)',
+            'tile_count': expected_tiles,
             'tile_area': tile_area,
             'tile_dimensions': f'{side_length}×{side_length}m',
             'people_per_household': self.people_per_household.get(),
@@ -2596,51 +4058,91 @@ class BuildingCountPopulationEstimator:
             'floor_calculations': []
         }
         
-        # Process each coordinate-aware tile with enhanced error handling
-        successful_tiles = 0
-        failed_tiles = 0
-        
-        for i, tile_metadata in enumerate(self.tile_metadata_list):
-            try:
-                print(f"Processing tile {i+1}/{len(self.tile_metadata_list)}: {os.path.basename(tile_metadata['path'])}")
-                
-                # Use enhanced tile analysis with 3-channel fixes
-                tile_results = self.analyze_coordinate_aware_tile_enhanced(tile_metadata)
-                
-                if tile_results:
-                    # Aggregate results only if analysis was successful
-                    total_results['residential_count'] += tile_results['residential_count']
-                    total_results['non_residential_count'] += tile_results['non_residential_count']
-                    total_results['total_population'] += tile_results['total_population']
-                    total_results['total_base_population'] += tile_results.get('total_base_population', 0)
-                    total_results['standard_houses'] += tile_results['standard_houses']
-                    total_results['medium_houses'] += tile_results['medium_houses']
-                    total_results['large_houses'] += tile_results['large_houses']
-                    total_results['building_details'].extend(tile_results['building_details'])
-                    total_results['total_floors'] += tile_results.get('total_floors', 0)
-                    total_results['floor_calculations'].extend(tile_results.get('floor_calculations', []))
-                    successful_tiles += 1
-                else:
-                    failed_tiles += 1
-                    print(f"Warning: Tile {i+1} analysis failed, skipping...")
-                
-            except Exception as e:
-                failed_tiles += 1
-                print(f"Error processing tile {i+1}: {str(e)}")
-                # Continue processing other tiles
-                continue
-            
-            # Update progress
-            progress = (i + 1) / len(self.tile_metadata_list) * 100
-            status_msg = f"Processed {i+1}/{len(self.tile_metadata_list)} coordinate-aware tiles ({progress:.1f}%) - Success: {successful_tiles}, Failed: {failed_tiles}"
-            self.root.after(0, lambda msg=status_msg: self.update_status(msg, "🔍"))
+        # Resuming adds the finished tiles of the last run back into the totals
+        resumed_successful, resumed_skipped = 0, []
+        if resumed:
+            finished, resumed_successful, resumed_skipped = self._restore_checkpoint(manifest, total_results, params)
+            resume_msg = f"Resuming: {len(finished)} of {expected_tiles} tiles restored from the checkpoint"
+            print(f"♻️ {resume_msg}")
+            self.root.after(0, lambda msg=resume_msg: self.update_status(msg, "♻️"))
+        
+        # Pixels handed to the runners, for the throughput used by plan_tile_run
+        pixel_count = [0]
+        def _counted(source):
+            for tile_metadata in source:
+                rows, cols = tile_metadata['shape']
+                pixel_count[0] += rows * cols
+                if manifest is not None:
+                    manifest.stage(tile_metadata)
+                yield tile_metadata
+        tile_source = _counted(tile_source)
+        
+        # Height above ground is computed once per scene and reused across runs
+        self.ndsm_path = None
+        if params['use_height'] and params['use_ndsm']:
+            self.ndsm_path = self._prepare_ndsm_for_run()
+        
+        # Throughput covers the tile loop only; the one-off nDSM build would skew the estimates
+        run_start = time.perf_counter()
+        remaining_tiles = max(1, remaining_tiles)
+        try:
+            if params['use_process_pool']:
+                # Each worker process runs the whole per-tile chain with its own model
+                processed_tiles, successful_tiles, failed_tiles, skipped_tiles = self._run_tile_process_pool(
+                    tile_source, remaining_tiles, total_results, params, manifest)
+            else:
+                # DSM/DTM (and the streamed optical raster) stay open for the run instead of
+                # being reopened for every tile
+                streamed_path = self.aligned_paths.get("optical") if self.stream_tiles.get() else None
+                if streamed_path or (params['use_height'] and ((self.dhm_path and self.dtm_path) or self.ndsm_path)):
+                    self.height_reader = HeightDataReader(*self._height_source_paths(), self.ndsm_path, streamed_path)
+                # Read, inference and post-processing run as overlapping pipeline stages
+                processed_tiles, successful_tiles, failed_tiles, skipped_tiles = self._run_tile_pipeline(
+                    tile_source, remaining_tiles, total_results, params, manifest)
+        finally:
+            if manifest is not None:
+                manifest.flush()
+            if self.height_reader is not None:
+                self.height_reader.close()
+                self.height_reader = None
+        
+        processed_tiles += len(finished)
+        successful_tiles += resumed_successful
+        skipped_tiles = resumed_skipped + skipped_tiles
+        
+        # Streaming skips empty grid cells, so the real count is only known now
+        total_results['tile_count'] = processed_tiles
+        
+        if pixel_count[0]:
+            self.last_throughput = {
+                'seconds_per_megapixel': (time.perf_counter() - run_start) / (pixel_count[0] / 1e6),
+                'megapixels': pixel_count[0] / 1e6,
+                'tiles': processed_tiles,
+                'process_pool': params['use_process_pool'],
+                'measured': datetime.now().isoformat(timespec='seconds')
+            }
+            self._update_run_manifest('throughput', self.last_throughput)
         
         # Final processing summary
         print(f"\n=== TILE PROCESSING SUMMARY ===")
-        print(f"Total tiles: {len(self.tile_metadata_list)}")
+        print(f"Grid cells: {tile_plan['grid_cells']} ({tile_plan['outside_footprint']} outside valid data, never read)")
+        print(f"Total tiles: {processed_tiles}")
         print(f"Successfully processed: {successful_tiles}")
         print(f"Failed tiles: {failed_tiles}")
-        print(f"Success rate: {(successful_tiles/len(self.tile_metadata_list)*100):.1f}%")
+        print(f"Skipped tiles: {len(skipped_tiles)}")
+        if finished:
+            print(f"Restored from checkpoint: {len(finished)}")
+        skip_reasons = {}
+        for skipped in skipped_tiles:
+            skip_reasons[skipped['reason']] = skip_reasons.get(skipped['reason'], 0) + 1
+        for reason, count in skip_reasons.items():
+            print(f"  - {reason}: {count}")
+        # Skipped tiles were never sent to the model, so they don't count against the success rate
+        analyzed_tiles = processed_tiles - len(skipped_tiles)
+        success_rate = (successful_tiles/analyzed_tiles*100) if analyzed_tiles > 0 else 0
+        print(f"Success rate: {success_rate:.1f}%")
+        if manifest is not None:
+            print(f"Tile manifest: {manifest.path} {manifest.status_counts()}")
         
         # Calculate average floors
         if total_results['residential_count'] > 0:
@@ -2652,10 +4154,16 @@ class BuildingCountPopulationEstimator:
         
         # Add processing statistics to results
         total_results['processing_stats'] = {
-            'total_tiles': len(self.tile_metadata_list),
+            'total_tiles': processed_tiles,
             'successful_tiles': successful_tiles,
             'failed_tiles': failed_tiles,
-            'success_rate': (successful_tiles/len(self.tile_metadata_list)*100) if len(self.tile_metadata_list) > 0 else 0
+            'grid_cells': tile_plan['grid_cells'],
+            'outside_footprint_tiles': tile_plan['outside_footprint'],
+            'skipped_tiles': len(skipped_tiles),
+            'skip_reasons': skip_reasons,
+            'skipped_tile_details': skipped_tiles,
+            'resumed_tiles': len(finished),
+            'success_rate': success_rate
         }
         
         self.building_data = total_results['building_details']
@@ -2665,10 +4173,12 @@ class BuildingCountPopulationEstimator:
     def _analyze_thread(self):
         """Background analysis thread"""
         try:
-            if self.is_tif_file:
-                results = self.analyze_coordinate_aware_tiles()
-            else:
-                results = self.analyze_single_image(self.file_path)
+            # The inference backend stays fixed for the whole run (see set_inference_backend)
+            with inference_backend_lock:
+                if self.is_tif_file:
+                    results = self.analyze_coordinate_aware_tiles()
+                else:
+                    results = self.analyze_single_image(self.file_path)
             
             self.analysis_results = results
             self.root.after(0, lambda: self.display_results(results))
@@ -2686,30 +4196,83 @@ class BuildingCountPopulationEstimator:
     
     def analyze_coordinate_aware_tile_enhanced(self, tile_metadata):
         """Enhanced tile analysis with proper 3-channel image handling"""
-        tile_path = tile_metadata['path']
-        
-        tile_results = {
-            'residential_count': 0,
-            'non_residential_count': 0,
-            'total_population': 0,
-            'total_base_population': 0,
-            'standard_houses': 0,
-            'medium_houses': 0,
-            'large_houses': 0,
-            'building_details': [],
-            'total_floors': 0,
-            'floor_calculations': []
-        }
+        params = self._snapshot_analysis_params()
+        prepared = self._prepare_tile_for_inference(tile_metadata, params)
+        if prepared is None:
+            return None
+        if prepared.get('skip'):
+            return self._summarize_detections(None, params)
+        results = self._predict_batch([prepared['image']])[0]
+        if results is None:
+            return None
+        return self._postprocess_tile_detections(prepared, results, params)
+
+    def _prepare_tile_for_inference(self, tile_metadata, params):
+        """
+        Read stage of tile analysis: height data plus a YOLO-ready image for one tile.
+        Returns a dict for _postprocess_tile_detections, or None if the tile cannot be used.
+        Tiles gated out before inference come back as a dict with a 'skip' entry
+        ({'reason', 'detail'}) and no image.
+        """
+        # Streamed tiles may have no file on disk; fall back to their grid id
+        tile_path = tile_metadata.get('path') or tile_metadata.get('tile_id')
+        tile_data = tile_metadata.get('array')
         
         try:
             print(f"  📍 Analyzing tile: {os.path.basename(tile_path)}")
             
+            if tile_data is None and tile_metadata.get('window') is not None:
+                tile_data = self._read_streamed_tile(tile_metadata)
+                if tile_data is None:
+                    return {'tile_metadata': tile_metadata, 'tile_path': tile_path,
+                            'skip': {'reason': 'no_data', 'detail': 'all pixels are zero'}}
+                tile_path = tile_metadata.get('path') or tile_path
+            
             # Debug image information
-            self.debug_image_info(tile_path)
+            if tile_data is None:
+                self.debug_image_info(tile_path)
+            
+            # Spectral masking (vegetation/water) needs all bands of the tile
+            spectral_mask = None
+            if params['use_spectral_mask']:
+                if tile_data is None and tile_path.lower().endswith(('.tif', '.tiff')):
+                    with rasterio.open(tile_path) as src:
+                        tile_data = src.read()
+                if tile_data is not None:
+                    spectral_mask = self._spectral_mask_for_tile(tile_metadata, tile_data, params)
+                    print(f"  🌿 Spectral mask: {spectral_mask.mean() * 100:.1f}% vegetation/water")
+            
+            # Skip tiles that are almost entirely vegetation/water before any further reads
+            if spectral_mask is not None:
+                unmasked_fraction = 1.0 - float(spectral_mask.mean())
+                if unmasked_fraction < params['min_unmasked_fraction']:
+                    detail = f"{unmasked_fraction * 100:.1f}% unmasked < {params['min_unmasked_fraction'] * 100:.1f}%"
+                    print(f"  ⏭️ Skipping tile: {detail}")
+                    return {'tile_metadata': tile_metadata, 'tile_path': tile_path,
+                            'skip': {'reason': 'low_built_up', 'detail': detail}}
+            
+            # Skip tiles without anything standing above ground (fields, sandbanks, open ground)
+            if params['use_height'] and params['use_height_gate'] and (self.ndsm_path or (self.dhm_path and self.dtm_path)):
+                try:
+                    elevated_fraction = self._elevated_fraction_for_tile(tile_metadata)
+                except Exception as e:
+                    print(f"  ⚠️ Height gate check failed: {e}")
+                    elevated_fraction = None
+                if elevated_fraction is not None and elevated_fraction < params['min_elevated_fraction']:
+                    detail = (f"{elevated_fraction * 100:.2f}% above {MIN_BUILDING_HEIGHT} m "
+                              f"< {params['min_elevated_fraction'] * 100:.2f}%")
+                    print(f"  ⏭️ Skipping tile: {detail}")
+                    return {'tile_metadata': tile_metadata, 'tile_path': tile_path,
+                            'skip': {'reason': 'no_elevated_structures', 'detail': detail}}
             
             # Extract height data for this specific tile if enabled
-            dhm_data, dtm_data, tile_transform = None, None, None
-            if self.use_height_calculation.get():
+            dhm_data, dtm_data, ndsm_data, tile_transform = None, None, None, None
+            if params['use_height'] and self.ndsm_path:
+                # One read from the precomputed height-above-ground raster
+                ndsm_data, tile_transform = self.extract_ndsm_for_tile(tile_metadata)
+                if ndsm_data is not None:
+                    print(f"  🗻 nDSM data extracted successfully")
+            elif params['use_height']:
                 try:
                     dhm_data, dtm_data, tile_transform = self.extract_height_data_for_tile(tile_metadata)
                     print(f"  🗻 Height data extracted successfully")
@@ -2717,238 +4280,1007 @@ class BuildingCountPopulationEstimator:
                     print(f"  ⚠️ Height data extraction failed: {e}")
                     dhm_data = dtm_data = tile_transform = None
             
-            # Preprocess tile to ensure proper 3-channel RGB format
-            try:
-                processed_tile_path = self.preprocess_tile_for_yolo_enhanced(tile_path)
-                print(f"  🔄 Tile preprocessed: {os.path.basename(processed_tile_path)}")
-                
-                # Validate the processed image has exactly 3 channels
-                is_valid, validation_msg = self.validate_image_channels(processed_tile_path)
-                if not is_valid:
-                    print(f"  ❌ Channel validation failed: {validation_msg}")
-                    return None
-                else:
-                    print(f"  ✅ Channel validation passed: {validation_msg}")
-                    
-            except Exception as e:
-                print(f"  ❌ Tile preprocessing failed: {e}")
+            # Preprocess tile to a 3-channel uint8 array (no temp files)
+            image_bgr = self.preprocess_tile_for_yolo_array(tile_path, tile_data, spectral_mask,
+                                                            params['scene_stretch'])
+            
+            # Validate the processed image has exactly 3 channels
+            is_valid, validation_msg = self.validate_image_array(image_bgr)
+            if not is_valid:
+                print(f"  ❌ Channel validation failed: {validation_msg}")
                 return None
+            print(f"  ✅ Channel validation passed: {validation_msg}")
+            
+            return {
+                'tile_metadata': tile_metadata,
+                'tile_path': tile_path,
+                'image': image_bgr,
+                'dhm_data': dhm_data,
+                'dtm_data': dtm_data,
+                'ndsm_data': ndsm_data,
+                'tile_transform': tile_transform,
+                'masked_fraction': float(spectral_mask.mean()) if spectral_mask is not None else 0.0
+            }
             
-            # Run YOLO detection with enhanced error handling
+        except Exception as e:
+            print(f"  ❌ Tile preprocessing failed for {tile_path}: {e}")
+            return None
+
+    def apply_inference_backend(self, event=None):
+        """Load the chosen inference backend in the background; "auto" picks the fastest installed one"""
+        choice = self.inference_backend_choice.get()
+        self.backend_status.config(text="⏳ Benchmarking backends..." if choice == "auto" else f"⏳ Loading {choice}...",
+                                   fg="#7f8c8d")
+        if inference_backend_lock.locked():
+            self.backend_status.config(text=f"⏳ {choice} will be loaded when the running analysis finishes")
+        
+        def _load():
             try:
-                print(f"  🔍 Running YOLO detection...")
-                
-                # Double-check image format before YOLO
-                test_img = cv2.imread(processed_tile_path)
-                if test_img is None or len(test_img.shape) != 3 or test_img.shape[2] != 3:
-                    raise Exception(f"Invalid image format for YOLO: {test_img.shape if test_img is not None else 'None'}")
-                
-                results = model.predict(source=processed_tile_path, save=False, imgsz=640, verbose=False)
+                backend, timings = (pick_inference_backend() if choice == "auto" else (choice, {}))
+                set_inference_backend(backend)
+                details = ", ".join(f"{name} {seconds * 1000:.0f} ms" if isinstance(seconds, float) else f"{name} n/a"
+                                    for name, seconds in timings.items())
+                text, color = f"✅ {backend}" + (f" ({details})" if details else ""), "#27ae60"
+                logging.info(f"Inference backend: {backend} {timings}")
+            except Exception as e:
+                text, color = f"❌ {choice} unavailable, using {inference_backend}: {e}", "#e74c3c"
+                logging.warning(f"Inference backend {choice} failed: {e}")
+            self.root.after(0, lambda: self.backend_status.config(text=text, fg=color))
+        
+        threading.Thread(target=_load, daemon=True).start()
+
+    def _resolve_inference_batch_size(self):
+        """Tiles per model.predict call: the configured value, or auto-sized from free RAM when 0"""
+        try:
+            requested = int(self.inference_batch_size.get())
+        except (ValueError, tk.TclError):
+            requested = 0
+        if requested > 0:
+            return requested
+        
+        try:
+            import psutil
+            available = psutil.virtual_memory().available
+        except Exception:
+            return 4
+        
+        # Budget a quarter of free RAM at ~256 MB per tile (640² letterboxed input,
+        # YOLOv8 activations and the tile arrays themselves), capped at 32 tiles
+        per_tile_bytes = 256 * 1024 * 1024
+        return int(max(1, min(32, (available // 4) // per_tile_bytes)))
+
+    def _predict_batch(self, images):
+        """
+        Run one model.predict call over a list of preprocessed tile arrays.
+        Returns one entry per image, aligned with the input: the per-image results
+        list (as model.predict returns for a single source) or None if it failed.
+        """
+        if not images:
+            return []
+        
+        try:
+            print(f"  🔍 Running YOLO detection on batch of {len(images)} tile(s)...")
+            results = model.predict(source=list(images), save=False, imgsz=640,
+                                    batch=len(images), verbose=False)
+            if results is not None and len(results) == len(images):
                 print(f"  ✅ YOLO detection completed")
-                
+                return [[result] for result in results]
+            print(f"  ⚠️ YOLO returned {0 if results is None else len(results)} results for {len(images)} tiles; retrying one by one")
+        except Exception as e:
+            print(f"  ⚠️ Batched YOLO detection failed ({e}); retrying one by one")
+        
+        # Fallback: one call per tile so a single bad tile does not sink the batch
+        per_image = []
+        for image in images:
+            try:
+                per_image.append(model.predict(source=image, save=False, imgsz=640, verbose=False))
             except Exception as e:
                 print(f"  ❌ YOLO detection failed: {e}")
-                # Clean up temporary file
-                if processed_tile_path != tile_path and os.path.exists(processed_tile_path):
-                    try:
-                        os.remove(processed_tile_path)
-                    except:
-                        pass
-                return None
-            
-            # Clean up temporary file after successful detection
-            if processed_tile_path != tile_path and os.path.exists(processed_tile_path):
-                try:
-                    os.remove(processed_tile_path)
-                except:
-                    pass
-            
+                per_image.append(None)
+        return per_image
+
+    def _postprocess_tile_detections(self, prepared, results, params):
+        """Turn the YOLO results of one prepared tile into per-tile building and population counts"""
+        tile_metadata = prepared['tile_metadata']
+        tile_path = prepared['tile_path']
+        dhm_data = prepared['dhm_data']
+        dtm_data = prepared['dtm_data']
+        ndsm_data = prepared.get('ndsm_data')
+        
+        try:
             # Process detection results
             if results and len(results) > 0:
                 result = results[0]
                 if result.boxes is not None and len(result.boxes) > 0:
                     print(f"  🏠 Found {len(result.boxes)} detections")
                     
-                    for j, box in enumerate(result.boxes):
+                    # Floors for every detection of the tile in one pass
+                    tile_floors = None
+                    if params['use_height'] and (ndsm_data is not None or (dhm_data is not None and dtm_data is not None)):
                         try:
-                            # Extract detection information - FIXED tensor access
-                            x_center, y_center, width, height = box.xywh[0].cpu().numpy()
-                            confidence = float(box.conf.cpu().numpy())
-                            class_id = int(box.cls.cpu().numpy())
-                            
-                            # Calculate building area in square meters
-                            building_area_px = width * height
-                            building_area_sqm = building_area_px * (self.ground_sample_distance ** 2)
-                            
-                            # Calculate floors using coordinate-aware height data
-                            floors = 1  # Default
-                            if (self.use_height_calculation.get() and 
-                                dhm_data is not None and dtm_data is not None):
-                                try:
-                                    floors = self.calculate_building_floors_from_tile_data(
-                                        int(x_center), int(y_center), dhm_data, dtm_data, tile_transform
-                                    )
-                                except Exception as e:
-                                    print(f"    ⚠️ Floor calculation failed for detection {j}: {e}")
-                                    floors = 1
-                            
-                            # Convert pixel coordinates to world coordinates
-                            try:
-                                world_x, world_y = rasterio.transform.xy(tile_metadata['transform'], y_center, x_center)
-                            except Exception as e:
-                                print(f"    ⚠️ Coordinate transformation failed for detection {j}: {e}")
-                                world_x = world_y = "N/A"
-                            
-                            # Only count residential buildings for population
-                            if class_id == 0:  # Residential
-                                tile_results['residential_count'] += 1
-                                
-                                # Determine house category and population multiplier
-                                if building_area_sqm < self.medium_house_threshold.get():
-                                    house_category = "Standard"
-                                    population_multiplier = 1
-                                    tile_results['standard_houses'] += 1
-                                elif building_area_sqm < self.large_house_threshold.get():
-                                    house_category = "Medium"
-                                    population_multiplier = 2
-                                    tile_results['medium_houses'] += 1
-                                else:
-                                    house_category = "Large"
-                                    population_multiplier = 3
-                                    tile_results['large_houses'] += 1
-                                
-                                # Calculate base population (without floors)
-                                base_population = population_multiplier * self.people_per_household.get()
-                                
-                                # Calculate final population (with floors)
-                                final_population = base_population * floors
-                                
-                                tile_results['total_base_population'] += base_population
-                                tile_results['total_population'] += final_population
-                                tile_results['total_floors'] += floors
-                                
-                                # Store floor calculation details
-                                if self.use_height_calculation.get():
-                                    tile_results['floor_calculations'].append({
-                                        'world_x': world_x,
-                                        'world_y': world_y,
-                                        'floors': floors,
-                                        'base_population': base_population,
-                                        'final_population': final_population
-                                    })
-                            else:
-                                tile_results['non_residential_count'] += 1
-                                house_category = "Non-Residential"
-                                population_multiplier = 0
-                                base_population = 0
-                                final_population = 0
-                                floors = 1  # Default for non-residential
-                            
-                            # Store building details with proper field names
-                            building_detail = {
-                                'tile_path': tile_path,
-                                'tile_row': tile_metadata['row'],
-                                'tile_col': tile_metadata['col'],
-                                'detection_id': j,
-                                'pixel_x': float(x_center),
-                                'pixel_y': float(y_center),
-                                'world_x': float(world_x) if world_x != "N/A" else "N/A",
-                                'world_y': float(world_y) if world_y != "N/A" else "N/A",
-                                'width_px': float(width),  # Fixed field name
-                                'height_px': float(height),  # Fixed field name
-                                'area_sqm': building_area_sqm,
-                                'confidence': confidence,
-                                'class_id': class_id,
-                                'class_name': class_names.get(class_id, 'Unknown'),
-                                'house_category': house_category,
-                                'population_multiplier': population_multiplier,
-                                'base_population': base_population,
-                                'floors': floors,
-                                'final_population': final_population,
-                                'bbox': box.xyxy[0].cpu().numpy().tolist()
-                            }
-                            
-                            tile_results['building_details'].append(building_detail)
-                            
+                            centers = result.boxes.xywh.cpu().numpy()
+                            _, tile_floors = self.calculate_building_floors_vectorized(
+                                centers[:, 0], centers[:, 1],
+                                ndsm_data if ndsm_data is not None else dhm_data,
+                                None if ndsm_data is not None else dtm_data,
+                                params['floor_height']
+                            )
+                            print(f"  🏢 Floors: {int(tile_floors.sum())} over {len(tile_floors)} detections")
                         except Exception as e:
-                            print(f"    ❌ Error processing detection {j}: {e}")
-                            continue
+                            print(f"  ⚠️ Floor calculation failed for tile: {e}")
+                            tile_floors = None
+                    
+                    detections = self._detections_from_result(result, params, tile_floors, tile_metadata.get('transform'))
+                    detections.update({
+                        'tile_path': tile_path,
+                        'tile_row': tile_metadata['row'],
+                        'tile_col': tile_metadata['col']
+                    })
+                    tile_results = self._summarize_detections(detections, params)
                     
                     print(f"  📊 Tile results: {tile_results['residential_count']} residential, {tile_results['non_residential_count']} non-residential")
+                    return tile_results
                 else:
                     print(f"  📭 No detections found in tile")
             else:
                 print(f"  📭 No YOLO results for tile")
             
-            return tile_results
+            return self._summarize_detections(None, params)
             
         except Exception as e:
             print(f"  ❌ Critical error analyzing tile {tile_path}: {e}")
             return None
 
+    def _detections_from_result(self, result, params, floors=None, transform=None):
+        """
+        Pull one YOLO result into NumPy columns (one row per detection) and derive areas,
+        house categories, population and world coordinates with array operations.
+        floors: per-detection floors for residential buildings (default 1).
+        transform: tile affine for world coordinates; NaN when not given.
+        """
+        boxes = result.boxes
+        xywh = boxes.xywh.cpu().numpy().reshape(-1, 4).astype(np.float64)
+        confidence = boxes.conf.cpu().numpy().reshape(-1).astype(np.float64)
+        class_id = boxes.cls.cpu().numpy().reshape(-1).astype(np.int64)
+        xyxy = boxes.xyxy.cpu().numpy().reshape(-1, 4).astype(np.float64)
+        n = len(class_id)
+        x_center, y_center, width, height = xywh.T
+        
+        # Building area in square meters
+        area_sqm = width * height * (params['gsd'] ** 2)
+        
+        # House category and population multiplier (residential only)
+        residential = class_id == 0
+        multiplier = np.where(area_sqm < params['medium_threshold'], 1,
+                              np.where(area_sqm < params['large_threshold'], 2, 3))
+        multiplier = np.where(residential, multiplier, 0)
+        category_code = np.where(residential, multiplier - 1, HOUSE_CATEGORIES.index("Non-Residential"))
+        
+        floors = np.ones(n, dtype=np.int64) if floors is None else np.asarray(floors, dtype=np.int64)
+        floors = np.where(residential, floors, 1)  # Non-residential default to 1 floor
+        base_population = multiplier * params['people_per_household']
+        final_population = base_population * floors
+        
+        # Pixel centre -> world coordinates (same as rasterio.transform.xy with offset='center')
+        if transform is not None:
+            a, b, c, d, e, f = tuple(transform)[:6]
+            world_x = a * (x_center + 0.5) + b * (y_center + 0.5) + c
+            world_y = d * (x_center + 0.5) + e * (y_center + 0.5) + f
+        else:
+            world_x = world_y = np.full(n, np.nan)
+        
+        return {
+            'detection_id': np.arange(n),
+            'pixel_x': x_center,
+            'pixel_y': y_center,
+            'world_x': world_x,
+            'world_y': world_y,
+            'width_px': width,
+            'height_px': height,
+            'area_sqm': area_sqm,
+            'confidence': confidence,
+            'class_id': class_id,
+            'category_code': category_code.astype(np.int8),
+            'population_multiplier': multiplier,
+            'base_population': base_population,
+            'floors': floors,
+            'final_population': final_population,
+            'bbox': xyxy
+        }
+
+    def _summarize_detections(self, detections, params):
+        """Per-tile counts and population totals from detection columns (None = no detections)"""
+        tile_results = {
+            'residential_count': 0,
+            'non_residential_count': 0,
+            'total_population': 0,
+            'total_base_population': 0,
+            'standard_houses': 0,
+            'medium_houses': 0,
+            'large_houses': 0,
+            'detections': detections,
+            'total_floors': 0,
+            'floor_calculations': []
+        }
+        if detections is None:
+            return tile_results
+        
+        residential = detections['class_id'] == 0
+        category_counts = np.bincount(detections['category_code'], minlength=len(HOUSE_CATEGORIES))
+        tile_results.update({
+            'residential_count': int(residential.sum()),
+            'non_residential_count': int((~residential).sum()),
+            'total_population': float(detections['final_population'][residential].sum()),
+            'total_base_population': float(detections['base_population'][residential].sum()),
+            'standard_houses': int(category_counts[0]),
+            'medium_houses': int(category_counts[1]),
+            'large_houses': int(category_counts[2]),
+            'total_floors': int(detections['floors'][residential].sum())
+        })
+        
+        # Floor calculation details for residential buildings
+        if params['use_height']:
+            tile_results['floor_calculations'] = [
+                {'world_x': wx, 'world_y': wy, 'floors': fl, 'base_population': bp, 'final_population': fp}
+                for wx, wy, fl, bp, fp in zip(*(detections[key][residential].tolist() for key in
+                                                ('world_x', 'world_y', 'floors', 'base_population', 'final_population')))
+            ]
+        return tile_results
+
+    def _accumulate_tile_results(self, total_results, tile_results):
+        """Add one tile's counts and building details to the run totals"""
+        total_results['residential_count'] += tile_results['residential_count']
+        total_results['non_residential_count'] += tile_results['non_residential_count']
+        total_results['total_population'] += tile_results['total_population']
+        total_results['total_base_population'] += tile_results.get('total_base_population', 0)
+        total_results['standard_houses'] += tile_results['standard_houses']
+        total_results['medium_houses'] += tile_results['medium_houses']
+        total_results['large_houses'] += tile_results['large_houses']
+        if tile_results.get('detections') is not None:
+            total_results['building_details'].append(tile_results['detections'])
+        total_results['total_floors'] += tile_results.get('total_floors', 0)
+        total_results['floor_calculations'].extend(tile_results.get('floor_calculations', []))
+
+    def _checkpoint_settings(self, params):
+        """Analysis settings that change per-tile results; a checkpoint is only resumed if they match"""
+        keys = ('use_height', 'use_ndsm', 'use_height_gate', 'min_elevated_fraction', 'use_spectral_mask',
+                'vari_threshold', 'ndwi_threshold', 'nir_band', 'min_unmasked_fraction', 'scene_stretch', 'floor_height',
+                'people_per_household', 'medium_threshold', 'large_threshold', 'gsd')
+        settings = {key: params[key] for key in keys}
+        settings['height_sources'] = [os.path.abspath(p) if p else None for p in self._height_source_paths()]
+        # Streamed tile ids (and so the finished-tile keys) depend on the tile area
+        settings['tile_area'] = self._generated_tile_grid()[0]
+        # Backends differ slightly in their outputs (e.g. ONNX/OpenVINO export precision)
+        settings['inference_backend'] = inference_backend
+        return settings
+
+    def _restore_checkpoint(self, manifest, total_results, params):
+        """
+        Add the tiles finished by the checkpointed run to total_results.
+        Returns (finished tile keys, number of tiles with results, skipped tile list).
+        """
+        finished = set()
+        successful = 0
+        skipped = []
+        for tile_id, path, row, col, status, detail, detections in manifest.finished_tiles():
+            finished.add(tile_id)
+            if status == 'skipped':
+                skipped.append({'tile': tile_id, 'reason': detail, 'detail': 'restored from checkpoint'})
+                continue
+            if detections is not None:
+                detections.update({'tile_path': path or tile_id, 'tile_row': row, 'tile_col': col})
+            self._accumulate_tile_results(total_results, self._summarize_detections(detections, params))
+            successful += 1
+        return finished, successful, skipped
+
+    def _snapshot_analysis_params(self):
+        """Copy the analysis settings out of the Tk variables so worker threads can use them safely"""
+        def _count(var, default):
+            try:
+                return max(1, int(var.get()))
+            except (ValueError, tk.TclError):
+                return default
+        
+        return {
+            'use_height': bool(self.use_height_calculation.get()),
+            'use_ndsm': bool(self.use_ndsm.get()),
+            'use_height_gate': bool(self.use_height_gate.get()),
+            'min_elevated_fraction': float(self.min_elevated_fraction.get()),
+            'use_spectral_mask': bool(self.use_spectral_mask.get()),
+            'vari_threshold': float(self.vari_threshold.get()),
+            'ndwi_threshold': float(self.ndwi_threshold.get()),
+            'nir_band': self._resolve_nir_band(),
+            'mask_cache_dir': os.path.join(self.tiles_save_path, "_masks") if self.tiles_save_path else None,
+            'min_unmasked_fraction': float(self.min_unmasked_fraction.get()),
+            'scene_stretch': self._get_scene_stretch(),
+            'floor_height': float(self.floor_height.get()),
+            'people_per_household': self.people_per_household.get(),
+            'medium_threshold': float(self.medium_house_threshold.get()),
+            'large_threshold': float(self.large_house_threshold.get()),
+            'gsd': float(self.ground_sample_distance),
+            'batch_size': self._resolve_inference_batch_size(),
+            'reader_threads': _count(self.reader_threads, 2),
+            'postprocess_threads': _count(self.postprocess_threads, 2),
+            'use_process_pool': bool(self.use_process_pool.get()),
+            'process_workers': _count(self.process_workers, 1),
+            'torch_threads': _count(self.torch_threads_per_worker, 1)
+        }
+
+    def _run_tile_pipeline(self, tile_source, expected_tiles, total_results, params, manifest=None):
+        """
+        Analyze tiles as three overlapping stages connected by bounded queues:
+        reader threads (window reads, DSM/DTM extraction, preprocessing) -> one
+        inference thread that owns the model and batches tiles -> a post-processing
+        pool (floors, population). Results are aggregated on the calling thread.
+        A full queue blocks the stage feeding it, so only a few batches of tiles
+        are ever held in memory.
+        Each tile's outcome is recorded in the tile manifest, if given. If aggregation fails,
+        the stages are stopped and joined before the error propagates.
+        Returns (processed_tiles, successful_tiles, failed_tiles, skipped_tiles), the last
+        being a list of {'tile', 'reason', 'detail'} for tiles gated out before inference.
+        """
+        import queue
+        from concurrent.futures import ThreadPoolExecutor
+        
+        batch_size = params['batch_size']
+        n_readers = params['reader_threads']
+        print(f"Running tile pipeline: {n_readers} reader thread(s), YOLO batches of {batch_size}, "
+              f"{params['postprocess_threads']} post-processing thread(s)")
+        
+        done = object()  # end-of-stream marker
+        stop = threading.Event()  # set when aggregation stops early; the stages wind down
+        prepared_queue = queue.Queue(maxsize=2 * batch_size)
+        result_queue = queue.Queue(maxsize=2 * batch_size)
+        
+        # The tile source may be a generator over one open dataset, so readers share it under a
+        # lock; streamed sources only yield windows, and each reader reads its tiles outside it
+        source_iter = iter(tile_source)
+        source_lock = threading.Lock()
+        counter = [0]
+        
+        def reader():
+            try:
+                while not stop.is_set():
+                    with source_lock:
+                        try:
+                            tile_metadata = next(source_iter)
+                        except StopIteration:
+                            return
+                        counter[0] += 1
+                        index = counter[0]
+                    label = TileManifest.tile_key(tile_metadata)
+                    prepared = None
+                    try:
+                        print(f"Processing tile {index}/{expected_tiles}: {label}")
+                        prepared = self._prepare_tile_for_inference(tile_metadata, params)
+                    except Exception as e:
+                        print(f"Error processing tile {index}: {str(e)}")
+                    finally:
+                        # Tiles may carry their pixels; release them once preprocessed
+                        tile_metadata.pop('array', None)
+                    if prepared is None:
+                        prepared_queue.put(('failed', label))
+                    elif prepared.get('skip'):
+                        prepared_queue.put(('skipped', label, prepared['skip']))
+                    else:
+                        prepared_queue.put(prepared)
+            except Exception as e:
+                print(f"❌ Tile reader stopped: {e}")
+            finally:
+                prepared_queue.put(done)
+        
+        def run_batch(batch, post_pool):
+            batch_results = self._predict_batch([prepared['image'] for prepared in batch])
+            for prepared, results in zip(batch, batch_results):
+                # The image is only needed by the model
+                prepared.pop('image', None)
+                label = TileManifest.tile_key(prepared['tile_metadata'])
+                if results is None:
+                    result_queue.put(('failed', label))
+                else:
+                    result_queue.put(('analyzed', label, post_pool.submit(self._postprocess_tile_detections,
+                                                                          prepared, results, params)))
+        
+        def inference(post_pool):
+            finished_readers = 0
+            try:
+                batch = []
+                while finished_readers < n_readers:
+                    item = prepared_queue.get()
+                    if item is done:
+                        finished_readers += 1
+                    elif stop.is_set():
+                        # Run abandoned: only drain what the readers still deliver
+                        continue
+                    elif isinstance(item, tuple):
+                        result_queue.put(item)
+                    else:
+                        batch.append(item)
+                    if len(batch) >= batch_size:
+                        run_batch(batch, post_pool)
+                        batch = []
+                # Last, partially filled batch
+                if batch and not stop.is_set():
+                    run_batch(batch, post_pool)
+            except Exception as e:
+                print(f"❌ Inference stage stopped: {e}")
+                # Keep draining so readers blocked on a full queue can exit
+                while finished_readers < n_readers:
+                    if prepared_queue.get() is done:
+                        finished_readers += 1
+            finally:
+                result_queue.put(done)
+        
+        processed_tiles = successful_tiles = failed_tiles = 0
+        skipped_tiles = []
+        with ThreadPoolExecutor(max_workers=params['postprocess_threads']) as post_pool:
+            readers = [threading.Thread(target=reader, daemon=True) for _ in range(n_readers)]
+            inference_thread = threading.Thread(target=inference, args=(post_pool,), daemon=True)
+            for thread in readers:
+                thread.start()
+            inference_thread.start()
+            
+            item = None
+            try:
+                while True:
+                    item = result_queue.get()
+                    if item is done:
+                        break
+                    processed_tiles += 1
+                    
+                    status, label = item[0], item[1]
+                    if status == 'skipped':
+                        skipped_tiles.append(dict(item[2], tile=label))
+                        tile_results = 'skipped'
+                    elif status == 'failed':
+                        tile_results = None
+                    else:
+                        try:
+                            tile_results = item[2].result()
+                        except Exception as e:
+                            print(f"  ❌ Post-processing failed: {e}")
+                            tile_results = None
+                    
+                    if tile_results == 'skipped':
+                        if manifest is not None:
+                            manifest.record(label, 'skipped', item[2]['reason'])
+                    elif tile_results:
+                        self._accumulate_tile_results(total_results, tile_results)
+                        successful_tiles += 1
+                        if manifest is not None:
+                            manifest.record(label, 'done', detections=tile_results.get('detections'))
+                    else:
+                        failed_tiles += 1
+                        print(f"Warning: Tile {label} analysis failed, skipping...")
+                        if manifest is not None:
+                            manifest.record(label, 'failed')
+                    
+                    # Update progress
+                    progress = min(100.0, processed_tiles / expected_tiles * 100)
+                    status_msg = f"Processed {processed_tiles}/{expected_tiles} coordinate-aware tiles ({progress:.1f}%) - Success: {successful_tiles}, Failed: {failed_tiles}, Skipped: {len(skipped_tiles)}"
+                    self.root.after(0, lambda msg=status_msg: self.update_status(msg, "🔍"))
+            finally:
+                if item is not done:
+                    # Stopped early (e.g. a failed manifest write): wind the stages down and
+                    # drain their queues, so no thread reads through height_reader after this
+                    stop.set()
+                    while item is not done:
+                        item = result_queue.get()
+                        if isinstance(item, tuple) and item[0] == 'analyzed':
+                            item[2].cancel()
+                inference_thread.join()
+                for thread in readers:
+                    thread.join()
+        
+        return processed_tiles, successful_tiles, failed_tiles, skipped_tiles
+
+
+    def _run_tile_process_pool(self, tile_source, expected_tiles, total_results, params, manifest=None):
+        """
+        Analyze tiles in worker processes, each with its own model and torch thread pool.
+        Tiles are handed out in slices of one YOLO batch and at most two slices per
+        worker are in flight, so streamed tiles are not all read up front.
+        The per-tile results are merged here, into the same totals as the threaded pipeline,
+        and each tile's outcome is recorded in the tile manifest, if given. A slice whose
+        worker crashes counts as failed tiles; a broken pool is replaced and the run goes on.
+        Workers that cannot start (e.g. cannot load the run's inference backend) stop the run.
+        Returns (processed_tiles, successful_tiles, failed_tiles, skipped_tiles), the last
+        being a list of {'tile', 'reason', 'detail'} for tiles gated out before inference.
+        """
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        from concurrent.futures.process import BrokenProcessPool
+        
+        workers = params['process_workers']
+        chunk_size = params['batch_size']
+        print(f"Running tile analysis in {workers} worker process(es), "
+              f"{params['torch_threads']} torch thread(s) each, slices of {chunk_size} tile(s)")
+        
+        worker_state = {
+            'dhm_path': self.dhm_path,
+            'dtm_path': self.dtm_path,
+            'ndsm_path': self.ndsm_path,
+            'aligned_paths': dict(self.aligned_paths),
+            'inference_backend': inference_backend,
+            'params': params
+        }
+        
+        def chunks():
+            chunk = []
+            for tile_metadata in tile_source:
+                chunk.append(tile_metadata)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        
+        def new_pool():
+            # Spawn, not fork: the parent holds Tk and torch threads that must not be forked
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=_tile_worker_init,
+                                       initargs=(worker_state, params['torch_threads']))
+            # A worker whose _tile_worker_init fails breaks the pool; every replacement would too
+            try:
+                pool.submit(_tile_worker_ready).result()
+            except BrokenProcessPool as e:
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise RuntimeError(f"Worker processes could not start (see the log): {e}") from e
+            return pool
+        
+        processed_tiles = successful_tiles = failed_tiles = 0
+        skipped_tiles = []
+        pool = new_pool()
+        try:
+            pending = {}  # future -> (tile labels of its slice, pool it was submitted to)
+            chunk_iter = chunks()
+            exhausted = False
+            while pending or not exhausted:
+                while not exhausted and len(pending) < 2 * workers:
+                    try:
+                        chunk = next(chunk_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending[pool.submit(_tile_worker_run, chunk)] = ([TileManifest.tile_key(t) for t in chunk], pool)
+                if not pending:
+                    break
+                
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    labels, future_pool = pending.pop(future)
+                    try:
+                        outcomes = future.result()
+                    except Exception as e:
+                        # A crashed worker (e.g. killed for memory) or an unpicklable result only
+                        # fails this slice; the run goes on
+                        print(f"❌ Worker failed on {len(labels)} tile(s): {e}")
+                        outcomes = [(label, None, None, None) for label in labels]
+                        if isinstance(e, BrokenProcessPool) and future_pool is pool:
+                            # The other slices in flight on the broken pool fail the same way
+                            print("♻️ Restarting the worker processes")
+                            pool.shutdown(wait=False, cancel_futures=True)
+                            pool = new_pool()
+                    for label, tile_results, skip, tile_info in outcomes:
+                        processed_tiles += 1
+                        if skip:
+                            skipped_tiles.append(dict(skip, tile=label))
+                            status = 'skipped'
+                        elif tile_results:
+                            self._accumulate_tile_results(total_results, tile_results)
+                            successful_tiles += 1
+                            status = 'done'
+                        else:
+                            failed_tiles += 1
+                            print(f"Warning: Tile {label} analysis failed, skipping...")
+                            status = 'failed'
+                        if manifest is not None:
+                            manifest.record(label, status, skip['reason'] if skip else None,
+                                            tile_results.get('detections') if tile_results else None, tile_info)
+                
+                # Update progress
+                progress = min(100.0, processed_tiles / expected_tiles * 100)
+                status_msg = f"Processed {processed_tiles}/{expected_tiles} coordinate-aware tiles ({progress:.1f}%) - Success: {successful_tiles}, Failed: {failed_tiles}, Skipped: {len(skipped_tiles)}"
+                self.root.after(0, lambda msg=status_msg: self.update_status(msg, "🔍"))
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        
+        return processed_tiles, successful_tiles, failed_tiles, skipped_tiles
+
+    def compute_spectral_mask(self, data, vari_threshold=0.1, ndwi_threshold=0.2, nir_band=None, block_rows=256):
+        """
+        Vegetation/water mask of a CHW tile with bands R, G, B first: True where
+        VARI = (G − R) / (G + R − B) > vari_threshold (vegetation) or, when nir_band
+        (0-based) is given, NDWI = (G − NIR) / (G + NIR) > ndwi_threshold (water).
+        Computed in strips of block_rows rows with reused float32 buffers, so only
+        the output mask is allocated per tile.
+        """
+        bands, height, width = data.shape
+        mask = np.zeros((height, width), dtype=bool)
+        if bands < 3 or height == 0:
+            return mask
+        
+        rows = min(block_rows, height)
+        num = np.empty((rows, width), dtype=np.float32)
+        den = np.empty_like(num)
+        hit = np.empty((rows, width), dtype=bool)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for top in range(0, height, rows):
+                bottom = min(height, top + rows)
+                n = bottom - top
+                red, green, blue = data[0, top:bottom], data[1, top:bottom], data[2, top:bottom]
+                nu, de, out = num[:n], den[:n], mask[top:bottom]
+                
+                # VARI (0/0 on empty pixels gives NaN, which never passes the threshold)
+                np.subtract(green, red, out=nu, dtype=np.float32)
+                np.add(green, red, out=de, dtype=np.float32)
+                np.subtract(de, blue, out=de, dtype=np.float32)
+                np.divide(nu, de, out=nu)
+                np.greater(nu, vari_threshold, out=out)
+                
+                # NDWI needs the near-infrared band
+                if nir_band is not None and 3 <= nir_band < bands:
+                    nir = data[nir_band, top:bottom]
+                    np.subtract(green, nir, out=nu, dtype=np.float32)
+                    np.add(green, nir, out=de, dtype=np.float32)
+                    np.divide(nu, de, out=nu)
+                    np.greater(nu, ndwi_threshold, out=hit[:n])
+                    np.logical_or(out, hit[:n], out=out)
+        
+        return mask
+
+    def _tile_content_key(self, tile_metadata, data):
+        """
+        Identity of a tile's pixels: the source raster (path, size, mtime) plus the
+        window for streamed tiles, the tile file itself for saved tiles, and a hash
+        of the array when the tile only exists in memory.
+        """
+        window = tile_metadata.get('window')
+        source = tile_metadata.get('source_path') if window is not None else tile_metadata.get('path')
+        if source and os.path.exists(source):
+            key = [os.path.abspath(source), os.path.getsize(source), os.path.getmtime(source)]
+            if window is not None:
+                key.extend([window.col_off, window.row_off, window.width, window.height])
+            return hashlib.sha1(json.dumps(key).encode()).hexdigest()
+        return hashlib.sha1(np.ascontiguousarray(data).data).hexdigest()
+
+    def _spectral_mask_for_tile(self, tile_metadata, data, params):
+        """
+        Spectral mask of one tile, cached as packed bits in the tiles' _masks folder.
+        A cached mask is reused only for the same tile content, thresholds and NIR band.
+        """
+        cache_dir = params.get('mask_cache_dir')
+        tile_id = tile_metadata.get('tile_id') or os.path.splitext(os.path.basename(tile_metadata['path']))[0]
+        cache_path = os.path.join(cache_dir, f"{tile_id}.mask.npz") if cache_dir else None
+        nir_band = params.get('nir_band')
+        thresholds = np.array([params['vari_threshold'], params['ndwi_threshold'],
+                               -1 if nir_band is None else nir_band], dtype=np.float32)
+        shape = np.array(data.shape[1:])
+        source = np.array(self._tile_content_key(tile_metadata, data)) if cache_path else None
+        
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cached:
+                    if (np.array_equal(cached['thresholds'], thresholds) and np.array_equal(cached['shape'], shape)
+                            and 'source' in cached.files and str(cached['source']) == str(source)):
+                        return np.unpackbits(cached['packed'], axis=-1, count=int(shape[1])).astype(bool)
+            except Exception as e:
+                print(f"  ⚠️ Ignoring unreadable mask cache {cache_path}: {e}")
+        
+        mask = self.compute_spectral_mask(data, params['vari_threshold'], params['ndwi_threshold'], nir_band)
+        if cache_path:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.savez(cache_path, packed=np.packbits(mask, axis=-1), shape=shape, thresholds=thresholds,
+                         source=source)
+            except Exception as e:
+                print(f"  ⚠️ Could not cache mask for {tile_id}: {e}")
+        return mask
+
+    def _scene_path(self):
+        """Raster the analysis tiles are cut from (aligned optical if available)"""
+        if not self.is_tif_file:
+            return None
+        return self.aligned_paths.get("optical") or self.file_path
+
+    def _resolve_nir_band(self):
+        """
+        0-based near-infrared band of the scene for NDWI: the configured band number,
+        or with "auto" the first band whose description names NIR / near infrared.
+        Returns None when the band is unknown, which leaves NDWI out of the mask.
+        """
+        choice = str(self.nir_band.get()).strip().lower()
+        if choice not in ('', 'auto'):
+            try:
+                band = int(choice)
+            except ValueError:
+                print(f"⚠️ Invalid NIR band '{choice}'; NDWI water masking disabled")
+                return None
+            return band - 1 if band >= 1 else None
+        
+        scene_path = self._scene_path()
+        if not scene_path or not os.path.exists(scene_path):
+            return None
+        try:
+            with rasterio.open(scene_path) as src:
+                descriptions = src.descriptions
+        except Exception as e:
+            print(f"⚠️ Could not read band descriptions of {scene_path}: {e}")
+            return None
+        for index, description in enumerate(descriptions):
+            name = (description or '').lower().replace('-', ' ')
+            if name == 'nir' or name.startswith('nir ') or 'near infrared' in name or 'nearinfrared' in name:
+                return index
+        return None
+
+    def _get_scene_stretch(self):
+        """
+        Per-band 2–98% stretch of the current scene, computed once and then reused by
+        YOLO preprocessing, tile previews and annotated tiles. Also reused from the run
+        manifest when the scene file is unchanged. Returns None without a scene.
+        """
+        scene_path = self._scene_path()
+        if not scene_path or not os.path.exists(scene_path):
+            return None
+        scene_key = [os.path.abspath(scene_path), os.path.getsize(scene_path), os.path.getmtime(scene_path)]
+        
+        cached = getattr(self, 'scene_stretch', None)
+        if cached and cached.get('scene') == scene_key:
+            return cached
+        
+        stretch = self._read_run_manifest().get('radiometry')
+        if not stretch or stretch.get('scene') != scene_key:
+            stretch = self._compute_scene_stretch(scene_path)
+            stretch['scene'] = scene_key
+            self._update_run_manifest('radiometry', stretch)
+        self.scene_stretch = stretch
+        return stretch
 
-    def preprocess_tile_for_yolo_enhanced(self, tile_path: str) -> str:
+    def _compute_scene_stretch(self, scene_path, percentiles=(2, 98), max_side=1024):
         """
-        Always return a temporary 3-channel RGB PNG suitable for YOLO.
-        The caller may delete the returned file when done.
+        Estimate per-band percentiles of a scene from a decimated read, like
+        image_to_tiles.py. GDAL serves the read from overviews when the file has them.
+        Nodata and zero fill are excluded.
         """
+        with rasterio.open(scene_path) as src:
+            bands = [1, 2, 3] if src.count >= 3 else [1]
+            factor = max(1, int(math.ceil(max(src.width, src.height) / max_side)))
+            out_shape = (len(bands), max(1, src.height // factor), max(1, src.width // factor))
+            print(f"📊 Computing scene {percentiles[0]}–{percentiles[1]}% percentiles "
+                  f"(1/{factor} resolution, {len(src.overviews(1))} overview level(s))...")
+            sample = src.read(bands, out_shape=out_shape, masked=True,
+                              resampling=RasterioResampling.nearest)
+        
+        low, high = [], []
+        for band in sample:
+            values = band.compressed().astype(np.float64)
+            values = values[np.isfinite(values) & (values != 0)]
+            if values.size == 0:
+                low.append(0.0)
+                high.append(255.0)
+                continue
+            p_low, p_high = np.percentile(values, percentiles)
+            low.append(float(p_low))
+            high.append(float(p_high) if p_high > p_low else float(p_low) + 1.0)
+        
+        print(f"✅ Percentiles per band: {list(zip(low, high))}")
+        return {'bands': bands, 'percentiles': list(percentiles), 'low': low, 'high': high}
+
+    def _run_manifest_path(self):
+        """JSON manifest of per-scene run artefacts, next to the tiles"""
+        if not self.tiles_save_path:
+            return None
+        return os.path.join(self.tiles_save_path, "run_manifest.json")
+
+    def _tile_manifest(self):
+        """TileManifest of the tiles folder (None before a save location is chosen)"""
+        if not self.tiles_save_path:
+            return None
+        return TileManifest(os.path.join(self.tiles_save_path, TileManifest.FILENAME))
+
+    def _restore_tiles_from_manifest(self):
+        """
+        Reload the tile set of the selected TIF from the tiles folder's manifest, so tiles
+        generated in an earlier session can be analysed without regenerating them.
+        Returns True if tiles were restored.
+        """
+        manifest_path = os.path.join(self.tiles_save_path, TileManifest.FILENAME) if self.tiles_save_path else None
+        if not (self.file_path and self.is_tif_file and manifest_path and os.path.exists(manifest_path)):
+            return False
+        try:
+            manifest = TileManifest(manifest_path)
+            scene = manifest.scene()
+            if scene.get('source') != os.path.abspath(self.file_path):
+                return False
+            aligned_paths = {label: p for label, p in scene.get('aligned_paths', {}).items() if os.path.exists(p)}
+            tiles = [] if scene.get('streamed') else manifest.load_tiles()
+            if (scene.get('streamed') and 'optical' not in aligned_paths) or (not scene.get('streamed') and not tiles):
+                return False
+        except Exception as e:
+            print(f"⚠️ Could not restore tiles from {manifest_path}: {e}")
+            return False
+        
+        self.aligned_paths = aligned_paths
+        self.tile_metadata_list = tiles
+        self.tile_plan = None
+        self.tile_area_sqm.set(scene['tile_area'])
+        self.snap_tiles_to_blocks.set(bool(scene.get('snap_tiles_to_blocks', False)))
+        self.stream_tiles.set(bool(scene.get('streamed')))
+        self.tiles_generated = True
+        counts = manifest.status_counts()
+        done = counts.get('done', 0) + counts.get('skipped', 0)
+        if scene.get('streamed'):
+            text = f"✅ Restored streaming setup from {scene.get('created')} ({done} tiles analysed before); CRS {scene.get('target_crs')}."
+        else:
+            text = f"✅ Restored {len(tiles)} tiles from {scene.get('created')} ({done} analysed before); CRS {scene.get('target_crs')}."
+        print(text)
+        self.tiles_status.config(text=text)
+        self.update_validation_status()
+        return True
+
+    def _read_run_manifest(self):
+        """Current run manifest as a dict (empty if missing or unreadable)"""
+        manifest_path = self._run_manifest_path()
+        if not manifest_path or not os.path.exists(manifest_path):
+            return {}
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ Could not read run manifest: {e}")
+            return {}
+
+    def _update_run_manifest(self, section, value):
+        """Store one section of the run manifest, replacing the file atomically"""
+        manifest_path = self._run_manifest_path()
+        if not manifest_path:
+            return
+        try:
+            manifest = self._read_run_manifest()
+            manifest[section] = value
+            os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+            part_path = manifest_path + ".part"
+            with open(part_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, default=str)
+            os.replace(part_path, manifest_path)
+        except Exception as e:
+            print(f"⚠️ Could not write run manifest: {e}")
+
+    def _stretch_lut(self, stretch: dict, dtype: np.dtype) -> np.ndarray:
+        """
+        (bands, 2**bits) uint8 lookup table of the scene stretch for 8/16-bit integer data,
+        indexed by the raw value reinterpreted as unsigned (so int16 works via a view).
+        Built once per stretch and dtype: 65536 entries per band for uint16 imagery.
+        """
+        key = (dtype.str, tuple(stretch['low']), tuple(stretch['high']))
+        luts = getattr(self, '_stretch_luts', None)
+        if luts is None:
+            luts = self._stretch_luts = {}
+        lut = luts.get(key)
+        if lut is None:
+            unsigned = np.dtype(f"u{dtype.itemsize}")
+            values = np.arange(2 ** (8 * dtype.itemsize), dtype=np.int64).astype(unsigned).view(dtype)
+            lut = np.empty((len(stretch['low']), values.size), dtype=np.uint8)
+            for j, (low, high) in enumerate(zip(stretch['low'], stretch['high'])):
+                # Same float32 steps as the per-pixel path so both round identically
+                band = values.astype(np.float32)
+                band -= low
+                band *= 255.0 / (high - low)
+                np.clip(band, 0, 255, out=band)
+                lut[j] = band
+            luts[key] = lut
+        return lut
+
+    def _tile_array_to_rgb(self, data: np.ndarray, stretch: Optional[dict] = None) -> np.ndarray:
+        """
+        Convert a CHW tile array (any band count / dtype) to 3-channel uint8 HWC.
+        With a scene stretch (see _get_scene_stretch) every tile gets the same per-band
+        mapping; without one the tile is normalised by its own min/max.
+        8/16-bit integer tiles go through the stretch lookup table, one np.take per band.
+        """
+        if stretch is not None and data.dtype.kind in 'ui' and data.dtype.itemsize <= 2:
+            lut = self._stretch_lut(stretch, data.dtype)
+            indices = data.view(f"u{data.dtype.itemsize}")
+            planes = np.empty((3,) + data.shape[1:], dtype=np.uint8)
+            for i in range(3):
+                band = min(i, data.shape[0] - 1)
+                # mode='clip' lets np.take write straight into the output plane
+                np.take(lut[min(i, len(lut) - 1)], indices[band], out=planes[i], mode='clip')
+            return planes.transpose(1, 2, 0)
+
+        # Build 3 channels
+        if data.shape[0] >= 3:
+            data = data[:3].transpose(1, 2, 0)  # CHW -> HWC
+        else:
+            band = data[0]
+            data = np.stack([band, band, band], axis=2)
+
+        if stretch is not None:
+            # Float (or 32-bit) data: same mapping, computed per pixel
+            n_bands = len(stretch['low'])
+            out = np.empty(data.shape, dtype=np.uint8)
+            for i in range(3):
+                j = min(i, n_bands - 1)
+                low, high = stretch['low'][j], stretch['high'][j]
+                band = data[:, :, i].astype(np.float32)
+                band -= low
+                band *= 255.0 / (high - low)
+                np.clip(band, 0, 255, out=band)
+                band[np.isnan(band)] = 0
+                out[:, :, i] = band
+            return out
+
+        # Normalize to 0–255
+        data = data.astype(np.float32)
+        dmin, dmax = np.nanmin(data), np.nanmax(data)
+        if dmax > dmin:
+            data = (data - dmin) / (dmax - dmin) * 255.0
+        else:
+            data = np.full_like(data, 128, dtype=np.float32)
+        return np.clip(data, 0, 255).astype(np.uint8)
+
+    def preprocess_tile_for_yolo_array(self, tile_path: str, tile_data: Optional[np.ndarray] = None,
+                                       mask: Optional[np.ndarray] = None,
+                                       stretch: Optional[dict] = None) -> np.ndarray:
+        """
+        Return a contiguous 3-channel uint8 HWC array that can be passed straight to
+        model.predict. Channels are BGR, which is what Ultralytics assumes for ndarray
+        sources (same as a cv2.imread'd file). If tile_data (CHW array of a streamed
+        tile) is given, tile_path is not read. Pixels where mask is True (spectral
+        mask) are painted YOLO's letterbox gray so the detector ignores them.
+        GeoTIFF tiles are converted with the scene stretch if one is given.
+        """
+        image_bgr = self._preprocess_tile_bgr(tile_path, tile_data, stretch)
+        if mask is not None and mask.shape == image_bgr.shape[:2]:
+            image_bgr[mask] = 114
+        return image_bgr
+
+    def _preprocess_tile_bgr(self, tile_path: str, tile_data: Optional[np.ndarray] = None,
+                             stretch: Optional[dict] = None) -> np.ndarray:
+        """Unmasked body of preprocess_tile_for_yolo_array"""
         try:
-            import tempfile
+            # In-memory tile (streaming mode)
+            if tile_data is not None:
+                return np.ascontiguousarray(self._tile_array_to_rgb(tile_data, stretch)[:, :, ::-1])
 
             # TIFF / GeoTIFF
             if tile_path.lower().endswith(('.tif', '.tiff')):
                 with rasterio.open(tile_path) as src:
-                    # Build 3 channels
-                    if src.count >= 3:
-                        data = src.read([1, 2, 3]).transpose(1, 2, 0)  # CHW -> HWC
-                    else:
-                        band = src.read(1)
-                        data = np.stack([band, band, band], axis=2)
-
-                # Normalize to 0–255 for PNG
-                data = data.astype(np.float32)
-                dmin, dmax = np.nanmin(data), np.nanmax(data)
-                if dmax > dmin:
-                    data = (data - dmin) / (dmax - dmin) * 255.0
-                else:
-                    data = np.full_like(data, 128, dtype=np.float32)
-                data = np.clip(data, 0, 255).astype(np.uint8)
-
-                tmp = tempfile.mktemp(suffix='.png')
-                Image.fromarray(data, mode='RGB').save(tmp, 'PNG')
-                return tmp
+                    data = src.read([1, 2, 3] if src.count >= 3 else [1])
+                return np.ascontiguousarray(self._tile_array_to_rgb(data, stretch)[:, :, ::-1])
 
             # Regular image files
             image = cv2.imread(tile_path, cv2.IMREAD_UNCHANGED)
             if image is None:
                 raise Exception("Could not load image file")
 
-            # Ensure 3 channels RGB
+            # Ensure 3 channels BGR
             if len(image.shape) == 2:  # grayscale
-                image_rgb = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+                image_bgr = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
             elif len(image.shape) == 3:
                 if image.shape[2] == 3:
-                    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                    image_bgr = image
                 elif image.shape[2] == 4:
-                    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+                    image_bgr = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
                 elif image.shape[2] == 1:
-                    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                    image_bgr = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
                 else:
                     raise Exception(f"Unexpected channel count: {image.shape[2]}")
             else:
                 raise Exception(f"Unexpected image shape: {image.shape}")
 
-            tmp = tempfile.mktemp(suffix='.png')
-            Image.fromarray(image_rgb, mode='RGB').save(tmp, 'PNG')
-            return tmp
+            if image_bgr.dtype != np.uint8:
+                # e.g. 16-bit PNG: stretch like a TIFF tile (HWC -> CHW -> RGB -> BGR)
+                image_bgr = self._tile_array_to_rgb(image_bgr[:, :, ::-1].transpose(2, 0, 1))[:, :, ::-1]
+
+            return np.ascontiguousarray(image_bgr)
 
         except Exception as e:
             # Safe fallback so the pipeline never crashes
-            import tempfile
-            tmp = tempfile.mktemp(suffix='.png')
-            Image.fromarray(np.full((640, 640, 3), 128, dtype=np.uint8), mode='RGB').save(tmp, 'PNG')
             print(f"    ❌ Preprocess failed ({e}). Using fallback RGB image.")
-            return tmp
+            return np.full((640, 640, 3), 128, dtype=np.uint8)
 
     
 
@@ -2962,7 +5294,7 @@ class BuildingCountPopulationEstimator:
             'standard_houses': 0,
             'medium_houses': 0,
             'large_houses': 0,
-            'building_details': [],
+            'building_details': DetectionStore(world_na='N/A - Single Image'),
             'processing_method': 'Coordinate-Aware Building Count Analysis (Single Image)' + (' with Floor Calculation' if self.use_height_calculation.get() else ''),
             'tile_count': 1,
             'tile_area': 'N/A - Single Image',
@@ -2981,16 +5313,12 @@ class BuildingCountPopulationEstimator:
         }
 
         try:
-            # Run YOLO detection
-            processed_image_path = self.preprocess_tile_for_yolo(image_path)
-            yolo_results = model.predict(source=processed_image_path, save=False, imgsz=640)
-
-            # Clean up temporary file if created
-            if processed_image_path != image_path and os.path.exists(processed_image_path):
-                try:
-                    os.remove(processed_image_path)
-                except:
-                    pass
+            # Run YOLO detection on the in-memory array (no temp PNG)
+            image_bgr = self.preprocess_tile_for_yolo_array(image_path)
+            is_valid, validation_msg = self.validate_image_array(image_bgr)
+            if not is_valid:
+                raise ValueError(validation_msg)
+            yolo_results = model.predict(source=image_bgr, save=False, imgsz=640)
 
             # --- NEW: create annotated image and schedule GUI update safely ---
             annotated_path = None
@@ -3029,73 +5357,14 @@ class BuildingCountPopulationEstimator:
                 result = yolo_results[0]
 
                 if result.boxes is not None and len(result.boxes) > 0:
-                    for i, box in enumerate(result.boxes):
-                        # Extract detection information
-                        x_center, y_center, width, height = box.xywh[0].cpu().numpy()
-                        confidence = float(box.conf[0].cpu().numpy())
-                        class_id = int(box.cls[0].cpu().numpy())
-
-                        # Calculate building area in square meters
-                        building_area_px = width * height
-                        building_area_sqm = building_area_px * (self.ground_sample_distance ** 2)
-
-                        # For single images, default floor calculation is 1 unless height data is available
-                        floors = 1
-
-                        # Only count residential buildings for population
-                        if class_id == 0:  # Residential
-                            results['residential_count'] += 1
-
-                            # Determine house category and population multiplier
-                            if building_area_sqm < self.medium_house_threshold.get():
-                                house_category = "Standard"
-                                population_multiplier = 1
-                                results['standard_houses'] += 1
-                            elif building_area_sqm < self.large_house_threshold.get():
-                                house_category = "Medium"
-                                population_multiplier = 2
-                                results['medium_houses'] += 1
-                            else:
-                                house_category = "Large"
-                                population_multiplier = 3
-                                results['large_houses'] += 1
-
-                            # Calculate base and final population
-                            base_population = population_multiplier * self.people_per_household.get()
-                            final_population = base_population * floors
-
-                            results['total_base_population'] += base_population
-                            results['total_population'] += final_population
-                            results['total_floors'] += floors
-                        else:
-                            results['non_residential_count'] += 1
-                            house_category = "Non-Residential"
-                            population_multiplier = 0
-                            base_population = 0
-                            final_population = 0
-
-                        # Store building details
-                        building_detail = {
-                            'detection_id': i,
-                            'pixel_x': float(x_center),
-                            'pixel_y': float(y_center),
-                            'world_x': 'N/A - Single Image',
-                            'world_y': 'N/A - Single Image',
-                            'width_px': float(width),
-                            'height_px': float(height),
-                            'area_sqm': building_area_sqm,
-                            'confidence': confidence,
-                            'class_id': class_id,
-                            'class_name': class_names.get(class_id, 'Unknown'),
-                            'house_category': house_category,
-                            'population_multiplier': population_multiplier,
-                            'base_population': base_population,
-                            'floors': floors,
-                            'final_population': final_population,
-                            'bbox': box.xyxy[0].cpu().numpy().tolist()
-                        }
-
-                        results['building_details'].append(building_detail)
+                    # For single images, default floor calculation is 1 unless height data is available
+                    detections = self._detections_from_result(result, self._snapshot_analysis_params())
+                    image_results = self._summarize_detections(detections, {'use_height': False})
+                    for key in ('residential_count', 'non_residential_count', 'total_population',
+                                'total_base_population', 'standard_houses', 'medium_houses',
+                                'large_houses', 'total_floors'):
+                        results[key] += image_results[key]
+                    results['building_details'].append(detections)
 
         except Exception as e:
             print(f"Error analyzing single image: {e}")
@@ -3380,12 +5649,12 @@ class BuildingCountPopulationEstimator:
         
         if results['floor_calculation_enabled']:
             # Calculate average floors per category from building details
-            standard_floors = sum([b['floors'] for b in results.get('building_details', []) 
-                                 if b['house_category'] == 'Standard']) or 0
-            medium_floors = sum([b['floors'] for b in results.get('building_details', []) 
-                               if b['house_category'] == 'Medium']) or 0
-            large_floors = sum([b['floors'] for b in results.get('building_details', []) 
-                              if b['house_category'] == 'Large']) or 0
+            building_details = results['building_details']
+            floors = building_details.column('floors')
+            house_categories = building_details.column('house_category')
+            standard_floors = int(floors[house_categories == 'Standard'].sum())
+            medium_floors = int(floors[house_categories == 'Medium'].sum())
+            large_floors = int(floors[house_categories == 'Large'].sum())
             
             standard_pop = standard_floors * people_per_household
             medium_pop = medium_floors * people_per_household  
@@ -3446,14 +5715,14 @@ class BuildingCountPopulationEstimator:
         ax3 = fig.add_subplot(gs[1, :])
         
         # Get floor data from building details
-        building_details = results.get('building_details', [])
-        residential_buildings = [b for b in building_details if b['class_id'] == 0]
+        residential_buildings = results['building_details'].residential()
         
-        if residential_buildings:
-            floors_data = [b['floors'] for b in residential_buildings]
+        if len(residential_buildings):
+            floors_data = residential_buildings.column('floors')
+            house_categories = residential_buildings.column('house_category')
             
             # Chart 1: Floor distribution histogram
-            ax1.hist(floors_data, bins=max(1, min(10, len(set(floors_data)))), 
+            ax1.hist(floors_data, bins=max(1, min(10, len(np.unique(floors_data)))), 
                     color='#3498db', alpha=0.7, edgecolor='white', linewidth=2)
             ax1.set_title('Floor Distribution', fontweight='bold')
             ax1.set_xlabel('Number of Floors')
@@ -3464,9 +5733,9 @@ class BuildingCountPopulationEstimator:
             categories = ['Standard', 'Medium', 'Large']
             avg_floors = []
             for cat in categories:
-                cat_buildings = [b for b in residential_buildings if b['house_category'] == cat]
-                if cat_buildings:
-                    avg_floors.append(sum(b['floors'] for b in cat_buildings) / len(cat_buildings))
+                cat_floors = floors_data[house_categories == cat]
+                if len(cat_floors):
+                    avg_floors.append(float(cat_floors.mean()))
                 else:
                     avg_floors.append(0)
             
@@ -3485,8 +5754,8 @@ class BuildingCountPopulationEstimator:
             ax2.grid(axis='y', alpha=0.3, linestyle='--')
             
             # Chart 3: Population impact comparison
-            base_populations = [b['base_population'] for b in residential_buildings]
-            final_populations = [b['final_population'] for b in residential_buildings]
+            base_populations = residential_buildings.column('base_population')
+            final_populations = residential_buildings.column('final_population')
             
             x = range(min(20, len(residential_buildings)))  # Show first 20 buildings
             width = 0.35
@@ -3538,22 +5807,16 @@ class BuildingCountPopulationEstimator:
             # Load tile as RGB for drawing
             if tile_path.lower().endswith(('.tif', '.tiff')):
                 with rasterio.open(tile_path) as src:
-                    if src.count >= 3:
-                        data = src.read([1, 2, 3]).transpose(1, 2, 0)
-                    else:
-                        band = src.read(1)
-                        data = np.stack([band, band, band], axis=2)
-                    data = data.astype(np.float32)
-                    dmin, dmax = np.nanmin(data), np.nanmax(data)
-                    data = ((data - dmin) / (dmax - dmin) * 255.0) if dmax > dmin else np.full_like(data, 128)
-                    image = np.clip(data, 0, 255).astype(np.uint8)
+                    data = src.read([1, 2, 3] if src.count >= 3 else [1])
+                # cv2 drawing needs a contiguous image
+                image = np.ascontiguousarray(self._tile_array_to_rgb(data, self._get_scene_stretch()))
             else:
                 image = cv2.cvtColor(cv2.imread(tile_path), cv2.COLOR_BGR2RGB)
 
             h, w = image.shape[:2]
 
             # Pick detections that belong to this tile
-            tile_detections = [d for d in results.get('building_details', []) if d.get('tile_path') == tile_path]
+            tile_detections = results['building_details'].for_tile(tile_path).records()
 
             for d in tile_detections:
                 x_center = d.get('pixel_x', 0.0)
@@ -3601,40 +5864,29 @@ class BuildingCountPopulationEstimator:
             print(f"Error in display_processed_tile: {e}")
 
 
-    def display_processed_single_image(self, _results):
-        """Display processed single image with detection overlays (uses RGB preprocessed image)."""
-        processed_path = None
+    def display_processed_single_image(self, results):
+        """Display the single image with the detections of its analysis results drawn on it (no second YOLO pass)."""
         try:
-            # Always convert to 3-channel RGB PNG before running YOLO
-            processed_path = self.preprocess_tile_for_yolo_enhanced(self.file_path)
-
-            image = cv2.imread(processed_path)
-            if image is None:
-                raise Exception("Could not load preprocessed image for display")
-
-            # Run YOLO on the preprocessed RGB image (not on the original path)
-            results_display = model.predict(source=processed_path, save=False, imgsz=640, verbose=False)
-
-            if results_display and len(results_display) > 0:
-                result = results_display[0]
-                if result.boxes is not None and len(result.boxes) > 0:
-                    for box in result.boxes:
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        class_id = int(box.cls[0].cpu().numpy())
-                        confidence = float(box.conf[0].cpu().numpy())
-
-                        color = colors.get(class_id, (255, 255, 255))
-                        label = f"{class_names.get(class_id, 'Unknown')} {confidence:.2f}"
-
-                        # Draw box
-                        cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
-
-                        # Label background + text
-                        (lw, lh) = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)[0]
-                        y_text = max(0, int(y1) - lh - 2)
-                        cv2.rectangle(image, (int(x1), y_text), (int(x1) + lw + 4, y_text + lh + 2), color, -1)
-                        cv2.putText(image, label, (int(x1) + 2, y_text + lh),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+            # Same 3-channel BGR array the detector saw
+            image = self.preprocess_tile_for_yolo_array(self.file_path)
+
+            details = results.get('building_details')
+            if details is not None and len(details) > 0:
+                for (x1, y1, x2, y2), class_id, confidence in zip(details.column('bbox').tolist(),
+                                                                  details.column('class_id').tolist(),
+                                                                  details.column('confidence').tolist()):
+                    color = colors.get(class_id, (255, 255, 255))
+                    label = f"{class_names.get(class_id, 'Unknown')} {confidence:.2f}"
+
+                    # Draw box
+                    cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+
+                    # Label background + text
+                    (lw, lh) = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.4, 1)[0]
+                    y_text = max(0, int(y1) - lh - 2)
+                    cv2.rectangle(image, (int(x1), y_text), (int(x1) + lw + 4, y_text + lh + 2), color, -1)
+                    cv2.putText(image, label, (int(x1) + 2, y_text + lh),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
 
             # Convert to RGB/PIL and show
             image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -3646,13 +5898,6 @@ class BuildingCountPopulationEstimator:
 
         except Exception as e:
             self.processed_label.config(text=f"❌ Error displaying image:\n{str(e)}")
-        finally:
-            # Clean up the temp file
-            if processed_path and processed_path != self.file_path and os.path.exists(processed_path):
-                try:
-                    os.remove(processed_path)
-                except:
-                    pass
 
     # ==================== Export Methods ====================
 
@@ -3669,6 +5914,8 @@ class BuildingCountPopulationEstimator:
             # If results is a dict, wrap into list
             if isinstance(results, dict):
                 results = [results]
+            elif isinstance(results, DetectionStore):
+                results = results.records()
 
             # Flatten nested dicts if necessary
             clean_results = []
@@ -3758,7 +6005,7 @@ class BuildingCountPopulationEstimator:
             writer.writerow(headers)
             
             # Building details data
-            for i, building in enumerate(results['building_details']):
+            for i, building in enumerate(results['building_details'].records()):
                 bbox = building.get('bbox', [0, 0, 0, 0])
                 row = [
                     i + 1,
@@ -3900,8 +6147,8 @@ class BuildingCountPopulationEstimator:
         ax3 = fig.add_subplot(gs[1, :])
         
         # Prepare data
-        building_details = self.analysis_results.get('building_details', [])
-        if not building_details:
+        building_details = self.analysis_results['building_details']
+        if not len(building_details):
             ax1.text(0.5, 0.5, 'No building data available', ha='center', va='center', 
                     transform=ax1.transAxes, fontsize=12)
             ax2.text(0.5, 0.5, 'No building data available', ha='center', va='center', 
@@ -3909,7 +6156,7 @@ class BuildingCountPopulationEstimator:
             ax3.text(0.5, 0.5, 'No building data available', ha='center', va='center', 
                     transform=ax3.transAxes, fontsize=12)
         else:
-            df = pd.DataFrame(building_details)
+            df = building_details.to_dataframe()
             
             # Chart 1: Confidence distribution
             confidence_data = df['confidence']
@@ -4005,14 +6252,16 @@ class BuildingCountPopulationEstimator:
             ax2 = fig.add_subplot(gs[0, 1])
             ax4 = fig.add_subplot(gs[1, :])
         
-        building_details = self.analysis_results.get('building_details', [])
+        building_details = self.analysis_results['building_details']
         
-        if building_details:
-            residential_buildings = [b for b in building_details if b['class_id'] == 0]
+        if len(building_details):
+            residential_buildings = building_details.residential()
             
-            if residential_buildings:
+            if len(residential_buildings):
+                house_categories = residential_buildings.column('house_category')
+                
                 # Chart 1: Population by building
-                populations = [b['final_population'] for b in residential_buildings]
+                populations = residential_buildings.column('final_population')
                 ax1.hist(populations, bins=15, color='#e74c3c', alpha=0.7, edgecolor='white')
                 ax1.set_title('Population per Building', fontweight='bold')
                 ax1.set_xlabel('Population')
@@ -4023,8 +6272,7 @@ class BuildingCountPopulationEstimator:
                 categories = ['Standard', 'Medium', 'Large']
                 cat_populations = []
                 for cat in categories:
-                    cat_pop = sum(b['final_population'] for b in residential_buildings 
-                                if b['house_category'] == cat)
+                    cat_pop = float(populations[house_categories == cat].sum())
                     cat_populations.append(cat_pop)
                 
                 colors = ['#27ae60', '#f39c12', '#9b59b6']
@@ -4034,11 +6282,11 @@ class BuildingCountPopulationEstimator:
                 
                 # Chart 3: Floor impact (if available)
                 if self.analysis_results['floor_calculation_enabled']:
-                    base_pops = [b['base_population'] for b in residential_buildings]
-                    final_pops = [b['final_population'] for b in residential_buildings]
+                    base_pops = residential_buildings.column('base_population')
+                    final_pops = residential_buildings.column('final_population')
                     
                     ax3.scatter(base_pops, final_pops, alpha=0.6, color='#3498db')
-                    ax3.plot([0, max(base_pops)], [0, max(base_pops)], 'r--', alpha=0.8, label='1:1 Line')
+                    ax3.plot([0, base_pops.max()], [0, base_pops.max()], 'r--', alpha=0.8, label='1:1 Line')
                     ax3.set_title('Floor Impact on Population', fontweight='bold')
                     ax3.set_xlabel('Base Population')
                     ax3.set_ylabel('Final Population (with floors)')
@@ -4046,9 +6294,9 @@ class BuildingCountPopulationEstimator:
                     ax3.grid(alpha=0.3)
                 
                 # Chart 4: Building size vs population
-                areas = [b['area_sqm'] for b in residential_buildings]
-                ax4.scatter(areas, populations, c=[colors[categories.index(b['house_category'])] 
-                           for b in residential_buildings], alpha=0.6, s=50)
+                areas = residential_buildings.column('area_sqm')
+                ax4.scatter(areas, populations, c=np.array(colors)[residential_buildings.column('category_code')], 
+                           alpha=0.6, s=50)
                 ax4.set_title('Building Area vs Population', fontweight='bold')
                 ax4.set_xlabel('Building Area (m²)')
                 ax4.set_ylabel('Population')
@@ -4080,11 +6328,10 @@ class BuildingCountPopulationEstimator:
         fig = Figure(figsize=(14, 10), facecolor='white')
         gs = fig.add_gridspec(2, 2, hspace=0.3, wspace=0.3)
         
-        building_details = self.analysis_results.get('building_details', [])
-        residential_buildings = [b for b in building_details if b['class_id'] == 0]
+        residential_buildings = self.analysis_results['building_details'].residential()
         
-        if residential_buildings and HAS_ADVANCED_LIBS:
-            df = pd.DataFrame(residential_buildings)
+        if len(residential_buildings) and HAS_ADVANCED_LIBS:
+            df = residential_buildings.to_dataframe()
             
             # Chart 1: Size distribution with categories
             ax1 = fig.add_subplot(gs[0, 0])
@@ -4174,19 +6421,17 @@ class BuildingCountPopulationEstimator:
         fig = Figure(figsize=(14, 12), facecolor='white')
         gs = fig.add_gridspec(3, 2, hspace=0.4, wspace=0.3)
         
-        building_details = self.analysis_results.get('building_details', [])
-        residential_buildings = [b for b in building_details if b['class_id'] == 0]
+        residential_buildings = self.analysis_results['building_details'].residential()
         
-        if residential_buildings:
-            floors_data = [b['floors'] for b in residential_buildings]
-            areas_data = [b['area_sqm'] for b in residential_buildings]
-            base_pop_data = [b['base_population'] for b in residential_buildings]
-            final_pop_data = [b['final_population'] for b in residential_buildings]
+        if len(residential_buildings):
+            floors_data = residential_buildings.column('floors')
+            areas_data = residential_buildings.column('area_sqm')
+            base_pop_data = residential_buildings.column('base_population')
+            final_pop_data = residential_buildings.column('final_population')
             
             # Chart 1: Floor frequency
             ax1 = fig.add_subplot(gs[0, 0])
-            unique_floors = sorted(set(floors_data))
-            floor_counts = [floors_data.count(f) for f in unique_floors]
+            unique_floors, floor_counts = np.unique(floors_data, return_counts=True)
             ax1.bar(unique_floors, floor_counts, color='#3498db', alpha=0.8)
             ax1.set_title('Floor Count Distribution', fontweight='bold')
             ax1.set_xlabel('Number of Floors')
@@ -4204,7 +6449,7 @@ class BuildingCountPopulationEstimator:
             # Chart 3: Population impact
             ax3 = fig.add_subplot(gs[1, 0])
             ax3.scatter(base_pop_data, final_pop_data, alpha=0.6, color='#e74c3c')
-            max_pop = max(max(base_pop_data), max(final_pop_data))
+            max_pop = max(base_pop_data.max(), final_pop_data.max())
             ax3.plot([0, max_pop], [0, max_pop], 'k--', alpha=0.5, label='1:1 Line')
             ax3.set_title('Population Impact of Floor Calculation', fontweight='bold')
             ax3.set_xlabel('Base Population')
@@ -4214,7 +6459,7 @@ class BuildingCountPopulationEstimator:
             
             # Chart 4: Floor efficiency
             ax4 = fig.add_subplot(gs[1, 1])
-            efficiency = [final/base if base > 0 else 1 for final, base in zip(final_pop_data, base_pop_data)]
+            efficiency = np.where(base_pop_data > 0, final_pop_data / np.maximum(base_pop_data, 1e-9), 1)
             ax4.hist(efficiency, bins=15, color='#9b59b6', alpha=0.7)
             ax4.set_title('Population Efficiency (Final/Base)', fontweight='bold')
             ax4.set_xlabel('Efficiency Ratio')
@@ -4227,16 +6472,12 @@ class BuildingCountPopulationEstimator:
             # Chart 5: Category comparison
             ax5 = fig.add_subplot(gs[2, :])
             categories = ['Standard', 'Medium', 'Large']
-            cat_data = {cat: [] for cat in categories}
-            
-            for building in residential_buildings:
-                cat = building['house_category']
-                if cat in cat_data:
-                    cat_data[cat].append(building['floors'])
+            house_categories = residential_buildings.column('house_category')
+            cat_data = {cat: floors_data[house_categories == cat] for cat in categories}
             
             # Create box plot
-            box_data = [cat_data[cat] for cat in categories if cat_data[cat]]
-            box_labels = [cat for cat in categories if cat_data[cat]]
+            box_data = [cat_data[cat] for cat in categories if len(cat_data[cat])]
+            box_labels = [cat for cat in categories if len(cat_data[cat])]
             
             if box_data:
                 bp = ax5.boxplot(box_data, labels=box_labels, patch_artist=True)
@@ -4275,8 +6516,7 @@ class BuildingCountPopulationEstimator:
         stats_text.pack(fill="both", expand=True)
         
         # Calculate and display statistics
-        building_details = self.analysis_results.get('building_details', [])
-        residential_buildings = [b for b in building_details if b['class_id'] == 0]
+        residential_buildings = self.analysis_results['building_details'].residential()
         
         stats_content = self.generate_statistical_content(residential_buildings)
         stats_text.insert(tk.END, stats_content)
@@ -4301,7 +6541,7 @@ class BuildingCountPopulationEstimator:
         content.append(f"Analysis Method: {self.analysis_results['processing_method']}")
         content.append("")
         
-        if not residential_buildings:
+        if not len(residential_buildings):
             content.append("No residential buildings detected for statistical analysis.")
             return "\n".join(content)
         
@@ -4311,7 +6551,7 @@ class BuildingCountPopulationEstimator:
         content.append(f"Total Residential Buildings: {len(residential_buildings):,}")
         
         # Area statistics
-        areas = [b['area_sqm'] for b in residential_buildings]
+        areas = residential_buildings.column('area_sqm')
         content.append(f"\nBUILDING AREA STATISTICS (m²)")
         content.append(f"  Mean:     {np.mean(areas):8.2f}")
         content.append(f"  Median:   {np.median(areas):8.2f}")
@@ -4321,7 +6561,7 @@ class BuildingCountPopulationEstimator:
         content.append(f"  Range:    {np.max(areas) - np.min(areas):8.2f}")
         
         # Confidence statistics
-        confidences = [b['confidence'] for b in residential_buildings]
+        confidences = residential_buildings.column('confidence')
         content.append(f"\nDETECTION CONFIDENCE STATISTICS")
         content.append(f"  Mean:     {np.mean(confidences):8.3f}")
         content.append(f"  Median:   {np.median(confidences):8.3f}")
@@ -4331,7 +6571,7 @@ class BuildingCountPopulationEstimator:
         
         # Floor statistics (if available)
         if self.analysis_results['floor_calculation_enabled']:
-            floors = [b['floors'] for b in residential_buildings]
+            floors = residential_buildings.column('floors')
             content.append(f"\nFLOOR COUNT STATISTICS")
             content.append(f"  Mean:     {np.mean(floors):8.2f}")
             content.append(f"  Median:   {np.median(floors):8.2f}")
@@ -4341,7 +6581,7 @@ class BuildingCountPopulationEstimator:
             content.append(f"  Mode:     {stats.mode(floors)[0]:8.0f}")
         
         # Population statistics
-        populations = [b['final_population'] for b in residential_buildings]
+        populations = residential_buildings.column('final_population')
         content.append(f"\nPOPULATION PER BUILDING STATISTICS")
         content.append(f"  Mean:     {np.mean(populations):8.2f}")
         content.append(f"  Median:   {np.median(populations):8.2f}")
@@ -4352,17 +6592,18 @@ class BuildingCountPopulationEstimator:
         # Category breakdown
         content.append(f"\nCATEGORY BREAKDOWN")
         content.append("-" * 40)
+        house_categories = residential_buildings.column('house_category')
         for category in ['Standard', 'Medium', 'Large']:
-            cat_buildings = [b for b in residential_buildings if b['house_category'] == category]
-            if cat_buildings:
-                cat_areas = [b['area_sqm'] for b in cat_buildings]
-                cat_pops = [b['final_population'] for b in cat_buildings]
-                content.append(f"\n{category.upper()} HOUSES ({len(cat_buildings)} buildings)")
+            in_category = house_categories == category
+            if in_category.any():
+                cat_areas = areas[in_category]
+                cat_pops = populations[in_category]
+                content.append(f"\n{category.upper()} HOUSES ({int(in_category.sum())} buildings)")
                 content.append(f"  Area - Mean: {np.mean(cat_areas):6.1f} m², Range: {np.min(cat_areas):6.1f}-{np.max(cat_areas):6.1f} m²")
-                content.append(f"  Population - Total: {sum(cat_pops):6.0f}, Mean: {np.mean(cat_pops):6.1f}")
+                content.append(f"  Population - Total: {cat_pops.sum():6.0f}, Mean: {np.mean(cat_pops):6.1f}")
                 
                 if self.analysis_results['floor_calculation_enabled']:
-                    cat_floors = [b['floors'] for b in cat_buildings]
+                    cat_floors = floors[in_category]
                     content.append(f"  Floors - Mean: {np.mean(cat_floors):6.1f}, Range: {np.min(cat_floors):1.0f}-{np.max(cat_floors):1.0f}")
         
         # Percentile analysis
@@ -4398,14 +6639,14 @@ class BuildingCountPopulationEstimator:
             
             # Prepare data for correlation
             df_data = {
-                'Area (m²)': [b['area_sqm'] for b in residential_buildings],
-                'Confidence': [b['confidence'] for b in residential_buildings],
-                'Population': [b['final_population'] for b in residential_buildings],
-                'Multiplier': [b['population_multiplier'] for b in residential_buildings]
+                'Area (m²)': residential_buildings.column('area_sqm'),
+                'Confidence': residential_buildings.column('confidence'),
+                'Population': residential_buildings.column('final_population'),
+                'Multiplier': residential_buildings.column('population_multiplier')
             }
             
             if self.analysis_results['floor_calculation_enabled']:
-                df_data['Floors'] = [b['floors'] for b in residential_buildings]
+                df_data['Floors'] = residential_buildings.column('floors')
             
             df = pd.DataFrame(df_data)
             
@@ -4448,6 +6689,90 @@ class BuildingCountPopulationEstimator:
             tk.Label(corr_frame, text=f"Error creating correlation analysis: {str(e)}",
                    bg="white", fg="#e74c3c", font=('Arial', 10)).pack(pady=20)
 
+# ==================== Process-Pool Tile Analysis ====================
+
+# Per-process state of a tile analysis worker (set by _tile_worker_init)
+_worker_analyzer = None
+_worker_params = None
+
+def _tile_worker_init(worker_state, torch_threads):
+    """Initialize a tile analysis worker process.
+    
+    The worker's model is the module-level one, loaded once when this process
+    imported the module and switched to the parent's inference backend (whose export
+    the parent already cached). A worker that cannot load that backend raises, so the
+    run stops instead of mixing backends. The analyzer is a GUI-free instance that only
+    carries the attributes the per-tile methods need.
+    """
+    global _worker_analyzer, _worker_params
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except Exception as e:
+        print(f"⚠️ Could not set torch threads in worker {os.getpid()}: {e}")
+    try:
+        set_inference_backend(worker_state['inference_backend'])
+    except Exception as e:
+        raise RuntimeError(f"Worker {os.getpid()} cannot load the {worker_state['inference_backend']} "
+                           f"inference backend: {e}") from e
+    
+    analyzer = object.__new__(BuildingCountPopulationEstimator)
+    analyzer.dhm_path = worker_state['dhm_path']
+    analyzer.dtm_path = worker_state['dtm_path']
+    analyzer.ndsm_path = worker_state['ndsm_path']
+    analyzer.aligned_paths = worker_state['aligned_paths']
+    # Open DSM/DTM (or the nDSM) and the streamed optical raster once per worker; they
+    # are closed when the process exits
+    analyzer.height_reader = None
+    optical_path = analyzer.aligned_paths.get("optical")
+    if optical_path or (worker_state['params']['use_height'] and ((analyzer.dhm_path and analyzer.dtm_path) or analyzer.ndsm_path)):
+        analyzer.height_reader = HeightDataReader(*analyzer._height_source_paths(), analyzer.ndsm_path, optical_path)
+    analyzer.ground_sample_distance = worker_state['params']['gsd']
+    _worker_analyzer = analyzer
+    _worker_params = worker_state['params']
+
+def _tile_worker_ready():
+    """Inference backend of an initialized worker; lets the parent check that workers start"""
+    return inference_backend
+
+def _tile_worker_run(tile_chunk):
+    """
+    Analyze a slice of tiles in a worker process.
+    Returns [(tile label, tile_results or None, skip info or None, tile_info), ...], where
+    tile_info has the metadata filled in by reading the tile here (content hash, path).
+    """
+    analyzer, params = _worker_analyzer, _worker_params
+    outcomes = []
+    prepared_batch = []
+    for tile_metadata in tile_chunk:
+        label = TileManifest.tile_key(tile_metadata)
+        prepared = None
+        try:
+            prepared = analyzer._prepare_tile_for_inference(tile_metadata, params)
+        except Exception as e:
+            print(f"Error processing tile {label}: {str(e)}")
+        finally:
+            tile_metadata.pop('array', None)
+        tile_info = {'content_hash': tile_metadata.get('content_hash'), 'path': tile_metadata.get('path')}
+        if prepared is None:
+            outcomes.append((label, None, None, tile_info))
+        elif prepared.get('skip'):
+            outcomes.append((label, None, prepared['skip'], tile_info))
+        else:
+            prepared_batch.append((label, prepared, tile_info))
+    
+    batch_size = params['batch_size']
+    for start in range(0, len(prepared_batch), batch_size):
+        batch = prepared_batch[start:start + batch_size]
+        batch_results = analyzer._predict_batch([prepared['image'] for _, prepared, _ in batch])
+        for (label, prepared, tile_info), results in zip(batch, batch_results):
+            prepared.pop('image', None)
+            tile_results = None
+            if results is not None:
+                tile_results = analyzer._postprocess_tile_detections(prepared, results, params)
+            outcomes.append((label, tile_results, None, tile_info))
+    return outcomes
+
 # ==================== Main Application ====================
 
 # Replace your main() function with this enhanced version
@@ -4481,4 +6806,7 @@ def main():
         logging.info("Application terminated")
 
 if __name__ == "__main__":
+    # Worker processes re-launch the frozen executable; let them run their task instead of the GUI
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,294 @@
+"""
+Unit tests for the tiling and analysis helpers of main.py.
+main.py loads the YOLO weights (best.pt, from the working directory) on import, so
+run these from the folder that holds them:  python -m pytest test_main.py
+"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+rasterio = pytest.importorskip("rasterio")
+pytest.importorskip("ultralytics")
+if not os.path.exists("best.pt"):
+    pytest.skip("main.py loads best.pt from the working directory on import", allow_module_level=True)
+
+import main
+from rasterio.transform import from_origin
+from rasterio.windows import from_bounds
+
+
+def make_app(**attrs):
+    """Estimator without its Tk window, with just the state the tested methods use"""
+    app = object.__new__(main.BuildingCountPopulationEstimator)
+    app.tile_plan_cache = {}
+    app.tile_plan_cache_lock = threading.Lock()
+    for name, value in attrs.items():
+        setattr(app, name, value)
+    return app
+
+
+def write_raster(path, data, nodata=0, overviews=()):
+    """Single-band uint8 GeoTIFF at 1 m pixels in a UTM CRS, with 'average' overviews"""
+    with rasterio.open(path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                       dtype="uint8", crs="EPSG:32633", transform=from_origin(500000, 4000000, 1, 1),
+                       nodata=nodata, tiled=True, blockxsize=256, blockysize=256) as dst:
+        dst.write(data, 1)
+        if overviews:
+            dst.build_overviews(list(overviews), rasterio.enums.Resampling.average)
+    return path
+
+
+def non_empty_cells(ds, plan):
+    """Grid cells of a plan whose window holds at least one valid pixel"""
+    xs, ys = plan['xs'], plan['ys']
+    cells = set()
+    for r in range(len(ys) - 1):
+        for c in range(len(xs) - 1):
+            window = from_bounds(xs[c], ys[r + 1], xs[c + 1], ys[r], transform=ds.transform)
+            if ds.read_masks(1, window=window, boundless=True).any():
+                cells.add((r, c))
+    return cells
+
+
+@pytest.fixture
+def nodata_border():
+    """Valid data in the middle, a wide nodata border and a few lone valid pixels in it"""
+    data = np.zeros((2600, 2600), dtype=np.uint8)
+    data[700:1900, 500:2000] = 120
+    for row, col in ((40, 40), (2599, 1234), (1500, 2590), (333, 2101)):
+        data[row, col] = 7
+    return data
+
+
+@pytest.mark.parametrize("overviews", [(), (2, 4)])
+def test_footprint_plan_keeps_every_non_empty_tile(tmp_path, nodata_border, overviews):
+    path = write_raster(str(tmp_path / "scene.tif"), nodata_border, overviews=overviews)
+    app = make_app()
+    with rasterio.open(path) as ds:
+        plan = app._plan_area_tiles(ds, 150.0 ** 2)
+        non_empty = non_empty_cells(ds, plan)
+
+    assert plan['outside_footprint'] > 0
+    assert non_empty <= set(plan['cells'])
+
+
+def test_footprint_plan_falls_back_to_every_cell_without_overviews(tmp_path):
+    data = np.zeros((64, 5000), dtype=np.uint8)
+    data[:, 2000:2100] = 50
+    path = write_raster(str(tmp_path / "wide.tif"), data)
+    app = make_app()
+    with rasterio.open(path) as ds:
+        assert app._valid_footprint(ds) is None
+        plan = app._plan_area_tiles(ds, 64.0 ** 2)
+
+    assert plan['outside_footprint'] == 0
+    assert len(plan['cells']) == plan['grid_cells']
+
+
+@pytest.mark.parametrize("mem_limit_mb", [128, 256, 1024, 4096])
+@pytest.mark.parametrize("num_threads", [1, 4, 16])
+def test_reproject_chunking_fits_the_memory_budget(mem_limit_mb, num_threads):
+    count, item_size, block_size = 4, 2, 512
+    threads, warp_mem_mb, chunk = make_app()._reproject_chunking(count, item_size, num_threads,
+                                                                 mem_limit_mb, block_size)
+    # Warp buffers of every thread plus the 2 x threads output chunks in flight
+    chunk_mb = chunk * chunk * count * item_size / 1024 ** 2
+    assert 1 <= threads <= num_threads
+    assert threads * warp_mem_mb <= mem_limit_mb / 2 or threads == 1
+    assert threads * warp_mem_mb + 2 * threads * chunk_mb <= mem_limit_mb
+    assert chunk % block_size == 0
+
+
+class _Tensor:
+    """Stand-in for the torch tensors of a YOLO result (.cpu().numpy())"""
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.values
+
+
+class _Result:
+    """YOLO result with the boxes of rows (cx, cy, w, h, conf, cls)"""
+    def __init__(self, rows):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        cx, cy, w, h = rows[:, :4].T
+        self.boxes = type("Boxes", (), {})()
+        self.boxes.xywh = _Tensor(rows[:, :4])
+        self.boxes.conf = _Tensor(rows[:, 4])
+        self.boxes.cls = _Tensor(rows[:, 5])
+        self.boxes.xyxy = _Tensor(np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1))
+
+
+ANALYSIS_PARAMS = {'gsd': 0.5, 'medium_threshold': 150.0, 'large_threshold': 250.0,
+                   'people_per_household': 4.23, 'use_height': True}
+
+
+def old_building_rows(detections, world_na="N/A"):
+    """Per-building dicts as tile merging built them before DetectionStore"""
+    world_ok = ~(np.isnan(detections['world_x']) | np.isnan(detections['world_y']))
+    tile_fields = {key: detections[key] for key in ('tile_path', 'tile_row', 'tile_col') if key in detections}
+    rows = []
+    for i in range(len(detections['class_id'])):
+        class_id = int(detections['class_id'][i])
+        row = dict(tile_fields)
+        row.update({
+            'detection_id': int(detections['detection_id'][i]),
+            'pixel_x': float(detections['pixel_x'][i]),
+            'pixel_y': float(detections['pixel_y'][i]),
+            'world_x': float(detections['world_x'][i]) if world_ok[i] else world_na,
+            'world_y': float(detections['world_y'][i]) if world_ok[i] else world_na,
+            'width_px': float(detections['width_px'][i]),
+            'height_px': float(detections['height_px'][i]),
+            'area_sqm': float(detections['area_sqm'][i]),
+            'confidence': float(detections['confidence'][i]),
+            'class_id': class_id,
+            'class_name': main.class_names.get(class_id, 'Unknown'),
+            'house_category': main.HOUSE_CATEGORIES[detections['category_code'][i]],
+            'population_multiplier': int(detections['population_multiplier'][i]),
+            'base_population': float(detections['base_population'][i]),
+            'floors': int(detections['floors'][i]),
+            'final_population': float(detections['final_population'][i]),
+            'bbox': detections['bbox'][i].tolist()
+        })
+        rows.append(row)
+    return rows
+
+
+def test_detection_store_matches_the_old_building_rows():
+    app = make_app()
+    tiles = [
+        ("tile_a.tif", 0, 1, [(20, 20, 10, 10, 0.9, 0), (50, 50, 30, 30, 0.8, 0), (70, 70, 40, 40, 0.7, 1)],
+         rasterio.Affine(0.5, 0, 500000, 0, -0.5, 4000000)),
+        ("tile_b.tif", 2, 3, [(80, 30, 22, 22, 0.6, 0), (10, 90, 35, 12, 0.55, 0)], None),
+    ]
+    store = main.DetectionStore()
+    expected = []
+    for path, row, col, boxes, transform in tiles:
+        floors = np.arange(1, len(boxes) + 1)
+        detections = app._detections_from_result(_Result(boxes), ANALYSIS_PARAMS, floors, transform)
+        detections.update({'tile_path': path, 'tile_row': row, 'tile_col': col})
+        store.append(detections)
+        expected.extend(old_building_rows(detections))
+
+    records = list(store.records())
+    assert len(store) == len(records) == len(expected)
+    for record, old in zip(records, expected):
+        assert record.keys() == old.keys()
+        for key, value in old.items():
+            if isinstance(value, str):
+                assert record[key] == value, key
+            else:
+                # Columns are stored in float32/int16 and friends
+                assert record[key] == pytest.approx(value, rel=1e-6), key
+
+    residential = store.residential()
+    assert len(residential) == sum(old['class_id'] == 0 for old in expected)
+    assert len(store.for_tile("tile_b.tif")) == 2
+    assert store.column('house_category').tolist() == [old['house_category'] for old in expected]
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16, np.int16])
+def test_stretch_lookup_table_matches_the_per_pixel_stretch(dtype):
+    info = np.iinfo(dtype)
+    data = np.random.default_rng(1).integers(info.min, info.max, (3, 64, 80), endpoint=True).astype(dtype)
+    stretch = {'low': [float(info.min) + 10, 3.0, -7.5], 'high': [float(info.max) - 20, 200.0, 180.25]}
+    app = make_app()
+
+    lut_rgb = app._tile_array_to_rgb(data, stretch)
+    # Float input takes the per-pixel arithmetic the table replaced
+    per_pixel_rgb = app._tile_array_to_rgb(data.astype(np.float32), stretch)
+
+    assert lut_rgb.dtype == np.uint8 and lut_rgb.shape == (64, 80, 3)
+    np.testing.assert_array_equal(lut_rgb, per_pixel_rgb)
+
+
+@pytest.mark.parametrize("with_terrain", [True, False])
+@pytest.mark.filterwarnings("ignore:All-NaN slice")
+def test_vectorized_floors_match_the_per_detection_loop(with_terrain):
+    rng = np.random.default_rng(2)
+    surface = rng.uniform(100, 130, (60, 70)).astype(np.float32)
+    terrain = rng.uniform(95, 105, (60, 70)).astype(np.float32)
+    # No data and out-of-range samples, also at the tile edges
+    surface[rng.random(surface.shape) < 0.05] = np.nan
+    terrain[:3, :] = np.nan
+    surface[10:14, 20:25] = 20000
+    surface[40:, 60:] = np.nan
+    terrain[40:, 60:] = np.nan
+    if not with_terrain:
+        surface = np.where(np.isnan(terrain) | (surface >= 10000), np.nan, surface - terrain)
+
+    x_centers = np.concatenate([rng.uniform(-5, 75, 40), [0, 69, 65, 22]])
+    y_centers = np.concatenate([rng.uniform(-5, 65, 40), [0, 59, 50, 12]])
+    app = make_app()
+
+    _, floors = app.calculate_building_floors_vectorized(x_centers, y_centers, surface,
+                                                         terrain if with_terrain else None, floor_height=3.0)
+    ground = terrain if with_terrain else np.zeros_like(surface)
+    expected = [app.calculate_building_floors_from_tile_data(x, y, surface, ground, None, floor_height=3.0)
+                for x, y in zip(x_centers, y_centers)]
+
+    assert floors.tolist() == expected
+
+
+def manifest_tiles():
+    """Three tile metadata dicts as tiling produces them"""
+    tiles = []
+    for col in range(3):
+        x = 500000 + col * 50
+        tiles.append({"path": None, "tile_id": f"tile_X{x}to{x + 50}_Y3999950to4000000_A2500", "row": 0, "col": col,
+                      "bounds": (x, 3999950, x + 50, 4000000),
+                      "transform": rasterio.Affine(0.5, 0, x, 0, -0.5, 4000000),
+                      "crs": "EPSG:32633", "shape": (100, 100), "area_sqm": 2500.0, "requested_area_sqm": 2500.0})
+    return tiles
+
+
+def test_tile_manifest_resumes_finished_tiles(tmp_path):
+    path = str(tmp_path / main.TileManifest.FILENAME)
+    tiles = manifest_tiles()
+    settings = {'floor_height': 3.0, 'gsd': 0.5}
+    manifest = main.TileManifest(path)
+    manifest.replace_tiles(tiles, {'tile_area': 2500.0})
+    assert manifest.start_run(settings) is False
+
+    detections = {'class_id': np.array([0, 1]), 'floors': np.array([2, 1])}
+    for tile in tiles:
+        manifest.stage(tile)
+    manifest.record(tiles[0]['tile_id'], 'done', detections=detections)
+    manifest.record(tiles[1]['tile_id'], 'skipped', 'no_data')
+    manifest.flush()  # tiles[2] never finished (interrupted run)
+
+    resumed = main.TileManifest(path)
+    assert resumed.start_run(settings, resume=True) is True
+    assert resumed.finished_keys() == {tiles[0]['tile_id'], tiles[1]['tile_id']}
+    finished = {tile_id: (status, stored) for tile_id, _, _, _, status, _, stored in resumed.finished_tiles()}
+    status, stored = finished[tiles[0]['tile_id']]
+    assert status == 'done'
+    np.testing.assert_array_equal(stored['floors'], detections['floors'])
+    assert finished[tiles[1]['tile_id']] == ('skipped', None)
+    assert resumed.status_counts() == {'done': 1, 'skipped': 1, 'pending': 1}
+    assert [tile['tile_id'] for tile in resumed.load_tiles()] == [tile['tile_id'] for tile in tiles]
+
+
+def test_tile_manifest_resets_when_the_settings_change(tmp_path):
+    path = str(tmp_path / main.TileManifest.FILENAME)
+    tiles = manifest_tiles()
+    manifest = main.TileManifest(path)
+    manifest.replace_tiles(tiles, {'tile_area': 2500.0})
+    manifest.start_run({'floor_height': 3.0})
+    manifest.stage(tiles[0])
+    manifest.record(tiles[0]['tile_id'], 'done', detections={'class_id': np.array([0])})
+    manifest.flush()
+
+    assert manifest.start_run({'floor_height': 2.5}, resume=True) is False
+    assert manifest.finished_keys() == set()
+    assert list(manifest.finished_tiles()) == []
+    assert manifest.status_counts() == {'pending': 3}
+    # The new settings are the ones a later resume is checked against
+    assert manifest.start_run({'floor_height': 2.5}, resume=True) is True